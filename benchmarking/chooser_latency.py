@@ -0,0 +1,156 @@
+# Copyright (c) 2018 NVIDIA Corporation
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+import numpy as np
+sys.path.insert(0, "../")
+
+from milano.search_algorithms.gp.spearmint.gpei_chooser import GPEIChooser
+from milano.search_algorithms.gp.spearmint.gpeiopt_chooser import \
+  GPEIOptChooser
+from milano.search_algorithms.gp.spearmint.gpei_constrained_chooser import \
+  GPConstrainedEIChooser
+from milano.search_algorithms.gp.spearmint.sparse_gpei_chooser import \
+  SparseGPEIChooser
+from bbob_func_eval import BenchmarkGenerator
+
+
+CHOOSERS = {
+  "GPEIChooser": GPEIChooser,
+  "GPEIOptChooser": GPEIOptChooser,
+  "GPConstrainedEIChooser": GPConstrainedEIChooser,
+  "SparseGPEIChooser": SparseGPEIChooser,
+}
+
+
+def gen_study(bench_name, dim, num_observations, num_candidates,
+              num_pending, random_seed, violation_fraction=0.0):
+  """Builds the arguments of chooser's ``next()`` for a synthetic study with
+  ``num_observations`` completed points of the bbob function ``bench_name``.
+  The ``violation_fraction`` of the observations with the largest values are
+  marked as constraint violations (infinite values).
+  Returns the ``next()`` arguments and the function rescaled to the unit cube.
+  """
+  benchmarks = BenchmarkGenerator(random_seed=random_seed, dim=dim)
+  func, x_opt, f_opt = benchmarks.get_function_by_name(bench_name)
+
+  def unit_func(u):
+    return np.abs(func(u * 10.0 - 5.0) - f_opt)
+
+  grid_size = num_observations + num_candidates + num_pending
+  grid = np.random.rand(grid_size, dim)
+  values = np.zeros(grid_size) + np.inf
+  durations = np.zeros(grid_size) + np.inf
+  complete = np.arange(num_observations)
+  pending = np.arange(num_observations, num_observations + num_pending)
+  candidates = np.arange(num_observations + num_pending, grid_size)
+  values[complete] = [unit_func(u) for u in grid[complete]]
+  num_violations = int(violation_fraction * num_observations)
+  if num_violations > 0:
+    worst = np.argsort(values[complete])[-num_violations:]
+    values[complete[worst]] = np.inf
+  return (grid, values, durations, candidates, pending, complete), unit_func
+
+
+def suggest(chooser, study, batch_size):
+  """Returns ``batch_size`` points suggested by the chooser. Choosers without
+  ``next_batch()`` are called once per point, with the previously suggested
+  candidates moved to the pending points.
+  """
+  grid, values, durations, candidates, pending, complete = study
+  if batch_size > 1 and hasattr(chooser, "next_batch"):
+    job_ids = chooser.next_batch(grid, values, durations,
+                                 candidates, pending, complete, batch_size)
+  else:
+    job_ids = []
+    for _ in range(batch_size):
+      job_id = chooser.next(grid, values, durations,
+                            candidates, pending, complete)
+      job_ids.append(job_id)
+      if not isinstance(job_id, tuple):
+        candidates = candidates[candidates != job_id]
+        pending = np.append(pending, job_id)
+  return [job_id[1] if isinstance(job_id, tuple) else grid[job_id]
+          for job_id in job_ids]
+
+
+def time_chooser(chooser, study, unit_func, num_runs, trace_memory=False,
+                 batch_size=1):
+  """Asks the chooser for ``batch_size`` points ``num_runs`` times on the same
+  study and returns the per-call latencies, the function values at the
+  suggested points and the peak memory allocated during the calls in
+  megabytes (only measured if ``trace_memory`` is set, which slows the calls
+  down a little).
+  """
+  latencies, suggested_values = [], []
+  if trace_memory:
+    tracemalloc.start()
+  for _ in range(num_runs):
+    start = time.time()
+    suggested = suggest(chooser, study, batch_size)
+    latencies.append(time.time() - start)
+    suggested_values += [unit_func(point) for point in suggested]
+  peak_memory = 0.0
+  if trace_memory:
+    peak_memory = tracemalloc.get_traced_memory()[1] / 2.0**20
+    tracemalloc.stop()
+  return np.array(latencies), np.array(suggested_values), peak_memory
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    description='Measures latency of the GP choosers next() call',
+  )
+  parser.add_argument("--choosers", nargs='+', default=["GPEIChooser"],
+                      choices=sorted(CHOOSERS.keys()),
+                      help="Choosers to benchmark.")
+  parser.add_argument("--chooser_params", default="{}",
+                      help="JSON dictionary with parameters passed to all "
+                           "benchmarked choosers.")
+  parser.add_argument("--bench_name", default="sphere",
+                      help="Benchmark name, e.g. sphere, rastrigin, etc.")
+  parser.add_argument("--bench_dim", type=int, default=8,
+                      help="Benchmarking dimensionality")
+  parser.add_argument("--num_observations", type=int, default=500,
+                      help="Number of completed evaluations.")
+  parser.add_argument("--num_candidates", type=int, default=10000,
+                      help="Number of candidate grid points.")
+  parser.add_argument("--num_pending", type=int, default=0,
+                      help="Number of pending evaluations.")
+  parser.add_argument("--violation_fraction", type=float, default=0.0,
+                      help="Fraction of the completed evaluations which "
+                           "violate the constraints.")
+  parser.add_argument("--batch_size", type=int, default=1,
+                      help="Number of points suggested by every call.")
+  parser.add_argument("--num_runs", type=int, default=3,
+                      help="Number of next() calls to time.")
+  parser.add_argument("--trace_memory", action='store_true',
+                      help="Report the peak memory allocated by next().")
+  parser.add_argument("--random_seed", type=int, default=0)
+  args = parser.parse_args()
+
+  chooser_params = json.loads(args.chooser_params)
+  np.random.seed(args.random_seed)
+  study, unit_func = gen_study(
+    args.bench_name, args.bench_dim, args.num_observations,
+    args.num_candidates, args.num_pending, args.random_seed,
+    args.violation_fraction,
+  )
+  best_observed = np.min(study[1][study[5]])
+
+  for chooser_name in args.choosers:
+    np.random.seed(args.random_seed)
+    chooser = CHOOSERS[chooser_name](**chooser_params)
+    latencies, suggested_values, peak_memory = time_chooser(
+      chooser, study, unit_func, args.num_runs, args.trace_memory,
+      args.batch_size,
+    )
+    print("{}: latency mean {:.3f}s, min {:.3f}s; suggested value "
+          "mean {:.6f} (best observed {:.6f})".format(
+            chooser_name, latencies.mean(), latencies.min(),
+            suggested_values.mean(), best_observed,
+          ))
+    if args.trace_memory:
+      print("{}: peak memory {:.1f}MB".format(chooser_name, peak_memory))
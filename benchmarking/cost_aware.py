@@ -0,0 +1,104 @@
+# Copyright (c) 2018 NVIDIA Corporation
+import argparse
+import heapq
+import json
+import sys
+import numpy as np
+sys.path.insert(0, "../")
+
+from milano.search_algorithms import GPSearch
+from milano.search_algorithms.gp.spearmint.gpei_chooser import GPEIChooser
+from bbob_func_eval import BenchmarkGenerator
+
+
+def run_search(cost_aware, bench_name, dim, num_workers, budget, max_cost,
+               random_seed, search_params):
+  """Runs ``GPSearch`` with the expected improvement (or the expected
+  improvement per second if ``cost_aware`` is True) on the bbob function
+  ``bench_name`` with ``num_workers`` simulated workers, until ``budget``
+  units of time have been spent by all workers together. The duration of a
+  job grows exponentially with its first parameter (like with the size of a
+  model), from 1 to ``max_cost`` units of time. Returns the best value found
+  and the number of jobs run.
+  """
+  benchmarks = BenchmarkGenerator(random_seed=random_seed, dim=dim)
+  func, x_opt, f_opt = benchmarks.get_function_by_name(bench_name)
+  params_to_tune = {
+    "x{}".format(i): {"min": -5, "max": 5, "type": "range"}
+    for i in range(dim)
+  }
+  search_params = dict(search_params)
+  chooser_params = dict(search_params.pop("chooser_params", {}))
+  chooser_params.setdefault("noiseless", True)
+  chooser_params["cost_aware"] = cost_aware
+  search = GPSearch(params_to_tune, None, "minimize", int(budget),
+                    random_seed=random_seed + 100, chooser=GPEIChooser,
+                    chooser_params=chooser_params,
+                    num_init_jobs=num_workers, **search_params)
+
+  def cost(x):
+    return max_cost ** ((x[0] + 5.0) / 10.0)
+
+  def launch(params, now):
+    x = np.array([params["x{}".format(i)] for i in range(dim)])
+    heapq.heappush(running, (now + cost(x), id(params), params))
+
+  running, best, spent, num_jobs = [], np.inf, 0.0, 0
+  for params in search.gen_initial_params():
+    launch(params, 0.0)
+  while running and spent < budget:
+    now, _, params = heapq.heappop(running)
+    x = np.array([params["x{}".format(i)] for i in range(dim)])
+    duration = cost(x)
+    spent += duration
+    num_jobs += 1
+    result = func(x)
+    best = min(best, abs(result - f_opt))
+    params = {key: str(val) for key, val in params.items()}
+    search.record_duration(params, duration)
+    for new_params in search.gen_new_params(result, params, True):
+      if new_params is not None:
+        launch(new_params, now)
+  search.close()
+  return best, num_jobs
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    description='Compares the expected improvement with the expected '
+                'improvement per second of GPSearch on bbob functions with '
+                'simulated job durations under a fixed time budget',
+  )
+  parser.add_argument("--bench_name", default="sphere",
+                      help="Benchmark name, e.g. sphere, rastrigin, etc.")
+  parser.add_argument("--bench_dim", type=int, default=4,
+                      help="Benchmarking dimensionality")
+  parser.add_argument("--num_workers", type=int, default=1,
+                      help="Number of simulated workers.")
+  parser.add_argument("--budget", type=float, default=300,
+                      help="Total time spent by all workers.")
+  parser.add_argument("--max_cost", type=float, default=30,
+                      help="Ratio of the longest and the shortest duration.")
+  parser.add_argument("--search_params", default="{}",
+                      help="JSON dictionary of GPSearch parameters, "
+                           "chooser_params are passed to GPEIChooser.")
+  parser.add_argument("--num_runs", type=int, default=3,
+                      help="Number of runs with different random seeds.")
+  args = parser.parse_args()
+
+  search_params = json.loads(args.search_params)
+  for cost_aware in [False, True]:
+    name = "EI per second" if cost_aware else "EI"
+    bests = []
+    for seed in range(args.num_runs):
+      best, num_jobs = run_search(
+        cost_aware, args.bench_name, args.bench_dim, args.num_workers,
+        args.budget, args.max_cost, seed, search_params,
+      )
+      bests.append(best)
+      print("{} run {}: best value {:.6f} after {} jobs".format(
+        name, seed, best, num_jobs,
+      ))
+    print("{}: best value {:.6f} (median over runs {:.6f})".format(
+      name, np.mean(bests), np.median(bests),
+    ))
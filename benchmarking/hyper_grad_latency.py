@@ -0,0 +1,99 @@
+# Copyright (c) 2018 NVIDIA Corporation
+import argparse
+import sys
+import time
+import numpy as np
+sys.path.insert(0, "../")
+
+from milano.search_algorithms.gp.spearmint import gp
+from bbob_func_eval import BenchmarkGenerator
+
+
+def time_hyper_grad(covar, bench_name, dim, num_observations, num_runs,
+                    random_seed, num_restarts=1):
+  """Times the GP marginal likelihood gradient and the full
+  ``GP.optimize_hypers`` call with ``num_restarts`` starting points on
+  ``num_observations`` points of the bbob function ``bench_name``.
+  The optimization is timed both from scratch and warm-started from its
+  previous solution. Returns the mean latencies of the gradient, of the cold
+  and of the warm-started optimization in seconds, and the negative log
+  marginal likelihood that was reached.
+  """
+  benchmarks = BenchmarkGenerator(random_seed=random_seed, dim=dim)
+  func, x_opt, f_opt = benchmarks.get_function_by_name(bench_name)
+  comp = np.random.rand(num_observations, dim)
+  vals = np.array([func(u * 10.0 - 5.0) - f_opt for u in comp])
+
+  model = gp.GP(covar=covar, num_restarts=num_restarts)
+  model.real_init(dim, vals)
+  model.mean = np.mean(vals)
+  nlogprob, grad_nlogprob = model.hyper_objective(comp, vals)
+  hypers = np.zeros(dim + 2)
+  hypers[0] = np.log(np.std(vals))
+  hypers[1] = np.log(1e-3)
+
+  grad_latency = 0.0
+  for run in range(num_runs):
+    # Change the length scales so that the memoized factorization is
+    # recomputed, as it is during the optimization.
+    hypers[2:] = np.log(0.5 + 0.1 * run)
+    nlogprob(hypers)
+    start = time.time()
+    grad_nlogprob(hypers)
+    grad_latency += time.time() - start
+
+  optimize_latency = 0.0
+  for run in range(num_runs):
+    model.hypers_opt = None
+    start = time.time()
+    model.optimize_hypers(comp, vals)
+    optimize_latency += time.time() - start
+  nlp = nlogprob(model.hypers_opt)
+
+  start = time.time()
+  for run in range(num_runs):
+    model.optimize_hypers(comp, vals)
+  warm_latency = time.time() - start
+  return (grad_latency / num_runs, optimize_latency / num_runs,
+          warm_latency / num_runs, nlp)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    description='Measures latency of the GP hyperparameter optimization',
+  )
+  parser.add_argument("--covar", default="Matern52",
+                      help="Covariance function, e.g. ARDSE, Matern52.")
+  parser.add_argument("--bench_name", default="sphere",
+                      help="Benchmark name, e.g. sphere, rastrigin, etc.")
+  parser.add_argument("--bench_dims", type=int, nargs='+',
+                      default=[2, 8, 32, 64],
+                      help="Benchmarking dimensionalities")
+  parser.add_argument("--num_observations", type=int, nargs='+',
+                      default=[100, 300, 1000],
+                      help="Numbers of completed evaluations.")
+  parser.add_argument("--num_restarts", type=int, default=1,
+                      help="Maximum number of optimize_hypers restarts.")
+  parser.add_argument("--num_runs", type=int, default=3,
+                      help="Number of calls to time.")
+  parser.add_argument("--random_seed", type=int, default=0)
+  parser.add_argument("--check_observations", type=int, default=50,
+                      help="Number of points at which the gradients of all "
+                           "covariance functions are checked against finite "
+                           "differences before timing, 0 to skip the check.")
+  args = parser.parse_args()
+
+  for dim in args.bench_dims:
+    if args.check_observations > 0:
+      gp.check_grad_covars([dim], args.check_observations, args.random_seed)
+    for num_observations in args.num_observations:
+      np.random.seed(args.random_seed)
+      grad_latency, optimize_latency, warm_latency, nlp = time_hyper_grad(
+        args.covar, args.bench_name, dim, num_observations, args.num_runs,
+        args.random_seed, args.num_restarts,
+      )
+      print("D={}, n={}: gradient {:.4f}s, optimize_hypers {:.3f}s "
+            "(warm start {:.3f}s), -log likelihood {:.2f}".format(
+              dim, num_observations, grad_latency, optimize_latency,
+              warm_latency, nlp,
+            ))
@@ -0,0 +1,113 @@
+# Copyright (c) 2018 NVIDIA Corporation
+import argparse
+import heapq
+import json
+import sys
+import numpy as np
+sys.path.insert(0, "../")
+
+from milano.search_algorithms import GPSearch, MFSearch
+from bbob_func_eval import BenchmarkGenerator
+
+
+def run_search(algo, bench_name, dim, num_workers, epochs, budget,
+               random_seed, search_params):
+  """Runs ``GPSearch`` (every job trains for the full number of epochs) or
+  ``MFSearch`` (which chooses the number of epochs out of ``epochs``) on the
+  bbob function ``bench_name`` with ``num_workers`` simulated workers, until
+  ``budget`` epochs have been trained. A job trained for ``e`` out of the
+  maximal ``E`` epochs evaluates the function at the parameters shifted by
+  ``(1 - e / E)`` times a random vector of length 2, so the lower
+  fidelities are biased, and takes ``e`` units of time.
+  Returns the best value found at the full fidelity and the number of jobs
+  run at every fidelity.
+  """
+  benchmarks = BenchmarkGenerator(random_seed=random_seed, dim=dim)
+  func, x_opt, f_opt = benchmarks.get_function_by_name(bench_name)
+  rng = np.random.RandomState(random_seed)
+  shift = rng.randn(dim)
+  shift *= 2.0 / np.linalg.norm(shift)
+  params_to_tune = {
+    "x{}".format(i): {"min": -5, "max": 5, "type": "range"}
+    for i in range(dim)
+  }
+  num_evals = int(budget / epochs[0]) + num_workers
+  if algo == "MFSearch":
+    search = MFSearch(params_to_tune, None, "minimize", num_evals,
+                      random_seed=random_seed + 100,
+                      fidelity_params={
+                        "--num_epochs": {"type": "values", "values": epochs},
+                      },
+                      num_init_jobs=num_workers, **search_params)
+  else:
+    search = GPSearch(params_to_tune, None, "minimize", num_evals,
+                      random_seed=random_seed + 100,
+                      num_init_jobs=num_workers, **search_params)
+
+  def launch(params, now):
+    params = dict(params)
+    params.setdefault("--num_epochs", epochs[-1])
+    finish = now + params["--num_epochs"]
+    heapq.heappush(running, (finish, id(params), params))
+
+  running, best, spent = [], np.inf, 0.0
+  counts = {epoch: 0 for epoch in epochs}
+  for params in search.gen_initial_params():
+    launch(params, 0.0)
+  while running and spent < budget:
+    now, _, params = heapq.heappop(running)
+    num_epochs = params["--num_epochs"]
+    spent += num_epochs
+    counts[num_epochs] += 1
+    x = np.array([params["x{}".format(i)] for i in range(dim)])
+    result = func(x + (1.0 - num_epochs / epochs[-1]) * shift)
+    if num_epochs == epochs[-1]:
+      best = min(best, abs(result - f_opt))
+    if algo != "MFSearch":
+      del params["--num_epochs"]
+    new_params = search.gen_new_params(
+      result, {key: str(val) for key, val in params.items()}, True,
+    )
+    for params in new_params:
+      if params is not None:
+        launch(params, now)
+  search.close()
+  return best, counts
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    description='Compares MFSearch with GPSearch on bbob functions with a '
+                'simulated number of epochs as the fidelity',
+  )
+  parser.add_argument("--bench_name", default="sphere",
+                      help="Benchmark name, e.g. sphere, rastrigin, etc.")
+  parser.add_argument("--bench_dim", type=int, default=4,
+                      help="Benchmarking dimensionality")
+  parser.add_argument("--num_workers", type=int, default=1,
+                      help="Number of simulated workers.")
+  parser.add_argument("--epochs", type=int, nargs='+', default=[1, 3, 9, 27],
+                      help="Numbers of epochs MFSearch can choose from, "
+                           "GPSearch always uses the last one.")
+  parser.add_argument("--budget", type=float, default=1080,
+                      help="Total number of epochs to train.")
+  parser.add_argument("--search_params", default="{}",
+                      help="JSON dictionary mapping algorithm names to "
+                           "dictionaries of their parameters.")
+  parser.add_argument("--num_runs", type=int, default=3,
+                      help="Number of runs with different random seeds.")
+  args = parser.parse_args()
+
+  search_params = json.loads(args.search_params)
+  for algo in ["GPSearch", "MFSearch"]:
+    bests = []
+    for seed in range(args.num_runs):
+      best, counts = run_search(
+        algo, args.bench_name, args.bench_dim, args.num_workers, args.epochs,
+        args.budget, seed, search_params.get(algo, {}),
+      )
+      bests.append(best)
+      print("{} run {}: best full fidelity value {:.6f}, jobs per number of "
+            "epochs {}".format(algo, seed, best, counts))
+    print("{}: best full fidelity value {:.6f} (median over runs {:.6f})"
+          .format(algo, np.mean(bests), np.median(bests)))
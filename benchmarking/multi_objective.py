@@ -0,0 +1,130 @@
+# Copyright (c) 2018 NVIDIA Corporation
+import argparse
+import json
+import sys
+import numpy as np
+sys.path.insert(0, "../")
+
+import milano.search_algorithms
+from milano.pareto import ParetoFront
+from bbob_func_eval import BenchmarkGenerator
+
+
+def hypervolume(points, reference):
+  """Returns the area dominated by the 2-dimensional ``points`` (all
+  objectives minimized) and bounded by ``reference``.
+  """
+  front = ParetoFront()
+  for point in points:
+    if np.all(point < reference):
+      front.add(point)
+  area, prev_y = 0.0, reference[1]
+  for x, y in sorted(front.points, key=lambda point: point[0]):
+    area += (reference[0] - x) * (prev_y - y)
+    prev_y = y
+  return area
+
+
+def run_search(algo_name, funcs, dim, num_workers, num_evals, random_seed,
+               search_params):
+  """Runs the search algorithm ``algo_name`` on the objectives ``funcs``
+  with ``num_workers`` simulated workers, the same way as
+  ``search_efficiency.py``. With ``objective_id`` in ``search_params`` a
+  single-objective algorithm optimizes only that objective. Returns the
+  values of all objectives at all evaluated points.
+  """
+  rng = np.random.RandomState(random_seed)
+  params_to_tune = {
+    "x{}".format(i): {"min": -5, "max": 5, "type": "range"}
+    for i in range(dim)
+  }
+  search_params = dict(search_params)
+  objective_id = search_params.pop("objective_id", None)
+  objective = ["minimize"] * len(funcs)
+  if objective_id is not None:
+    objective = "minimize"
+  search = getattr(milano.search_algorithms, algo_name)(
+    params_to_tune, None, objective, num_evals,
+    random_seed=random_seed + 100, **search_params
+  )
+
+  running, points = list(search.gen_initial_params()), []
+  while running:
+    params = running.pop(rng.randint(len(running)))
+    x = np.array([float(params["x{}".format(i)]) for i in range(dim)])
+    values = tuple(func(x) for func in funcs)
+    points.append(values)
+    result = values if objective_id is None else values[objective_id]
+    new_params = search.gen_new_params(
+      result, {key: str(val) for key, val in params.items()}, True,
+    )
+    running += [params for params in new_params if params is not None]
+  search.close()
+  return np.array(points)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    description='Compares multi-objective search algorithms with separate '
+                'single-objective studies on pairs of bbob functions',
+  )
+  parser.add_argument("--algorithms", nargs='+',
+                      default=["RandomSearch", "ParEGOSearch"],
+                      help="Names of the multi-objective search algorithms "
+                           "to compare.")
+  parser.add_argument("--single_objective", default="GPSearch",
+                      help="Name of the search algorithm that is run once "
+                           "for every objective with half of the "
+                           "evaluations, empty to skip it.")
+  parser.add_argument("--search_params", default="{}",
+                      help="JSON dictionary mapping algorithm names to "
+                           "dictionaries of their parameters.")
+  parser.add_argument("--bench_names", nargs=2, default=["sphere", "sphere"],
+                      help="Benchmark names of the two objectives, their "
+                           "optima are different.")
+  parser.add_argument("--bench_dim", type=int, default=4,
+                      help="Benchmarking dimensionality")
+  parser.add_argument("--num_workers", type=int, default=1,
+                      help="Number of simulated workers.")
+  parser.add_argument("--num_evals", type=int, default=100,
+                      help="Number of function evaluations.")
+  parser.add_argument("--num_runs", type=int, default=3,
+                      help="Number of runs with different random seeds.")
+  args = parser.parse_args()
+
+  search_params = json.loads(args.search_params)
+  names = list(args.algorithms)
+  if args.single_objective:
+    names.append("2x " + args.single_objective)
+  volumes = {name: [] for name in names}
+  for seed in range(args.num_runs):
+    funcs = []
+    for i, bench_name in enumerate(args.bench_names):
+      benchmarks = BenchmarkGenerator(random_seed=2 * seed + i,
+                                      dim=args.bench_dim)
+      func, x_opt, f_opt = benchmarks.get_function_by_name(bench_name)
+      funcs.append(lambda x, func=func, f_opt=f_opt: func(x) - f_opt)
+    # the reference point is the median of random points in every objective,
+    # the volumes are fractions of the box between 0 and it
+    random_x = np.random.RandomState(seed).uniform(
+      -5, 5, (1000, args.bench_dim),
+    )
+    reference = np.median([[func(x) for func in funcs] for x in random_x],
+                          axis=0)
+    for name in names:
+      if name in args.algorithms:
+        points = run_search(name, funcs, args.bench_dim, args.num_workers,
+                            args.num_evals, seed, search_params.get(name, {}))
+      else:
+        points = np.vstack([run_search(
+          args.single_objective, funcs, args.bench_dim, args.num_workers,
+          args.num_evals // len(funcs), seed,
+          dict(search_params.get(args.single_objective, {}), objective_id=i),
+        ) for i in range(len(funcs))])
+      volume = hypervolume(points, reference) / np.prod(reference)
+      volumes[name].append(volume)
+      print("{} run {}: hypervolume {:.4f}".format(name, seed, volume))
+  for name in names:
+    print("{}: hypervolume {:.4f} (median over runs {:.4f})".format(
+      name, np.mean(volumes[name]), np.median(volumes[name]),
+    ))
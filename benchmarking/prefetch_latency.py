@@ -0,0 +1,109 @@
+# Copyright (c) 2018 NVIDIA Corporation
+import argparse
+import heapq
+import json
+import sys
+import time
+import numpy as np
+sys.path.insert(0, "../")
+
+from milano.search_algorithms import GPSearch
+from bbob_func_eval import BenchmarkGenerator
+
+
+def run_search(bench_name, dim, num_workers, num_evals, job_time,
+               random_seed, search_params, batch_results=False):
+  """Runs ``GPSearch`` on the bbob function ``bench_name`` with
+  ``num_workers`` simulated workers. Every job takes ``job_time`` seconds
+  on average (uniformly distributed between half and one and a half of it)
+  and the workers wait while ``gen_new_params`` computes their next job.
+  If ``batch_results`` is True, all jobs that have finished by the time a
+  result is processed are passed to a single ``gen_new_params_batch`` call.
+  Returns the ``gen_new_params`` latencies and the best value found.
+  """
+  benchmarks = BenchmarkGenerator(random_seed=random_seed, dim=dim)
+  func, x_opt, f_opt = benchmarks.get_function_by_name(bench_name)
+  params_to_tune = {
+    "x{}".format(i): {"min": -5, "max": 5, "type": "range"}
+    for i in range(dim)
+  }
+  search = GPSearch(params_to_tune, None, "minimize", num_evals,
+                    random_seed=random_seed, num_init_jobs=num_workers,
+                    **search_params)
+  rng = np.random.RandomState(random_seed)
+
+  def launch(params, now):
+    finish = now + job_time * rng.uniform(0.5, 1.5)
+    heapq.heappush(running, (finish, id(params), params))
+
+  running, latencies, best = [], [], np.inf
+  start = time.time()
+  for params in search.gen_initial_params():
+    launch(params, start)
+  while running:
+    finish, _, params = heapq.heappop(running)
+    time.sleep(max(0.0, finish - time.time()))
+    finished = [params]
+    while batch_results and running and running[0][0] <= time.time():
+      finished.append(heapq.heappop(running)[2])
+    results = []
+    for params in finished:
+      result = func(np.array([params["x{}".format(i)] for i in range(dim)]))
+      best = min(best, abs(result - f_opt))
+      results.append(
+        (result, {key: str(val) for key, val in params.items()}, True),
+      )
+    call_start = time.time()
+    if batch_results:
+      new_params = search.gen_new_params_batch(results)
+    else:
+      new_params = search.gen_new_params(*results[0])
+    latencies.append(time.time() - call_start)
+    for params in new_params:
+      if params is not None:
+        launch(params, time.time())
+  search.close()
+  return latencies, best
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    description='Measures how long the workers wait for GPSearch suggestions',
+  )
+  parser.add_argument("--search_params", default="{}",
+                      help="JSON dictionary of GPSearch parameters.")
+  parser.add_argument("--bench_name", default="sphere",
+                      help="Benchmark name, e.g. sphere, rastrigin, etc.")
+  parser.add_argument("--bench_dim", type=int, default=4,
+                      help="Benchmarking dimensionality")
+  parser.add_argument("--num_workers", type=int, default=4,
+                      help="Number of simulated workers.")
+  parser.add_argument("--num_evals", type=int, default=50,
+                      help="Number of function evaluations.")
+  parser.add_argument("--job_time", type=float, default=2.0,
+                      help="Mean duration of a job in seconds.")
+  parser.add_argument("--random_seed", type=int, default=0)
+  parser.add_argument("--batch_results", action='store_true',
+                      help="Compare one gen_new_params call per result with "
+                           "one gen_new_params_batch call for all finished "
+                           "jobs instead of comparing prefetch modes.")
+  args = parser.parse_args()
+
+  if args.batch_results:
+    modes = [("batch_results", False), ("batch_results", True)]
+  else:
+    modes = [("prefetch", False), ("prefetch", True)]
+  for name, value in modes:
+    search_params = json.loads(args.search_params)
+    if name == "prefetch":
+      search_params["prefetch"] = value
+    np.random.seed(args.random_seed)
+    latencies, best = run_search(
+      args.bench_name, args.bench_dim, args.num_workers, args.num_evals,
+      args.job_time, args.random_seed, search_params,
+      batch_results=(name == "batch_results" and value),
+    )
+    print("{}={}: {} calls, gen_new_params latency mean {:.3f}s, "
+          "max {:.3f}s, total {:.1f}s; best value {:.6f}".format(
+            name, value, len(latencies), np.mean(latencies),
+            np.max(latencies), np.sum(latencies), best))
@@ -0,0 +1,113 @@
+# Copyright (c) 2018 NVIDIA Corporation
+import argparse
+import importlib
+import json
+import sys
+import time
+import numpy as np
+sys.path.insert(0, "../")
+
+import milano.search_algorithms
+from bbob_func_eval import BenchmarkGenerator
+
+
+def run_search(algo_name, bench_name, dim, num_workers, num_evals,
+               random_seed, search_params, num_values=0):
+  """Runs the search algorithm ``algo_name`` on the bbob function
+  ``bench_name`` in-process with ``num_workers`` simulated workers. Every
+  time a randomly chosen running job finishes, its result is passed to
+  ``gen_new_params`` the same way ``ExecutionManager`` does. With positive
+  ``num_values`` the parameters are "values" parameters with that many
+  shuffled values instead of "range" parameters.
+  Returns the ``gen_new_params`` latencies and the best value found.
+  """
+  benchmarks = BenchmarkGenerator(random_seed=random_seed, dim=dim)
+  func, x_opt, f_opt = benchmarks.get_function_by_name(bench_name)
+  rng = np.random.RandomState(random_seed)
+  if num_values > 0:
+    params_to_tune = {
+      "x{}".format(i): {
+        "type": "values",
+        "values": rng.permutation(np.linspace(-5, 5, num_values)).tolist(),
+      } for i in range(dim)
+    }
+  else:
+    params_to_tune = {
+      "x{}".format(i): {"min": -5, "max": 5, "type": "range"}
+      for i in range(dim)
+    }
+  # the search reseeds the global generator, so it can't use the same seed
+  # or it would sample x_opt first
+  search = getattr(milano.search_algorithms, algo_name)(
+    params_to_tune, None, "minimize", num_evals,
+    random_seed=random_seed + 100, **search_params
+  )
+
+  running, latencies, best = list(search.gen_initial_params()), [], np.inf
+  while running:
+    params = running.pop(rng.randint(len(running)))
+    result = func(np.array([float(params["x{}".format(i)])
+                            for i in range(dim)]))
+    best = min(best, abs(result - f_opt))
+    call_start = time.time()
+    new_params = search.gen_new_params(
+      result, {key: str(val) for key, val in params.items()}, True,
+    )
+    latencies.append(time.time() - call_start)
+    running += [params for params in new_params if params is not None]
+  search.close()
+  return latencies, best
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    description='Compares sample efficiency and suggestion latency of '
+                'search algorithms on bbob functions without a backend',
+  )
+  parser.add_argument("--algorithms", nargs='+', default=["RandomSearch"],
+                      help="Names of the search algorithms to compare, "
+                           "e.g. TPESearch GPSearch")
+  parser.add_argument("--search_params", default="{}",
+                      help="JSON dictionary mapping algorithm names to "
+                           "dictionaries of their parameters. \"chooser\" "
+                           "is given by its full class name.")
+  parser.add_argument("--bench_name", default="sphere",
+                      help="Benchmark name, e.g. sphere, rastrigin, etc.")
+  parser.add_argument("--bench_dim", type=int, default=4,
+                      help="Benchmarking dimensionality")
+  parser.add_argument("--num_workers", type=int, default=1,
+                      help="Number of simulated workers.")
+  parser.add_argument("--num_evals", type=int, default=100,
+                      help="Number of function evaluations.")
+  parser.add_argument("--num_values", type=int, default=0,
+                      help="If positive, every parameter is a \"values\" "
+                           "parameter with that many values in random "
+                           "order, which simulates categorical parameters.")
+  parser.add_argument("--num_runs", type=int, default=3,
+                      help="Number of runs with different random seeds.")
+  args = parser.parse_args()
+
+  search_params = json.loads(args.search_params)
+  # choosers of GPSearch are given by their full class names
+  for params in search_params.values():
+    if "chooser" in params:
+      module_name, class_name = params["chooser"].rsplit(".", 1)
+      params["chooser"] = getattr(importlib.import_module(module_name),
+                                  class_name)
+  for algo_name in args.algorithms:
+    bests, latencies = [], []
+    for seed in range(args.num_runs):
+      params = dict(search_params.get(algo_name, {}))
+      params.setdefault("num_init_jobs", args.num_workers)
+      if algo_name == "RandomSearch":
+        params.pop("num_init_jobs")
+      cur_latencies, best = run_search(
+        algo_name, args.bench_name, args.bench_dim, args.num_workers,
+        args.num_evals, seed, params, args.num_values,
+      )
+      bests.append(best)
+      latencies += cur_latencies
+    print("{}: best value {:.6f} (median over runs {:.6f}), gen_new_params "
+          "latency mean {:.4f}s, max {:.4f}s".format(
+            algo_name, np.mean(bests), np.median(bests),
+            np.mean(latencies), np.max(latencies)))
@@ -0,0 +1,110 @@
+# Copyright (c) 2018 NVIDIA Corporation
+import argparse
+import json
+import os
+import sys
+import tempfile
+import numpy as np
+import pandas as pd
+sys.path.insert(0, "../")
+
+from milano.search_algorithms import GPSearch
+from bbob_func_eval import BenchmarkGenerator
+
+
+def run_search(func, dim, num_evals, random_seed, search_params):
+  """Runs ``GPSearch`` on ``func`` with a single simulated worker and
+  returns the evaluated parameters and results in the order they were
+  evaluated.
+  """
+  params_to_tune = {
+    "x{}".format(i): {"min": -5, "max": 5, "type": "range"}
+    for i in range(dim)
+  }
+  search = GPSearch(params_to_tune, None, "minimize", num_evals,
+                    random_seed=random_seed + 100, **search_params)
+  running, history = list(search.gen_initial_params()), []
+  while running:
+    params = {key: str(val) for key, val in running.pop(0).items()}
+    result = func(np.array([float(params["x{}".format(i)])
+                            for i in range(dim)]))
+    history.append((result, params))
+    new_params = search.gen_new_params(result, params, True)
+    running += [params for params in new_params if params is not None]
+  search.close()
+  return history
+
+
+def write_results_file(history, path):
+  """Saves ``history`` the same way ``ExecutionManager`` does."""
+  pd.DataFrame(
+    data=[(result, " ".join("{}={}".format(key, val)
+                            for key, val in params.items()),
+           "Job succeeded", np.nan, job_id + 1)
+          for job_id, (result, params) in enumerate(sorted(
+            history, key=lambda item: item[0],
+          ))],
+    columns=["Result:", "params", "status", "duration", "job_id"],
+  ).to_csv(path)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(
+    description='Compares GPSearch with and without warm start from a '
+                'previous study of a related bbob function',
+  )
+  parser.add_argument("--bench_name", default="sphere",
+                      help="Benchmark name, e.g. sphere, rastrigin, etc.")
+  parser.add_argument("--bench_dim", type=int, default=4,
+                      help="Benchmarking dimensionality")
+  parser.add_argument("--num_prior_evals", type=int, default=50,
+                      help="Number of function evaluations of the previous "
+                           "study.")
+  parser.add_argument("--shift", type=float, default=0.5,
+                      help="Distance between the optima of the previous "
+                           "and the new function.")
+  parser.add_argument("--num_evals", type=int, default=20,
+                      help="Number of function evaluations of the new "
+                           "study.")
+  parser.add_argument("--search_params", default="{}",
+                      help="JSON dictionary of GPSearch parameters.")
+  parser.add_argument("--num_runs", type=int, default=3,
+                      help="Number of runs with different random seeds.")
+  args = parser.parse_args()
+
+  search_params = json.loads(args.search_params)
+  checkpoints = sorted({max(args.num_evals // 4, 1),
+                        max(args.num_evals // 2, 1), args.num_evals})
+  bests = {"cold": [], "warm": []}
+  for seed in range(args.num_runs):
+    benchmarks = BenchmarkGenerator(random_seed=seed, dim=args.bench_dim)
+    func, x_opt, f_opt = benchmarks.get_function_by_name(args.bench_name)
+    # the previous study optimized a shifted and rescaled function
+    shift = np.random.RandomState(seed).randn(args.bench_dim)
+    shift *= args.shift / np.linalg.norm(shift)
+    prior_history = run_search(
+      lambda x: 3.0 * func(x + shift) + 10.0, args.bench_dim,
+      args.num_prior_evals, seed + 1, search_params,
+    )
+    with tempfile.TemporaryDirectory() as tmp_dir:
+      prior_file = os.path.join(tmp_dir, "results.csv")
+      write_results_file(prior_history, prior_file)
+      for name in ["cold", "warm"]:
+        cur_params = dict(search_params)
+        if name == "warm":
+          cur_params["prior_results_files"] = [prior_file]
+        history = run_search(func, args.bench_dim, args.num_evals, seed,
+                             cur_params)
+        errors = np.minimum.accumulate(
+          [abs(result - f_opt) for result, _ in history],
+        )
+        bests[name].append([errors[num - 1] for num in checkpoints])
+        print("{} start run {}: best value after {} evaluations: {}".format(
+          name, seed, checkpoints,
+          ", ".join("{:.4f}".format(errors[num - 1]) for num in checkpoints),
+        ))
+  for name in ["cold", "warm"]:
+    print("{} start: mean best value after {} evaluations: {}".format(
+      name, checkpoints,
+      ", ".join("{:.4f}".format(val) for val in np.mean(bests[name], axis=0)),
+    ))
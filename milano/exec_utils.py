@@ -3,28 +3,44 @@ import asyncio
 import numpy as np
 import pandas as pd
 import re
+import time
 import traceback
-from typing import Iterable, Mapping, Any, Tuple, Optional
+from typing import Iterable, Mapping, Any, Tuple, Optional, Union
 
 from .backends.base import Backend, JobStatus, RetrievingJobLogsError, \
                            IsWorkerAvailableError, GettingJobStatusError, \
                            KillingJobError, LaunchingJobError
 from .search_algorithms.base import SearchAlgorithm
+from .pareto import ParetoFront
 
 
 class ExecutionManager:
   def __init__(self,
                backend_manager: Backend,
                search_algorithm: SearchAlgorithm,
-               res_pattern: str,
-               objective: str,
+               res_pattern: Union[str, Iterable[str]],
+               objective: Union[str, Iterable[str]],
                constraints: Iterable[Mapping[str, Any]],
                output_file: str = None,
                verbose=0,
                sleep_time=5,
                wait_for_logs_time=10,
                max_retries=5) -> None:
-    self._res_pattern = res_pattern
+    # with several result patterns every one of them is an objective with
+    # its own direction, the first one is used for early stopping
+    if isinstance(res_pattern, str):
+      res_pattern = [res_pattern]
+    if isinstance(objective, str):
+      objective = [objective]
+    if len(objective) != len(res_pattern):
+      raise ValueError(
+        "{} objectives were provided for {} result patterns".format(
+          len(objective), len(res_pattern),
+        )
+      )
+    self._res_patterns = list(res_pattern)
+    self._res_pattern = self._res_patterns[0]
+    self._multi_objective = len(self._res_patterns) > 1
     self._search_algorithm = search_algorithm
     self._backend_manager = backend_manager
     self._num_workers = self._backend_manager.num_workers
@@ -34,31 +50,65 @@ class ExecutionManager:
     self._sleep_time = sleep_time
     self._wait_for_logs_time = wait_for_logs_time
     self._max_retries = max_retries
-    if objective.lower() not in ["minimize", "maximize"]:
-      raise ValueError(
-        'Objective has to be "minimize" or "maximize", '
-        'but "{}" was provided'.format(objective)
-      )
-    self._objective = objective.lower()
-    if self._objective == "minimize":
+    for cur_objective in objective:
+      if cur_objective.lower() not in ["minimize", "maximize"]:
+        raise ValueError(
+          'Objective has to be "minimize" or "maximize", '
+          'but "{}" was provided'.format(cur_objective)
+        )
+    self._objectives = [cur_objective.lower() for cur_objective in objective]
+    self._objective = self._objectives[0]
+    # multiplying the results by the signs makes all objectives minimized
+    self._signs = np.array([1.0 if cur_objective == "minimize" else -1.0
+                            for cur_objective in self._objectives])
+    if self._multi_objective:
+      self._failure_score = tuple(self._signs * np.inf)
+    elif self._objective == "minimize":
       self._failure_score = np.inf
     else:
       self._failure_score = -np.inf
+    self.pareto_front = ParetoFront()
     self.final_results = None
     self._cnt = 0
 
-  def _parse_result(self, log: str) -> Optional[float]:
+  def _parse_result(self, log: str) -> Optional[Union[float, Tuple[float]]]:
     """This method takes a log string and parses it to produce resulting float.
     More precisely it looks for the last occurrence of ``self._res_pattern``
     in the log file and takes the float which supposed to be present right after
     the sought pattern. If no pattern was found, None is returned.
+    With several result patterns the tuple of the floats found after each of
+    them is returned, or None if any of them was not found.
     """
-    res_pos = log.rfind(self._res_pattern)
-    # -1 means the res_pattern is not found, returning None
-    if res_pos == -1:
-      return None
-    res_pos += len(self._res_pattern)
-    return float(log[res_pos:].split(maxsplit=1)[0])
+    results = []
+    for res_pattern in self._res_patterns:
+      res_pos = log.rfind(res_pattern)
+      # -1 means the res_pattern is not found, returning None
+      if res_pos == -1:
+        return None
+      res_pos += len(res_pattern)
+      results.append(float(log[res_pos:].split(maxsplit=1)[0]))
+    if self._multi_objective:
+      return tuple(results)
+    return results[0]
+
+  def _parse_intermediate_results(self, log: str) -> Iterable[float]:
+    """This method returns the floats found right after every occurrence of
+    ``self._res_pattern`` in the log, skipping the ones that can't be parsed.
+    """
+    results = []
+    res_pos = log.find(self._res_pattern)
+    while res_pos != -1:
+      res_pos += len(self._res_pattern)
+      try:
+        results.append(float(log[res_pos:].split(maxsplit=1)[0]))
+      except (ValueError, IndexError):
+        pass
+      res_pos = log.find(self._res_pattern, res_pos)
+    return results
+
+  @staticmethod
+  def _params_to_dict(job_params: str) -> Mapping[str, str]:
+    return dict([arg_val.split('=') for arg_val in job_params.split()])
 
   def _check_constraints(self, log: str) -> bool:
     """This method returns True if all constraints are satisfied
@@ -128,18 +178,9 @@ class ExecutionManager:
       log = None
     if log is not None:
       if not self._check_constraints(log):
-        for i in range(self._max_retries):
-          try:
-            self._backend_manager.kill_job(job_info)
-            break
-          except KillingJobError as e:
-            if i == self._max_retries - 1:
-              if self._verbose > 1:
-                print('Could not kill job "{}" on worker {}: {}'.format(
-                  job_params, worker_id, e.message,
-                ))
-              # continuing execution, since worker can't become available
-              return None, None
+        if not self._kill_job(job_info, job_params, worker_id):
+          # continuing execution, since worker can't become available
+          return None, None
 
         result = self._failure_score
         job_status = "Some constraints are not satisfied"
@@ -148,8 +189,47 @@ class ExecutionManager:
             'Killed job "{}" on worker {}: constraints are not satisfied'
             .format(job_params, worker_id)
           )
+        return job_status, result
+
+      # search algorithm can stop the job based on its intermediate results
+      intermediate_results = self._parse_intermediate_results(log)
+      if intermediate_results and self._search_algorithm.should_stop(
+        self._params_to_dict(job_params), intermediate_results,
+      ):
+        if not self._kill_job(job_info, job_params, worker_id):
+          return None, None
+
+        result = intermediate_results[-1]
+        if self._multi_objective:
+          result = self._parse_result(log)
+          if result is None:
+            result = self._failure_score
+        job_status = "Job stopped early"
+        if self._verbose > 1:
+          print('Stopped job "{}" on worker {} with {} {}'.format(
+            job_params, worker_id, self._res_pattern, result,
+          ))
     return job_status, result
 
+  def _kill_job(self,
+                job_info: object,
+                job_params: str,
+                worker_id: int) -> bool:
+    """Helper function that kills the job, retrying a few times.
+    Returns whether the job was killed.
+    """
+    for i in range(self._max_retries):
+      try:
+        self._backend_manager.kill_job(job_info)
+        return True
+      except KillingJobError as e:
+        if i == self._max_retries - 1:
+          if self._verbose > 1:
+            print('Could not kill job "{}" on worker {}: {}'.format(
+              job_params, worker_id, e.message,
+            ))
+    return False
+
   async def _handle_succeeded_job(self,
                                   job_info: object,
                                   job_params: str,
@@ -174,12 +254,13 @@ class ExecutionManager:
     # log was successfully retrieved, trying to parse results
     result = self._parse_result(log)
     if result is None:
+      res_patterns = ", ".join(self._res_patterns)
       if self._verbose > 1:
         print('"{}" was not found in log for job {} on worker {}'.format(
-          self._res_pattern, job_params, worker_id,
+          res_patterns, job_params, worker_id,
         ))
       return (
-        "Job failed: {} was not found in job's log".format(self._res_pattern),
+        "Job failed: {} was not found in job's log".format(res_patterns),
         self._failure_score
       )
 
@@ -192,7 +273,7 @@ class ExecutionManager:
     # everything is correct, returning result
     if self._verbose > 1:
       print("Got {} {} for job \"{}\" on worker {}".format(
-        self._res_pattern, result, job_params, worker_id,
+        ", ".join(self._res_patterns), result, job_params, worker_id,
       ))
     return "Job succeeded", result
 
@@ -220,6 +301,10 @@ class ExecutionManager:
     searching for the ``self._res_pattern``. In case of
     failure or when ``self._res_pattern`` was not found in job log, result is
     equal to ``np.inf`` (or ``-np.inf``, depending on the objective).
+    The wall time of the job in seconds, from the last time it was seen
+    pending on the backend until its final status, is pushed as the fourth
+    element of the tuple (``np.nan`` if the job was never started). It is
+    only accurate up to sleep_time.
     """
     # making the function exception-safe, since they are not going to
     # be handled or stop execution of the main program flow
@@ -238,8 +323,10 @@ class ExecutionManager:
               self._cnt += 1
               print("Processed {} jobs".format(self._cnt), end="\r")
             await results_queue.put((self._failure_score, job_params,
-                                     "Job failed: can't launch job on backend"))
+                                     "Job failed: can't launch job on backend",
+                                     np.nan))
             return
+      start_time = time.time()
 
       if self._verbose > 1:
         print("Started job \"{}\" on worker {}".format(job_params, worker_id))
@@ -258,6 +345,9 @@ class ExecutionManager:
                   job_params, worker_id, e.message,
                 ))
 
+        if status == JobStatus.PENDING:
+          # waiting in the backend's queue doesn't count towards duration
+          start_time = time.time()
         if status == JobStatus.RUNNING or status == JobStatus.PENDING:
           job_status, result = await self._handle_running_job(
             job_info, job_params, worker_id,
@@ -280,7 +370,8 @@ class ExecutionManager:
         if self._verbose == 1:
           self._cnt += 1
           print("Processed {} jobs".format(self._cnt), end="\r")
-        await results_queue.put((result, job_params, job_status))
+        await results_queue.put((result, job_params, job_status,
+                                 time.time() - start_time))
         return
     except Exception as e:
       if self._verbose > 1:
@@ -292,7 +383,7 @@ class ExecutionManager:
         self._cnt += 1
         print("Processed {} jobs".format(self._cnt), end="\r")
       await results_queue.put((self._failure_score, job_params,
-                               "Job failed: unhandled exception"))
+                               "Job failed: unhandled exception", np.nan))
 
   async def _process_jobs(self,
                           jobs_queue: asyncio.Queue,
@@ -336,10 +427,16 @@ class ExecutionManager:
     ``self._search_algorithm.gen_initial_jobs()`` and pushes all of them to the
     ``jobs_queue``. It then enters the loop until it gets None from the
     ``results_queue``. On each iteration of the loop it will wait for the new
-     result to appear in the results_queue and ask the
-    ``self._search_algorithm`` to generate new jobs based on the last result
-    retrieved using ``self._search_algorithm.gen_new_jobs``. It will then push
+     result to appear in the results_queue, take all other results that are
+    already available and ask the ``self._search_algorithm`` to generate new
+    jobs based on them using
+    ``self._search_algorithm.gen_new_params_batch``, after passing the
+    durations of the finished jobs to
+    ``self._search_algorithm.record_duration`` and the jobs that were stopped
+    early to ``self._search_algorithm.record_early_stop``. It will then push
     all new jobs into the ``jobs_queue`` and save the current ``results.csv``.
+    With several objectives the results are tuples and the jobs that aren't
+    dominated by any other job are kept in ``self.pareto_front``.
     """
     init_jobs = self._search_algorithm.gen_initial_params()
     for job_params in init_jobs:
@@ -347,47 +444,94 @@ class ExecutionManager:
 
     results = []
     cnt = 0
-    while True:
-      result_tuple = await results_queue.get()
-      if result_tuple is None:
+    finished = False
+    while not finished:
+      result_tuples = [await results_queue.get()]
+      while not results_queue.empty():
+        result_tuples.append(results_queue.get_nowait())
+      if None in result_tuples:
+        finished = True
+        result_tuples = result_tuples[:result_tuples.index(None)]
+      if not result_tuples:
         break
-      cnt += 1
-      results.append(result_tuple + (cnt,))
-      new_jobs = self._search_algorithm.gen_new_params(
-        result=result_tuple[0],
-        params=dict([arg_val.split('=') for arg_val in result_tuple[1].split()]),
-        evaluation_succeeded=(not result_tuple[2].startswith("Job failed"))
-      )
+      new_results = []
+      for result_tuple in result_tuples:
+        cnt += 1
+        results.append(result_tuple + (cnt,))
+        if (self._multi_objective and
+            not result_tuple[2].startswith("Job failed")):
+          self.pareto_front.add(self._signs * result_tuple[0], cnt)
+        params = self._params_to_dict(result_tuple[1])
+        if not np.isnan(result_tuple[3]):
+          self._search_algorithm.record_duration(params, result_tuple[3])
+        if result_tuple[2] == "Job stopped early":
+          self._search_algorithm.record_early_stop(params)
+        new_results.append((
+          result_tuple[0],
+          params,
+          not result_tuple[2].startswith("Job failed"),
+        ))
+      new_jobs = self._search_algorithm.gen_new_params_batch(new_results)
       for job_params in new_jobs:
         await jobs_queue.put(job_params)
 
-      if self._objective == "minimize":
-        sorted_results = sorted(results)
-      else:
-        sorted_results = sorted(results, reverse=True)
-
+      sorted_results = self._sort_results(results)
       if self._output_file:
-        pd.DataFrame(
-          data=sorted_results,
-          columns=[self._res_pattern, "params", "status", "job_id"],
-        ).to_csv(self._output_file)
+        self._results_to_frame(sorted_results).to_csv(self._output_file)
 
-    if self._verbose > 1:
+    if self._verbose > 1 and self._multi_objective:
+      print(
+        "\nPareto front:\n    {}".format(
+          "\n    ".join(["{} for job \"{}\"".format(
+            ", ".join("{} {}".format(res_pattern, cur_value) for
+                      res_pattern, cur_value in zip(self._res_patterns, value)),
+            cmd,
+          ) for value, cmd, status, duration, job_id in
+            sorted_results[:len(self.pareto_front)]])
+        )
+      )
+    elif self._verbose > 1:
       print(
         "\nTop-10 parameters:\n    {}".format(
           "\n    ".join(["{} {} for job \"{}\"".format(
             self._res_pattern, value, cmd,
-          ) for value, cmd, status, job_id in sorted_results[:10]])
+          ) for value, cmd, status, duration, job_id in sorted_results[:10]])
         )
       )
-    self.final_results = pd.DataFrame(
-      data=sorted_results,
-      columns=[self._res_pattern, "params", "status", "job_id"],
+    self.final_results = self._results_to_frame(sorted_results)
+
+  def _sort_results(self, results):
+    """Sorts the results from the best one. With several objectives the jobs
+    on the Pareto front come first, followed by all other jobs, both sorted
+    by the first objective.
+    """
+    if not self._multi_objective:
+      return sorted(results, reverse=self._objective == "maximize")
+    return sorted(results, key=lambda result: (
+      result[-1] not in self.pareto_front, self._signs[0] * result[0][0],
+    ))
+
+  def _results_to_frame(self, sorted_results) -> pd.DataFrame:
+    """Converts the sorted results to the results table. With several
+    objectives there is a column for every objective and a "pareto_optimal"
+    column.
+    """
+    if not self._multi_objective:
+      return pd.DataFrame(
+        data=sorted_results,
+        columns=[self._res_pattern, "params", "status", "duration", "job_id"],
+      )
+    return pd.DataFrame(
+      data=[tuple(result[0]) + result[1:] + (result[-1] in self.pareto_front,)
+            for result in sorted_results],
+      columns=self._res_patterns + ["params", "status", "duration", "job_id",
+                                    "pareto_optimal"],
     )
 
   def start_tuning(self) -> None:
     """This is the main function that should be called to start tuning."""
     self._cnt = 0
+    self.pareto_front = ParetoFront()
     loop = asyncio.get_event_loop()
     jobs_queue = asyncio.Queue(loop=loop)
     results_queue = asyncio.Queue(loop=loop)
@@ -397,6 +541,9 @@ class ExecutionManager:
     process_jobs_coroutine = self._process_jobs(
       jobs_queue=jobs_queue, results_queue=results_queue,
     )
-    loop.run_until_complete(asyncio.gather(generate_jobs_coroutine,
-                                           process_jobs_coroutine))
-    loop.close()
+    try:
+      loop.run_until_complete(asyncio.gather(generate_jobs_coroutine,
+                                             process_jobs_coroutine))
+    finally:
+      loop.close()
+      self._search_algorithm.close()
@@ -0,0 +1,53 @@
+# Copyright (c) 2018 NVIDIA Corporation
+import numpy as np
+from typing import Any, Iterable, List
+
+
+def dominates(point: Iterable[float], other: Iterable[float]) -> bool:
+  """Returns whether ``point`` is at least as good as ``other`` in every
+  objective and better in at least one, all objectives being minimized.
+  """
+  point, other = np.asarray(point), np.asarray(other)
+  return bool(np.all(point <= other) and np.any(point < other))
+
+
+class ParetoFront:
+  """Non-dominated subset of the points added so far, maintained
+  incrementally. All objectives are minimized and points with non-finite
+  values are never on the front. A point equal to one already on the front
+  is not added. The items have to be hashable, e.g. job ids.
+  """
+  def __init__(self) -> None:
+    self.points = []
+    self.items = []
+    # the items again, so that membership checks don't scan the list
+    self._item_set = set()
+
+  def add(self, point: Iterable[float], item: Any = None) -> bool:
+    """Adds ``point`` (with ``item`` describing it) to the front unless it is
+    dominated, removing the points it dominates. Returns whether it was
+    added.
+    """
+    point = np.asarray(point, dtype=float)
+    if not np.all(np.isfinite(point)):
+      return False
+    for other in self.points:
+      if np.all(other <= point):
+        return False
+    keep = [i for i, other in enumerate(self.points)
+            if not dominates(point, other)]
+    self.points = [self.points[i] for i in keep] + [point]
+    self.items = [self.items[i] for i in keep] + [item]
+    self._item_set = set(self.items)
+    return True
+
+  def __len__(self) -> int:
+    return len(self.points)
+
+  def __contains__(self, item: Any) -> bool:
+    return item in self._item_set
+
+  def sorted_items(self) -> List[Any]:
+    """Returns the items sorted by the first objective."""
+    order = sorted(range(len(self.points)), key=lambda i: self.points[i][0])
+    return [self.items[i] for i in order]
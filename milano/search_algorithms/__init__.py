@@ -1,3 +1,10 @@
 # Copyright (c) 2017 NVIDIA Corporation
 from .random_search import RandomSearch
 from .gp.gp_search import GPSearch
+from .gp.turbo_search import TuRBOSearch
+from .gp.mf_search import MFSearch
+from .gp.parego_search import ParEGOSearch
+from .tpe_search import TPESearch
+from .evolution_search import EvolutionSearch
+from .pbt_search import PBTSearch
+from .rf_search import RFSearch
@@ -2,19 +2,28 @@
 import abc
 import six
 import numpy as np
+import pandas as pd
 
-from typing import Iterable, Mapping, Optional
+from typing import Iterable, List, Mapping, Optional, Tuple, Union
+
+
+def hash_dict(dct):
+  return " ".join("{}={}".format(key, val) for key, val in sorted(dct.items()))
 
 
 @six.add_metaclass(abc.ABCMeta)
 class SearchAlgorithm:
   """All search algorithms in MLQuest must inherit from this."""
+  # whether the algorithm can optimize several objectives at once
+  multi_objective = False
+
   def __init__(self,
                params_to_tune: Mapping,
                params_to_try_first: Mapping,
-               objective: str,
+               objective: Union[str, Iterable[str]],
                num_evals: int,
-               random_seed: int = None) -> None:
+               random_seed: int = None,
+               prior_results_files: Iterable[str] = None) -> None:
     """Base SearchAlgorithm constructor.
 
     Args:
@@ -34,9 +43,19 @@ class SearchAlgorithm:
               exponentiated.
             * "values": this parameter can be one of the supplied values.
       params_to_try_first (dict): dictionary with configurations to try first
-      objective (string): "minimize" or "maximize", case insensitive.
+      objective (string or list of strings): "minimize" or "maximize", case
+          insensitive. Algorithms with ``multi_objective = True`` also accept
+          a list with the direction of every objective, the results are then
+          tuples with a value for each of them.
       num_evals (int): maximum number of evaluations that the algorithm can do.
       random_seed (int): random seed to use.
+      prior_results_files (list of strings): results files of previous
+          studies with the same parameters and objective, e.g. tuning the
+          same model on another dataset, for algorithms that can transfer
+          knowledge from them. The successful results of every file, whose
+          parameters are within ``params_to_tune``, are available as
+          ``self._prior_results``: a list with a list of (result, params)
+          tuples for every file, params being strings.
     """
     for pm_name, pm_dict in params_to_tune.items():
       if "type" not in pm_dict:
@@ -79,14 +98,132 @@ class SearchAlgorithm:
     else:
       self._pre_configs_counter = -1
     self._num_evals = num_evals
-    if objective.lower() not in ["minimize", "maximize"]:
+    if isinstance(objective, str):
+      objective = [objective]
+    for cur_objective in objective:
+      if cur_objective.lower() not in ["minimize", "maximize"]:
+        raise ValueError(
+          'Objective has to be "minimize" or "maximize", '
+          'but "{}" was provided'.format(cur_objective)
+        )
+    if len(objective) > 1 and not self.multi_objective:
       raise ValueError(
-        'Objective has to be "minimize" or "maximize", '
-        'but "{}" was provided'.format(objective)
+        "{} doesn't support multiple objectives".format(type(self).__name__)
       )
-    self._objective = objective.lower()
+    self._objectives = [cur_objective.lower() for cur_objective in objective]
+    self._objective = self._objectives[0]
     self._random_seed = random_seed
     np.random.seed(self._random_seed)
+    self._params_to_id = {}
+    self._prior_results = [
+      self._read_results_file(results_file)
+      for results_file in (prior_results_files or [])
+    ]
+
+  def _read_results_file(
+    self,
+    results_file: str,
+  ) -> List[Tuple[float, Mapping]]:
+    """Returns the (result, params) tuples of the successful jobs in the
+    results file written by ``ExecutionManager``, skipping the jobs with
+    parameters that are missing or outside of ``self._params_to_tune``. The
+    result is the first column of the file.
+    """
+    results = []
+    data = pd.read_csv(results_file, index_col=0)
+    for result, job_params, status in zip(data.iloc[:, 0], data["params"],
+                                          data["status"]):
+      if status.startswith("Job failed") or not np.isfinite(result):
+        continue
+      params = dict([arg_val.split('=') for arg_val in job_params.split()])
+      if all(self._is_valid_value(pm_name, params.get(pm_name))
+             for pm_name in self._params_to_tune):
+        results.append((float(result), params))
+    return results
+
+  def _is_valid_value(self, pm_name: str, value: Optional[str]) -> bool:
+    pm_dict = self._params_to_tune[pm_name]
+    if value is None:
+      return False
+    if pm_dict["type"] == "values":
+      return value in [str(pm_value) for pm_value in pm_dict["values"]]
+    return pm_dict["min"] <= float(value) <= pm_dict["max"]
+
+  def _sample_param(self, pm_name: str):
+    """Samples the parameter ``pm_name`` randomly: uniformly between the
+    bounds (in logarithmic space for "log_range") or one of its values.
+    """
+    pm_dict = self._params_to_tune[pm_name]
+    if pm_dict["type"] == "range":
+      return float(np.random.uniform(pm_dict["min"], pm_dict["max"]))
+    if pm_dict["type"] == "log_range":
+      return float(np.exp(np.random.uniform(
+        np.log(pm_dict["min"]), np.log(pm_dict["max"]),
+      )))
+    return pm_dict["values"][np.random.randint(len(pm_dict["values"]))]
+
+  def _sample_params(self) -> dict:
+    """Generates new parameters by random sampling."""
+    return {pm_name: self._sample_param(pm_name)
+            for pm_name in self._params_to_tune}
+
+  def _param_bounds(
+    self,
+    pm_names: Iterable[str],
+  ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Returns the lower and the upper bounds of the parameters ``pm_names``
+    and whether they are "log_range" parameters, whose bounds are in
+    logarithmic space. "values" parameters get the bounds 0 and 1.
+    """
+    low, high, is_log = [], [], []
+    for pm_name in pm_names:
+      pm_dict = self._params_to_tune[pm_name]
+      is_log.append(pm_dict["type"] == "log_range")
+      if pm_dict["type"] == "values":
+        low.append(0.0)
+        high.append(1.0)
+      elif is_log[-1]:
+        low.append(np.log(pm_dict["min"]))
+        high.append(np.log(pm_dict["max"]))
+      else:
+        low.append(pm_dict["min"])
+        high.append(pm_dict["max"])
+    return (np.array(low, dtype=float), np.array(high, dtype=float),
+            np.array(is_log, dtype=bool))
+
+  def _value_index(self, pm_name: str, value) -> int:
+    """Returns the index of ``value`` among the values of the "values"
+    parameter ``pm_name``. They are compared as strings, since the results
+    pass the parameters as strings.
+    """
+    values = [str(pm_value) for pm_value in
+              self._params_to_tune[pm_name]["values"]]
+    if str(value) not in values:
+      raise ValueError('Value "{}" is not one of the "values" of '
+                       '"{}"'.format(value, pm_name))
+    return values.index(str(value))
+
+  def _has_all_params(self, params: Mapping) -> bool:
+    """Returns whether ``params`` specify all parameters in
+    ``self._params_to_tune``, which e.g. ``params_to_try_first`` don't have
+    to.
+    """
+    return all(pm_name in params for pm_name in self._params_to_tune)
+
+  def _add_job_id(self, params: Mapping, job_id) -> None:
+    """Remembers the ``job_id`` (e.g. a row of the algorithm's model) of a
+    new job with ``params``, see ``self._pop_job_id``.
+    """
+    # if we ever generate same parameters again, want to remember all of them
+    # and then take arbitrary id, since they all will point to the same
+    # point in our search space
+    self._params_to_id.setdefault(hash_dict(params), []).append(job_id)
+
+  def _pop_job_id(self, params: Mapping):
+    """Returns the id given to ``self._add_job_id`` for a job with
+    ``params`` (as strings or not) and forgets it.
+    """
+    return self._params_to_id[hash_dict(params)].pop()
 
   #@abc.abstractmethod
   def gen_initial_params(self) -> Iterable[Mapping]:
@@ -122,7 +259,8 @@ class SearchAlgorithm:
     `None` instead of dictionary with function parameters.
 
     Args:
-      result (float): the value of the function being optimized.
+      result (float): the value of the function being optimized, or the tuple
+          of the values of all objectives if several are optimized.
       params (dict): parameters, describing the point at which function was
           evaluated. This is the same dictionary as was returned from
           `self.gen_initial_params` or `self.gen_new_params`.
@@ -136,3 +274,84 @@ class SearchAlgorithm:
       list of dicts: [{param_name: param_value, ...}, ...]
     """
     pass
+
+  def gen_new_params_batch(
+    self,
+    results: Iterable[Tuple[float, Mapping, bool]],
+  ) -> Iterable[Optional[Mapping]]:
+    """This method should return new parameters to evaluate based on all
+    results that were retrieved since the last call.
+
+    It is called instead of `self.gen_new_params` when several jobs finish
+    at the same time, so that algorithms which refit a model on every new
+    result can do it once for the whole batch. By default it just calls
+    `self.gen_new_params` for every result and concatenates the outputs.
+
+    Args:
+      results (list of tuples): (result, params, evaluation_succeeded) for
+          every retrieved result, in the order they were retrieved. See
+          `self.gen_new_params` for the description of each element.
+
+    Returns:
+      list of dicts: [{param_name: param_value, ...}, ...]
+    """
+    new_params = []
+    for result, params, evaluation_succeeded in results:
+      new_params += list(self.gen_new_params(
+        result=result, params=params,
+        evaluation_succeeded=evaluation_succeeded,
+      ))
+    return new_params
+
+  def should_stop(self,
+                  params: Mapping,
+                  intermediate_results: Iterable[float]) -> bool:
+    """This method is called periodically for every running job and should
+    return whether the job needs to be stopped early. A stopped job is
+    reported to `self.gen_new_params` as a successful evaluation with the
+    last intermediate result. Never stops jobs by default.
+
+    Args:
+      params (dict): parameters of the running job as strings, see
+          `self.gen_new_params`.
+      intermediate_results (list of floats): all results the job has
+          reported so far, i.e. values after every occurrence of the result
+          pattern in the job's log.
+
+    Returns:
+      bool: whether to stop the job.
+    """
+    return False
+
+  def record_early_stop(self, params: Mapping) -> None:
+    """This method is called for every job that was killed because
+    `self.should_stop` returned True for it, right before its result is
+    passed to `self.gen_new_params` (or `self.gen_new_params_batch`). If the
+    job couldn't be killed it keeps running and this is not called. Does
+    nothing by default.
+
+    Args:
+      params (dict): parameters of the stopped job as strings, see
+          `self.gen_new_params`.
+    """
+    pass
+
+  def record_duration(self, params: Mapping, duration: float) -> None:
+    """This method is called with the wall time of every finished job right
+    before its result is passed to `self.gen_new_params` (or
+    `self.gen_new_params_batch`), so that algorithms can account for the
+    cost of the evaluations. Does nothing by default.
+
+    Args:
+      params (dict): parameters of the finished job as strings, see
+          `self.gen_new_params`.
+      duration (float): wall time of the job in seconds.
+    """
+    pass
+
+  def close(self) -> None:
+    """This method is called once the search is over and should release all
+    resources held by the algorithm, e.g. worker processes. Does nothing by
+    default.
+    """
+    pass
@@ -0,0 +1,261 @@
+# Copyright (c) 2018 NVIDIA Corporation
+import numpy as np
+from typing import Iterable, Mapping, Optional
+
+from .base import SearchAlgorithm
+
+
+class EvolutionSearch(SearchAlgorithm):
+  """Asynchronous steady-state evolutionary search.
+
+  Every time a job finishes, its result joins a population of the
+  ``population_size`` most recent results (regularized evolution: the oldest
+  member dies, no matter how good it is) and a single child is produced for
+  the freed worker. The child is a mutation of the best of
+  ``tournament_size`` random members of the population. Until the
+  population is full, parameters are sampled randomly.
+
+  With ``cma=True`` the "range" and "log_range" parameters of the child are
+  instead sampled from the search distribution of CMA-ES, which is updated
+  every time ``cma_popsize`` results have arrived. "values" parameters are
+  still inherited from the tournament winner and mutated.
+  """
+  def __init__(self,
+               params_to_tune: Mapping,
+               params_to_try_first: Mapping,
+               objective: str,
+               num_evals: int,
+               random_seed: int = None,
+               num_init_jobs=1,
+               num_jobs_to_launch_each_time=1,
+               population_size=50,
+               tournament_size=10,
+               mutation_prob=None,
+               mutation_scale=0.1,
+               cma=False,
+               cma_sigma=0.3,
+               cma_popsize=None) -> None:
+    super().__init__(params_to_tune, params_to_try_first,
+                     objective, num_evals, random_seed)
+    self._num_init_jobs = num_init_jobs
+    self._num_jobs_to_launch_each_time = num_jobs_to_launch_each_time
+    self._population_size = population_size
+    self._tournament_size = min(tournament_size, population_size)
+    if mutation_prob is None:
+      mutation_prob = 1.0 / len(self._params_to_tune)
+    self._mutation_prob = mutation_prob
+    self._mutation_scale = mutation_scale
+
+    # "range" and "log_range" parameters are mutated in linear and
+    # logarithmic space respectively
+    self._cont_names = [pm_name for pm_name, pm_dict in
+                        self._params_to_tune.items()
+                        if pm_dict["type"] != "values"]
+    self._low, self._high, self._is_log = self._param_bounds(self._cont_names)
+
+    # the population is a ring buffer, so the oldest member is replaced
+    self._population = []
+    self._population_values = np.zeros(population_size) + np.inf
+    self._oldest = 0
+
+    self._cma = None
+    if cma and self._cont_names:
+      self._cma = _CMAState(len(self._cont_names), cma_sigma, cma_popsize)
+    self._cma_results = []
+
+    self._evals_count = 0
+
+  def _to_unit(self, params: Mapping) -> np.ndarray:
+    x = np.array([float(params[pm_name]) for pm_name in self._cont_names])
+    x[self._is_log] = np.log(x[self._is_log])
+    return (x - self._low) / (self._high - self._low)
+
+  def _from_unit(self, u: np.ndarray, params: dict) -> None:
+    x = self._low + np.clip(u, 0.0, 1.0) * (self._high - self._low)
+    x[self._is_log] = np.exp(x[self._is_log])
+    for i, pm_name in enumerate(self._cont_names):
+      pm_dict = self._params_to_tune[pm_name]
+      params[pm_name] = float(np.clip(x[i], pm_dict["min"], pm_dict["max"]))
+
+  def _mutate(self, parent: Mapping, pm_names) -> dict:
+    """Returns a copy of ``parent`` with some of ``pm_names`` mutated. At
+    least one parameter is always mutated.
+    """
+    child = dict(parent)
+    mutated = np.random.uniform(size=len(pm_names)) < self._mutation_prob
+    if pm_names and not np.any(mutated):
+      mutated[np.random.randint(len(pm_names))] = True
+    for pm_name, mutate in zip(pm_names, mutated):
+      if not mutate:
+        continue
+      pm_dict = self._params_to_tune[pm_name]
+      if pm_dict["type"] == "values":
+        values = pm_dict["values"]
+        if len(values) > 1:
+          # picking any value except the current one
+          idx = np.random.randint(len(values) - 1)
+          if idx >= self._value_index(pm_name, parent[pm_name]):
+            idx += 1
+          child[pm_name] = values[idx]
+      else:
+        scale = self._mutation_scale
+        if pm_dict["type"] == "log_range":
+          low, high = np.log(pm_dict["min"]), np.log(pm_dict["max"])
+          value = np.log(float(parent[pm_name]))
+        else:
+          low, high = pm_dict["min"], pm_dict["max"]
+          value = float(parent[pm_name])
+        value = np.clip(value + np.random.normal(0.0, scale * (high - low)),
+                        low, high)
+        if pm_dict["type"] == "log_range":
+          value = np.clip(np.exp(value), pm_dict["min"], pm_dict["max"])
+        child[pm_name] = float(value)
+    return child
+
+  def _tournament(self) -> Optional[Mapping]:
+    """Returns the best of ``tournament_size`` random population members or
+    None if the population is not full yet.
+    """
+    if len(self._population) < self._population_size:
+      return None
+    idx = np.random.choice(self._population_size, self._tournament_size,
+                           replace=False)
+    return self._population[idx[np.argmin(self._population_values[idx])]]
+
+  def _get_new_point(self) -> Mapping:
+    parent = self._tournament()
+    cat_names = [pm_name for pm_name in self._params_to_tune
+                 if pm_name not in self._cont_names]
+    if self._cma is not None:
+      if parent is None:
+        params = {pm_name: self._sample_param(pm_name)
+                  for pm_name in cat_names}
+      else:
+        params = self._mutate(parent, cat_names)
+      self._from_unit(self._cma.sample(), params)
+    elif parent is None:
+      params = self._sample_params()
+    else:
+      params = self._mutate(parent, list(self._params_to_tune))
+    self._add_job_id(params, params)
+    self._evals_count += 1
+    return params
+
+  def _add_result(self, params: Mapping, result: float) -> None:
+    if len(self._population) < self._population_size:
+      self._population.append(params)
+      self._population_values[len(self._population) - 1] = result
+    else:
+      self._population[self._oldest] = params
+      self._population_values[self._oldest] = result
+      self._oldest = (self._oldest + 1) % self._population_size
+
+    if self._cma is not None:
+      self._cma_results.append((self._to_unit(params), result))
+      if len(self._cma_results) == self._cma.popsize:
+        self._cma.update(np.array([u for u, _ in self._cma_results]),
+                         np.array([val for _, val in self._cma_results]))
+        self._cma_results = []
+
+  def gen_initial_params(self) -> Iterable[Mapping]:
+    init_params = super().gen_initial_params()
+    if init_params is not None:
+      for params in init_params:
+        self._add_job_id(params, params)
+
+    params = [self._get_new_point()
+              for _ in range(min(self._num_evals, self._num_init_jobs))]
+
+    if init_params is not None:
+      return init_params + params
+    else:
+      return params
+
+  def gen_new_params(self,
+                     result: float,
+                     params: Mapping,
+                     evaluation_succeeded: bool) -> Iterable[Optional[Mapping]]:
+    if self._evals_count == self._num_evals:
+      return [None]
+    params = self._pop_job_id(params)
+    # jobs that don't specify all parameters can't be mutated
+    if evaluation_succeeded and self._has_all_params(params):
+      if self._objective == "maximize":
+        result = -result
+      self._add_result(params, result)
+
+    num_points = min(self._num_jobs_to_launch_each_time,
+                     self._num_evals - self._evals_count)
+    return [self._get_new_point() for _ in range(num_points)]
+
+
+class _CMAState:
+  """Search distribution of CMA-ES in the unit cube with the default
+  strategy parameters.
+  """
+  def __init__(self, num_dims, sigma, popsize=None):
+    n = num_dims
+    if popsize is None:
+      popsize = 4 + int(3 * np.log(n))
+    self.popsize = popsize
+    self.mu = popsize // 2
+    weights = np.log(self.mu + 0.5) - np.log(np.arange(1, self.mu + 1))
+    self.weights = weights / np.sum(weights)
+    self.mueff = 1.0 / np.sum(self.weights ** 2)
+    self.cc = (4.0 + self.mueff / n) / (n + 4.0 + 2.0 * self.mueff / n)
+    self.cs = (self.mueff + 2.0) / (n + self.mueff + 5.0)
+    self.c1 = 2.0 / ((n + 1.3) ** 2 + self.mueff)
+    self.cmu = min(1.0 - self.c1, 2.0 * (self.mueff - 2.0 + 1.0 / self.mueff) /
+                   ((n + 2.0) ** 2 + self.mueff))
+    self.damps = 1.0 + 2.0 * max(
+      0.0, np.sqrt((self.mueff - 1.0) / (n + 1.0)) - 1.0,
+    ) + self.cs
+    self.chin = np.sqrt(n) * (1.0 - 1.0 / (4.0 * n) + 1.0 / (21.0 * n ** 2))
+
+    self.mean = np.zeros(n) + 0.5
+    self.sigma = sigma
+    self.cov = np.eye(n)
+    self.pc = np.zeros(n)
+    self.ps = np.zeros(n)
+    self.eigvecs = np.eye(n)
+    self.eigvals = np.ones(n)
+    self.num_updates = 0
+
+  def sample(self):
+    z = np.random.normal(size=self.mean.shape[0])
+    return self.mean + self.sigma * self.eigvecs.dot(np.sqrt(self.eigvals) * z)
+
+  def update(self, x, values):
+    """Updates the distribution with the evaluated points ``x``. Some of
+    them might have been sampled before the previous update, since jobs
+    finish asynchronously.
+    """
+    n = self.mean.shape[0]
+    self.num_updates += 1
+    best = np.argsort(values, kind='stable')[:self.mu]
+    y = (np.clip(x[best], 0.0, 1.0) - self.mean) / self.sigma
+    y_w = self.weights.dot(y)
+    self.mean = self.mean + self.sigma * y_w
+
+    inv_sqrt = self.eigvecs.dot(
+      (self.eigvecs / np.sqrt(self.eigvals)).T
+    )
+    self.ps = ((1.0 - self.cs) * self.ps +
+               np.sqrt(self.cs * (2.0 - self.cs) * self.mueff) *
+               inv_sqrt.dot(y_w))
+    ps_norm = np.linalg.norm(self.ps)
+    hsig = (ps_norm / np.sqrt(1.0 - (1.0 - self.cs) ** (2 * self.num_updates))
+            / self.chin) < 1.4 + 2.0 / (n + 1.0)
+    self.pc = ((1.0 - self.cc) * self.pc +
+               hsig * np.sqrt(self.cc * (2.0 - self.cc) * self.mueff) * y_w)
+    self.cov = ((1.0 - self.c1 - self.cmu) * self.cov +
+                self.c1 * (np.outer(self.pc, self.pc) +
+                           (1.0 - hsig) * self.cc * (2.0 - self.cc) * self.cov) +
+                self.cmu * (y.T * self.weights).dot(y))
+    self.sigma *= np.exp(self.cs / self.damps * (ps_norm / self.chin - 1.0))
+    # the whole unit cube is the largest reasonable step
+    self.sigma = min(self.sigma, 1.0)
+
+    self.cov = 0.5 * (self.cov + self.cov.T)
+    self.eigvals, self.eigvecs = np.linalg.eigh(self.cov)
+    self.eigvals = np.maximum(self.eigvals, 1e-20)
@@ -2,22 +2,23 @@
 # This is wrapper around spearmint library. Please note that it imports code licensed under GPL v3.
 import numpy as np
 import collections
+import concurrent.futures
+import time
 
-from typing import Iterable, Mapping, Optional
+from typing import Iterable, Mapping, Optional, Tuple
 
-from milano.search_algorithms.base import SearchAlgorithm
+from milano.search_algorithms.base import SearchAlgorithm, hash_dict
 from milano.search_algorithms.gp.spearmint.gpei_chooser import GPEIChooser
 from milano.search_algorithms.gp.spearmint.utils import GridMap
 
 
-def hash_dict(dct):
-  return " ".join("{}={}".format(key, val) for key, val in sorted(dct.items()))
-
-
 class GPSearch(SearchAlgorithm):
   CANDIDATE_STATUS = 0
   PENDING_STATUS = 1
   COMPLETE_STATUS = 2
+  # task coordinates of this study and of the previous ones
+  TASK_COORD = 1.0
+  PRIOR_TASK_COORD = 0.5
 
   def __init__(self,
                params_to_tune: Mapping,
@@ -30,9 +31,12 @@ class GPSearch(SearchAlgorithm):
                num_init_jobs=1,
                num_jobs_to_launch_each_time=1,
                grid_size=1000,
-               smooth_inf_to=1e7) -> None:
+               smooth_inf_to=1e7,
+               prefetch=False,
+               prefetch_max_stale=1,
+               prior_results_files=None) -> None:
     super().__init__(params_to_tune, params_to_try_first,
-                     objective, num_evals, random_seed)
+                     objective, num_evals, random_seed, prior_results_files)
     self._num_init_jobs = num_init_jobs
     self._num_jobs_to_launch_each_time = num_jobs_to_launch_each_time
     self._fixed_params = {}
@@ -72,11 +76,10 @@ class GPSearch(SearchAlgorithm):
           self._fixed_params[pm_name] = pm_dict["values"][0]
 
     if chooser is None:
-      self._chooser = GPEIChooser(noiseless=True)
-    else:
-      if chooser_params is None:
-        chooser_params = {}
-      self._chooser = chooser(**chooser_params)
+      chooser, chooser_params = GPEIChooser, {"noiseless": True}
+    elif chooser_params is None:
+      chooser_params = {}
+    self._chooser = chooser(**chooser_params)
 
     self._gmap = GridMap(params, grid_size)
 
@@ -87,11 +90,93 @@ class GPSearch(SearchAlgorithm):
 
     self._values = np.zeros(grid_size) + np.inf
     self._durations = np.zeros(grid_size) + np.inf
+    # durations of the finished jobs whose results haven't been added yet
+    self._new_durations = {}
+    # when the running jobs were suggested, by grid index
+    self._launch_times = {}
     self._status = np.zeros(grid_size) + GPSearch.CANDIDATE_STATUS
-
-    self._params_to_id = {}
+    self._add_prior_results()
     self._evals_count = 0
 
+    # The next point can be computed in a background thread while the jobs
+    # are running, with all of them pending, by a chooser of its own so the
+    # suggestions never wait for a prefetch they don't use. The prefetch
+    # speculates that the prefetch_max_stale jobs predicted to finish first
+    # (see self._expected_to_finish) are the ones whose results arrive
+    # before it is used. If other jobs finish or fail, choosers with
+    # next_batch_with_hypers reuse the hyperparameter samples of a finished
+    # prefetch and only select the points again, otherwise the prefetch is
+    # ignored and the points are computed from scratch.
+    self._prefetch = prefetch
+    self._prefetch_max_stale = prefetch_max_stale
+    self._prefetch_chooser = chooser(**chooser_params) if prefetch else None
+    self._executor = None
+    self._prefetched = None
+
+    if self._num_prior > 0:
+      for cur_chooser in (self._chooser, self._prefetch_chooser):
+        if cur_chooser is not None:
+          cur_chooser.set_task(0, GPSearch.TASK_COORD)
+
+  def _add_prior_results(self) -> None:
+    """Puts the results of the previous studies in front of the grid as
+    completed jobs. The grid gets a task coordinate in front of the
+    parameters, ``PRIOR_TASK_COORD`` for the previous studies and
+    ``TASK_COORD`` for this one. The chooser's covariance has a separate
+    factor for it (see ``WarmStartMixin.set_task``), whose length scale is
+    fitted like the others and sets the correlation of the studies,
+    ``exp(-0.125 / length_scale**2)``. The results of every study are
+    standardized separately, see ``self._set_prior_values``.
+    """
+    self._num_prior = sum(len(results) for results in self._prior_results)
+    if self._num_prior == 0:
+      return
+    prior_grid, prior_z, prior_values = [], [], []
+    for results in self._prior_results:
+      values = np.array([result for result, _ in results])
+      if self._objective == "maximize":
+        values = -values
+      prior_z.append((values - np.mean(values)) / (np.std(values) + 1e-12))
+      prior_values.append(values)
+      for _, params in results:
+        prior_grid.append(self._gmap.to_unit(
+          [params[pm_name] for pm_name in self._pm_names],
+        ))
+    self._prior_z = np.concatenate(prior_z)
+    prior_values = np.concatenate(prior_values)
+    self._prior_scale = (np.mean(prior_values), np.std(prior_values))
+
+    self._grid = np.vstack((
+      np.hstack((np.zeros((self._num_prior, 1)) + GPSearch.PRIOR_TASK_COORD,
+                 np.array(prior_grid))),
+      np.hstack((np.zeros((self._grid.shape[0], 1)) + GPSearch.TASK_COORD,
+                 self._grid)),
+    ))
+    self._values = np.append(np.zeros(self._num_prior), self._values)
+    self._durations = np.append(np.zeros(self._num_prior) + np.inf,
+                                self._durations)
+    self._status = np.append(
+      np.zeros(self._num_prior) + GPSearch.COMPLETE_STATUS, self._status,
+    )
+
+  def _set_prior_values(self) -> None:
+    """Maps the standardized results of the previous studies to the scale of
+    the results of this study, or of all previous studies together while
+    this one has less than two results.
+    """
+    if self._num_prior == 0:
+      return
+    status = self._status[self._num_prior:]
+    values = self._values[self._num_prior:][
+      status == GPSearch.COMPLETE_STATUS
+    ]
+    values = values[values < self._smooth_inf_to]
+    if values.shape[0] >= 2:
+      mean, std = np.mean(values), np.std(values)
+    else:
+      mean, std = self._prior_scale
+    self._values[:self._num_prior] = mean + std * self._prior_z
+
   def _add_to_grid(self, candidate):
     # Checks to prevent numerical over/underflow from corrupting the grid
     candidate[candidate > 1.0] = 1.0
@@ -109,13 +194,89 @@ class GPSearch(SearchAlgorithm):
 
     return self._grid.shape[0] - 1
 
-  def _get_new_point(self) -> Mapping:
-    job_id = self._chooser.next(
-      self._grid, self._values, self._durations,
-      np.nonzero(self._status == GPSearch.CANDIDATE_STATUS)[0],
-      np.nonzero(self._status == GPSearch.PENDING_STATUS)[0],
-      np.nonzero(self._status == GPSearch.COMPLETE_STATUS)[0],
+  def _expected_to_finish(self, num_jobs):
+    """Returns the grid indices of the ``num_jobs`` running jobs predicted
+    to finish first. A job is predicted to take as long as the closest
+    completed job with a recorded duration. Without recorded durations any
+    running job may finish first, so all of them are returned.
+    """
+    pending = np.nonzero(self._status == GPSearch.PENDING_STATUS)[0]
+    timed = np.nonzero((self._status == GPSearch.COMPLETE_STATUS) &
+                       np.isfinite(self._durations))[0]
+    if timed.shape[0] == 0 or pending.shape[0] <= num_jobs:
+      return pending
+    dists = np.sum(
+      (self._grid[pending, np.newaxis] - self._grid[np.newaxis, timed]) ** 2,
+      axis=2,
+    )
+    now = time.time()
+    remaining = (self._durations[timed[np.argmin(dists, axis=1)]] -
+                 np.array([now - self._launch_times[idx] for idx in pending]))
+    return pending[np.argsort(remaining)[:num_jobs]]
+
+  def _prefetch_next(self, *args):
+    job_id = self._prefetch_chooser.next(*args)
+    hyper_samples = None
+    if hasattr(self._chooser, "next_batch_with_hypers"):
+      hyper_samples = self._prefetch_chooser.hyper_samples
+    return job_id, hyper_samples
+
+  def _start_prefetch(self) -> None:
+    if self._prefetched is not None:
+      self._prefetched[0].cancel()
+    self._set_prior_values()
+    if self._executor is None:
+      self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    # the chooser gets copies, since the results keep arriving meanwhile
+    status = self._status.copy()
+    future = self._executor.submit(
+      self._prefetch_next, self._grid.copy(), self._values.copy(),
+      self._durations.copy(),
+      np.nonzero(status == GPSearch.CANDIDATE_STATUS)[0],
+      np.nonzero(status == GPSearch.PENDING_STATUS)[0],
+      np.nonzero(status == GPSearch.COMPLETE_STATUS)[0],
     )
+    expected = self._expected_to_finish(self._prefetch_max_stale)
+    self._prefetched = (future, status, expected)
+
+  def _take_prefetched(self, num_points):
+    """Returns up to ``num_points`` new points from the prefetch, or an
+    empty list if it can't be used.
+    """
+    if self._prefetched is None or num_points == 0:
+      return []
+    future, status, expected = self._prefetched
+    self._prefetched = None
+    if self._status.shape[0] == status.shape[0]:
+      changed = np.nonzero(self._status != status)[0]
+      # at most prefetch_max_stale of the jobs expected to finish first
+      # have completed since the prefetch started, so its point is served
+      # as it is
+      if (changed.shape[0] <= self._prefetch_max_stale and
+          np.all(np.isin(changed, expected)) and
+          np.all(self._status[changed] == GPSearch.COMPLETE_STATUS)):
+        try:
+          return [self._get_new_point(future.result()[0])]
+        except Exception:
+          return []
+    # a stale prefetch that has finished still has fresh hyperparameter
+    # samples, one that hasn't is left to finish in the background
+    if not future.done() or future.exception() is not None:
+      future.cancel()
+      return []
+    hyper_samples = future.result()[1]
+    if not hyper_samples:
+      return []
+    return self._get_new_points(num_points, hyper_samples)
+
+  def _get_new_point(self, job_id=None) -> Mapping:
+    if job_id is None:
+      job_id = self._chooser.next(
+        self._grid, self._values, self._durations,
+        np.nonzero(self._status == GPSearch.CANDIDATE_STATUS)[0],
+        np.nonzero(self._status == GPSearch.PENDING_STATUS)[0],
+        np.nonzero(self._status == GPSearch.COMPLETE_STATUS)[0],
+      )
 
     # spearmint can return tuple when it decides to add new points to the grid
     if isinstance(job_id, tuple):
@@ -124,39 +285,73 @@ class GPSearch(SearchAlgorithm):
 
     candidate = self._grid[job_id]
     self._status[job_id] = GPSearch.PENDING_STATUS
+    self._launch_times[job_id] = time.time()
 
+    if self._num_prior > 0:
+      candidate = candidate[1:]
     cur_params = dict(zip(self._pm_names, self._gmap.unit_to_list(candidate)))
     cur_params.update(self._fixed_params)
 
-    # if we ever generate same parameters again, want to remember all of them
-    # and then take arbitrary grid id, since they all will point to the same
-    # point in our search space
-    pm_hash = hash_dict(cur_params)
-    if pm_hash not in self._params_to_id:
-      self._params_to_id[pm_hash] = []
-    self._params_to_id[pm_hash].append(job_id)
+    self._add_job_id(cur_params, job_id)
     self._evals_count += 1
     return cur_params
 
+  def _get_new_points(self, num_points, hyper_samples=None):
+    """Suggests ``num_points`` points. Given the ``hyper_samples`` of a
+    prefetch, the chooser only selects them with the current results.
+    """
+    self._set_prior_values()
+    if hyper_samples is not None:
+      job_ids = self._chooser.next_batch_with_hypers(
+        hyper_samples, self._grid, self._values, self._durations,
+        np.nonzero(self._status == GPSearch.CANDIDATE_STATUS)[0],
+        np.nonzero(self._status == GPSearch.PENDING_STATUS)[0],
+        np.nonzero(self._status == GPSearch.COMPLETE_STATUS)[0],
+        num_points,
+      )
+      return [self._get_new_point(job_id) for job_id in job_ids]
+    # choosers that support it suggest all points from a single model fit
+    if num_points > 1 and hasattr(self._chooser, "next_batch"):
+      job_ids = self._chooser.next_batch(
+        self._grid, self._values, self._durations,
+        np.nonzero(self._status == GPSearch.CANDIDATE_STATUS)[0],
+        np.nonzero(self._status == GPSearch.PENDING_STATUS)[0],
+        np.nonzero(self._status == GPSearch.COMPLETE_STATUS)[0],
+        num_points,
+      )
+      return [self._get_new_point(job_id) for job_id in job_ids]
+    return [self._get_new_point() for _ in range(num_points)]
+
   def gen_initial_params(self) -> Iterable[Mapping]:
     init_params = super().gen_initial_params()
 
-    params = []
-    for _ in range(min(self._num_evals, self._num_init_jobs)):
-      params.append(self._get_new_point())
+    params = self._get_new_points(min(self._num_evals, self._num_init_jobs))
+    if self._prefetch and self._evals_count < self._num_evals:
+      self._start_prefetch()
 
     if init_params is not None:
       return init_params + params
     else:
       return params
 
-  def gen_new_params(self,
-                     result: float,
-                     params: Mapping,
-                     evaluation_succeeded: bool) -> Iterable[Optional[Mapping]]:
-    if self._evals_count == self._num_evals:
-      return [None]
-    idx = self._params_to_id[hash_dict(params)].pop()
+  def record_duration(self, params: Mapping, duration: float) -> None:
+    # several jobs with the same parameters can finish at once, so every
+    # duration is assigned to the index its result is added to
+    self._new_durations.setdefault(hash_dict(params), []).append(duration)
+
+  def _pop_result_id(self, params: Mapping) -> int:
+    """Returns the grid index of a finished job with ``params`` and sets its
+    duration, if it was recorded.
+    """
+    idx = self._pop_job_id(params)
+    self._launch_times.pop(idx, None)
+    durations = self._new_durations.get(hash_dict(params))
+    if durations:
+      self._durations[idx] = durations.pop(0)
+    return idx
+
+  def _add_result(self, result, params, evaluation_succeeded) -> None:
+    idx = self._pop_result_id(params)
     if evaluation_succeeded:
       self._status[idx] = GPSearch.COMPLETE_STATUS
       if self._objective == "maximize":
@@ -170,8 +365,44 @@ class GPSearch(SearchAlgorithm):
       # if not succeeded, marking point as a potential candidate again
       self._status[idx] = GPSearch.CANDIDATE_STATUS
 
-    params = []
-    for _ in range(self._num_jobs_to_launch_each_time):
-      params.append(self._get_new_point())
-
+  def _suggest(self, num_points) -> Iterable[Mapping]:
+    params = self._take_prefetched(num_points)
+    params += self._get_new_points(num_points - len(params))
+    if self._prefetch and self._evals_count < self._num_evals:
+      self._start_prefetch()
     return params
+
+  def gen_new_params(self,
+                     result: float,
+                     params: Mapping,
+                     evaluation_succeeded: bool) -> Iterable[Optional[Mapping]]:
+    if self._evals_count == self._num_evals:
+      return [None]
+    self._add_result(result, params, evaluation_succeeded)
+    return self._suggest(self._num_jobs_to_launch_each_time)
+
+  def gen_new_params_batch(
+    self,
+    results: Iterable[Tuple[float, Mapping, bool]],
+  ) -> Iterable[Optional[Mapping]]:
+    if self._evals_count == self._num_evals:
+      return [None]
+    results = list(results)
+    for result, params, evaluation_succeeded in results:
+      self._add_result(result, params, evaluation_succeeded)
+    # the model is fitted once for all the results instead of once per result
+    num_points = min(self._num_jobs_to_launch_each_time * len(results),
+                     self._num_evals - self._evals_count)
+    return self._suggest(num_points)
+
+  def close(self) -> None:
+    if self._prefetched is not None:
+      concurrent.futures.wait([self._prefetched[0]])
+      self._prefetched = None
+    if self._executor is not None:
+      self._executor.shutdown()
+      self._executor = None
+    # some choosers keep a pool of worker processes alive between calls
+    for cur_chooser in (self._chooser, self._prefetch_chooser):
+      if hasattr(cur_chooser, "close"):
+        cur_chooser.close()
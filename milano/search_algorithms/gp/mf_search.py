@@ -0,0 +1,77 @@
+# Copyright (c) 2018 NVIDIA Corporation
+import numpy as np
+from typing import Mapping
+
+from milano.search_algorithms.gp.gp_search import GPSearch
+from milano.search_algorithms.gp.spearmint.mf_chooser import MFChooser
+
+
+class MFSearch(GPSearch):
+  """Multi-fidelity Bayesian optimization.
+
+  ``fidelity_params`` declares a single parameter that controls the cost
+  and the accuracy of a job, e.g. the number of epochs or the fraction of
+  the dataset, in the same format as ``params_to_tune``. A "values"
+  fidelity has to list the values from the lowest to the full fidelity, a
+  "range" or "log_range" fidelity is tried at ``num_fidelity_levels``
+  evenly spaced values (in logarithmic space for "log_range"), the maximum
+  being the full fidelity. ``fidelity_costs`` are the relative costs of the
+  fidelity values, which by default are the values themselves and have to
+  be given if the values are not numbers.
+
+  The Gaussian process models the objective jointly over the parameters
+  and the fidelity and every job is chosen together with its fidelity by
+  ``MFChooser``, so that most of the exploration is done at low fidelities.
+  All other parameters are the same as for ``GPSearch``.
+  """
+  def __init__(self,
+               params_to_tune: Mapping,
+               params_to_try_first: Mapping,
+               objective: str,
+               num_evals: int,
+               random_seed: int = None,
+               fidelity_params: Mapping = None,
+               fidelity_costs=None,
+               num_fidelity_levels=4,
+               chooser_params: Mapping = None,
+               **kwargs) -> None:
+    if fidelity_params is None or len(fidelity_params) != 1:
+      raise ValueError("fidelity_params has to contain exactly one parameter")
+    fidelity_name, fidelity_dict = next(iter(fidelity_params.items()))
+    if fidelity_name in params_to_tune:
+      raise ValueError('Fidelity parameter "{}" is also in '
+                       'params_to_tune'.format(fidelity_name))
+
+    # unit hypercube coordinates of the fidelity values, as mapped by GridMap
+    if fidelity_dict["type"] == "values":
+      values = fidelity_dict["values"]
+      if len(values) < 2:
+        raise ValueError("At least two fidelity values have to be specified")
+      levels = (np.arange(len(values)) + 0.5) / len(values)
+    else:
+      levels = np.linspace(0.0, 1.0, num_fidelity_levels)
+      low, high = fidelity_dict["min"], fidelity_dict["max"]
+      if fidelity_dict["type"] == "log_range":
+        values = np.exp(np.log(low) + levels * (np.log(high) - np.log(low)))
+      else:
+        values = low + levels * (high - low)
+    if fidelity_costs is None:
+      try:
+        fidelity_costs = [float(value) for value in values]
+      except (TypeError, ValueError):
+        raise ValueError('fidelity_costs has to be specified, since the values '
+                         'of fidelity parameter "{}" are not '
+                         'numbers'.format(fidelity_name))
+    if len(fidelity_costs) != len(levels):
+      raise ValueError("fidelity_costs has to contain {} costs, one for every "
+                       "fidelity value".format(len(levels)))
+
+    chooser_params = dict(chooser_params or {})
+    chooser_params["fidelity_levels"] = levels
+    chooser_params["fidelity_costs"] = fidelity_costs
+    # the fidelity is the last dimension of the grid
+    all_params = dict(params_to_tune)
+    all_params[fidelity_name] = fidelity_dict
+    super().__init__(all_params, params_to_try_first, objective, num_evals,
+                     random_seed, chooser=MFChooser,
+                     chooser_params=chooser_params, **kwargs)
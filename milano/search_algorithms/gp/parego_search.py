@@ -0,0 +1,89 @@
+# Copyright (c) 2018 NVIDIA Corporation
+import numpy as np
+from typing import Iterable, Mapping
+
+from milano.search_algorithms.gp.gp_search import GPSearch
+
+
+class ParEGOSearch(GPSearch):
+  """Multi-objective Bayesian optimization with ParEGO (Knowles, "ParEGO: A
+  Hybrid Algorithm With On-Line Landscape Approximation for Expensive
+  Multiobjective Optimization Problems", IEEE TEC 2006).
+
+  ``objective`` lists the direction of every objective and the results are
+  tuples with a value for each of them. Every time new jobs are needed, the
+  objectives of the completed jobs are normalized to [0, 1] and combined
+  with the augmented Chebyshev scalarization
+  ``max_i(w_i * f_i) + rho * sum_i(w_i * f_i)``, with weights ``w`` drawn
+  uniformly from the simplex, and the chooser minimizes the scalarized
+  values. Different weights favor different parts of the Pareto front, so
+  the jobs spread along it. Infinite values (e.g. from unsatisfied
+  constraints) are replaced by the worst value of the objective. All other
+  parameters are the same as for ``GPSearch``.
+  """
+  multi_objective = True
+
+  def __init__(self,
+               params_to_tune: Mapping,
+               params_to_try_first: Mapping,
+               objective: Iterable[str],
+               num_evals: int,
+               random_seed: int = None,
+               rho=0.05,
+               **kwargs) -> None:
+    if kwargs.get("prior_results_files"):
+      raise ValueError("ParEGOSearch doesn't support prior_results_files")
+    super().__init__(params_to_tune, params_to_try_first,
+                     objective, num_evals, random_seed, **kwargs)
+    self._rho = rho
+    # multiplying the results by the signs makes all objectives minimized
+    self._signs = np.array([1.0 if cur_objective == "minimize" else -1.0
+                            for cur_objective in self._objectives])
+    self._objective_values = np.zeros(
+      (self._grid.shape[0], len(self._objectives)),
+    ) + np.inf
+
+  def _add_to_grid(self, candidate):
+    idx = super()._add_to_grid(candidate)
+    self._objective_values = np.vstack((
+      self._objective_values, np.zeros((1, len(self._objectives))) + np.inf,
+    ))
+    return idx
+
+  def _add_result(self, result, params, evaluation_succeeded) -> None:
+    idx = self._pop_result_id(params)
+    if evaluation_succeeded:
+      self._status[idx] = GPSearch.COMPLETE_STATUS
+      self._objective_values[idx] = self._signs * np.array(result, dtype=float)
+    else:
+      # if not succeeded, marking point as a potential candidate again
+      self._status[idx] = GPSearch.CANDIDATE_STATUS
+
+  def _scalarize(self) -> None:
+    """Sets the values of the completed jobs to the scalarization of their
+    objectives with new random weights.
+    """
+    complete = self._status == GPSearch.COMPLETE_STATUS
+    if not np.any(complete):
+      return
+    values = self._objective_values[complete]
+    finite = np.isfinite(values)
+    lower = np.min(np.where(finite, values, np.inf), axis=0)
+    upper = np.max(np.where(finite, values, -np.inf), axis=0)
+    # objectives without any finite values don't matter
+    lower[~np.isfinite(lower)] = 0.0
+    upper[~np.isfinite(upper)] = 0.0
+    scaled = (values - lower) / np.maximum(upper - lower, 1e-12)
+    scaled[~finite] = 1.0
+    weighted = np.random.dirichlet(np.ones(values.shape[1])) * scaled
+    self._values[complete] = (np.max(weighted, axis=1) +
+                              self._rho * np.sum(weighted, axis=1))
+
+  def _start_prefetch(self) -> None:
+    self._scalarize()
+    super()._start_prefetch()
+
+  def _get_new_points(self, num_points, hyper_samples=None):
+    # all points suggested at once share the weights
+    self._scalarize()
+    return super()._get_new_points(num_points, hyper_samples)
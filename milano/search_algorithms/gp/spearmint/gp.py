@@ -28,14 +28,23 @@ gp.py contains utility functions related to computation in Gaussian processes.
 import numpy as np
 import scipy.linalg as spla
 import scipy.optimize as spo
+import scipy.stats    as sps
+from scipy.special import ndtr
 
-SQRT_3 = np.sqrt(3.0)
-SQRT_5 = np.sqrt(5.0)
+# Python floats, so that single precision inputs stay single precision.
+SQRT_3   = float(np.sqrt(3.0))
+SQRT_5   = float(np.sqrt(5.0))
+SQRT_2PI = float(np.sqrt(2*np.pi))
 
 
 def dist2(ls, x1, x2=None):
     # Assumes NxD and MxD matrices.
     # Compute the squared distance matrix, given length scales.
+    # If ls is an SxD stack of length scales (one row per hyperparameter
+    # sample), an SxNxM stack of distance matrices is returned.
+    ls = np.asarray(ls)
+    if ls.ndim == 2:
+        ls = ls[:,np.newaxis,:]
     
     if x2 is None:
         # Find distance with self for x1.
@@ -49,9 +58,9 @@ def dist2(ls, x1, x2=None):
         xx1 = x1 / ls
         xx2 = x2 / ls
     
-    r2 = np.maximum(-(np.dot(xx1, 2*xx2.T) 
-                       - np.sum(xx1*xx1, axis=1)[:,np.newaxis]
-                       - np.sum(xx2*xx2, axis=1)[:,np.newaxis].T), 0.0)
+    r2 = np.maximum(-(np.matmul(xx1, 2*np.swapaxes(xx2, -1, -2))
+                       - np.sum(xx1*xx1, axis=-1)[...,:,np.newaxis]
+                       - np.sum(xx2*xx2, axis=-1)[...,np.newaxis,:]), 0.0)
 
     return r2
 
@@ -111,14 +120,728 @@ def grad_Matern52(ls, x1, x2=None):
     grad_r2 = -(5.0/6.0)*np.exp(-SQRT_5*r)*(1 + SQRT_5*r)
     return grad_r2[:,:,np.newaxis] * grad_dist2(ls, x1, x2)
 
+# Covariance functions of the squared distance r2 = dist2(ls, x1, x2)
+# together with their derivatives (if grad is set), sharing the exponentials.
+def cov_grad_r2_SE(r2, grad=True):
+    cov = np.exp(-0.5*r2)
+    return cov, -0.5*cov if grad else None
+
+def cov_grad_r2_ARDSE(r2, grad=True):
+    cov = np.exp(-0.5*r2)
+    return cov, -0.5*cov if grad else None
+
+def cov_grad_r2_Matern32(r2, grad=True):
+    r   = np.sqrt(r2)
+    exp = np.exp(-SQRT_3*r)
+    return (1 + SQRT_3*r) * exp, -1.5*exp if grad else None
+
+def cov_grad_r2_Matern52(r2, grad=True):
+    r   = np.sqrt(r2)
+    exp = np.exp(-SQRT_5*r)
+    return ((1.0 + SQRT_5*r + (5.0/3.0)*r2) * exp,
+            -(5.0/6.0)*exp*(1 + SQRT_5*r) if grad else None)
+
+class Kernel:
+    # Covariance function which computes the squared distances once and
+    # derives the covariance, its gradient w.r.t. the inputs and w.r.t. the
+    # length scales from them. It can be called like the functions above.
+    # The last max_cached evaluations with a single length scale vector are
+    # cached by (ls, x1, x2), so the repeated calls made while the slice
+    # sampler moves the other hyperparameters don't recompute anything.
+    # Cached arrays are read-only. Stacked SxD length scales and matrices
+    # with more than max_cached_size entries are not cached.
+    # With a task_dim, the covariance is the product of the covariance of
+    # the other coordinates and the factor exp(-0.5*r2_task) of the task
+    # coordinate, so the length scale of that coordinate only sets how
+    # correlated the tasks are. 'r2' and 'grad_r2' then refer to the other
+    # coordinates, and only grad_x and grad_ls are exact for the task one.
+    max_cached      = 4
+    max_cached_size = 2**22
+
+    def __init__(self, covar, task_dim=None):
+        self.__name__   = covar
+        self.cov_grad_r2 = globals()['cov_grad_r2_' + covar]
+        self.task_dim    = task_dim
+        self.cache       = []
+
+    def __call__(self, ls, x1, x2=None, grad=False):
+        if grad:
+            return (self.evaluate(ls, x1, x2, grad=True)['cov'],
+                    self.grad_x(ls, x1, x2))
+        return self.evaluate(ls, x1, x2)['cov']
+
+    def __getstate__(self):
+        # Don't send the cached matrices to worker processes.
+        state = self.__dict__.copy()
+        state['cache'] = []
+        return state
+
+    def evaluate(self, ls, x1, x2=None, grad=False):
+        # Returns a dict with the squared distances 'r2', the covariance
+        # 'cov' and, if grad is set, dk/dr2 'grad_r2'. Single precision
+        # length scales give single precision results.
+        ls = np.asarray(ls)
+        ls = ls.astype(np.result_type(ls, np.float32), copy=False)
+        if self.__name__ == 'SE':
+            # SE ignores the length scales.
+            ls = np.ones_like(ls)
+        if ls.ndim == 2:
+            return self._evaluate(ls, x1, x2, grad)
+
+        for entry in self.cache:
+            if (np.array_equal(entry['ls'], ls) and
+                np.array_equal(entry['x1'], x1) and
+                (entry['x2'] is None if x2 is None
+                 else entry['x2'] is not None
+                 and np.array_equal(entry['x2'], x2))):
+                if grad and 'grad_r2' not in entry:
+                    entry['grad_r2'] = self.cov_grad_r2(entry['r2'])[1]
+                    if 'task_cov' in entry:
+                        entry['grad_r2'] = entry['grad_r2']*entry['task_cov']
+                    entry['grad_r2'].flags.writeable = False
+                return entry
+
+        entry = self._evaluate(ls, x1, x2, grad)
+        if entry['r2'].size > self.max_cached_size:
+            return entry
+        for value in entry.values():
+            value.flags.writeable = False
+        entry['ls'] = ls.copy()
+        entry['x1'] = np.array(x1)
+        entry['x2'] = None if x2 is None else np.array(x2)
+        self.cache = [entry] + self.cache[:self.max_cached - 1]
+        return entry
+
+    def _evaluate(self, ls, x1, x2=None, grad=False):
+        if self.task_dim is None:
+            r2 = dist2(ls, x1, x2)
+            cov, grad_r2 = self.cov_grad_r2(r2, grad)
+            if grad:
+                return {'r2' : r2, 'cov' : cov, 'grad_r2' : grad_r2}
+            return {'r2' : r2, 'cov' : cov}
+
+        # An infinite length scale takes the task coordinate out of r2.
+        other_ls = np.array(ls)
+        other_ls[...,self.task_dim] = np.inf
+        r2 = dist2(other_ls, x1, x2)
+        cov, grad_r2 = self.cov_grad_r2(r2, grad)
+        task_ls = ls[...,self.task_dim][...,np.newaxis,np.newaxis]
+        task_cov = np.exp(-0.5*(self.task_diffs(x1, x2)/task_ls)**2)
+        entry = {'r2' : r2, 'cov' : cov*task_cov, 'task_cov' : task_cov}
+        if grad:
+            entry['grad_r2'] = grad_r2*task_cov
+        return entry
+
+    def task_diffs(self, x1, x2=None):
+        # NxM differences of the task coordinates.
+        if x2 is None:
+            x2 = x1
+        return x1[:,np.newaxis,self.task_dim] - x2[np.newaxis,:,self.task_dim]
+
+    def grad_x(self, ls, x1, x2=None):
+        # NxMxD gradient of cov(ls, x1, x2) w.r.t. x1, the same as grad_*.
+        grad_r2 = self.evaluate(ls, x1, x2, grad=True)['grad_r2']
+        if x2 is None:
+            x2 = x1
+        if self.__name__ == 'SE':
+            ls = np.ones(np.shape(ls))
+        grad = grad_r2[:,:,np.newaxis] * grad_dist2(ls, x1, x2)
+        if self.task_dim is not None:
+            cov = self.evaluate(ls, x1, x2)['cov']
+            grad[:,:,self.task_dim] = (-cov*self.task_diffs(x1, x2)
+                                       / ls[self.task_dim]**2)
+        return grad
+
+    def grad_ls(self, ls, x1, x2=None, weights=None):
+        # NxMxD gradient of cov(ls, x1, x2) w.r.t. the length scales, or
+        # sum_ij weights_ij * dcov_ij/dls if an NxM weights matrix is given.
+        # The latter is computed with matrix products in O(D*N*M) without
+        # building the NxMxD tensor.
+        ls = np.asarray(ls, dtype=float)
+        if self.__name__ == 'SE':
+            shape = ls.shape if weights is not None else (
+                x1.shape[0], x1.shape[0] if x2 is None else x2.shape[0],
+                ls.shape[0])
+            return np.zeros(shape)
+        grad_r2 = self.evaluate(ls, x1, x2, grad=True)['grad_r2']
+        if x2 is None:
+            x2 = x1
+        if self.task_dim is not None:
+            # dcov/dls_task = cov*diff_task^2/ls_task^3
+            task_grad = (self.evaluate(ls, x1, x2)['cov']
+                         * self.task_diffs(x1, x2)**2
+                         / ls[self.task_dim]**3)
+        if weights is None:
+            sq_diffs = (x1[:,np.newaxis,:] - x2[np.newaxis,:,:])**2
+            grad = -2.0*grad_r2[:,:,np.newaxis]*sq_diffs/ls**3
+            if self.task_dim is not None:
+                grad[:,:,self.task_dim] = task_grad
+            return grad
+        # sum_ij w_ij (x1_id - x2_jd)^2
+        #   = sum_i x1_id^2 sum_j w_ij + sum_j x2_jd^2 sum_i w_ij
+        #     - 2 sum_i x1_id (w x2)_id
+        w = weights*grad_r2
+        sq_diffs = (np.dot(np.sum(w, axis=1), x1**2)
+                    + np.dot(np.sum(w, axis=0), x2**2)
+                    - 2*np.sum(x1*np.dot(w, x2), axis=0))
+        grad = -2.0*sq_diffs/ls**3
+        if self.task_dim is not None:
+            grad[self.task_dim] = np.sum(weights*task_grad)
+        return grad
+
+def stack_hypers(hyper_samples):
+    # Turns a list of (mean, noise, amp2, ls) samples into stacked arrays
+    # of shape S, S, S and SxD so they can be used with the batch_ functions.
+    mean  = np.array([hyper[0] for hyper in hyper_samples], dtype=float)
+    noise = np.array([hyper[1] for hyper in hyper_samples], dtype=float)
+    amp2  = np.array([hyper[2] for hyper in hyper_samples], dtype=float)
+    ls    = np.array([hyper[3] for hyper in hyper_samples], dtype=float)
+    return mean, noise, amp2, ls
+
+def batch_cov(cov_func, amp2, ls, x1, x2=None):
+    # Stacked version of the choosers' cov() for S hyperparameter samples.
+    # amp2 is a vector of length S and ls is an SxD matrix.
+    if x2 is None:
+        cov = cov_func(ls, x1, None) + 1e-6*np.eye(x1.shape[0])
+    else:
+        cov = cov_func(ls, x1, x2)
+    # Scale in place, the candidate cross-covariances can be large.
+    cov *= amp2[:,np.newaxis,np.newaxis]
+    return cov
+
+class JitterCholesky:
+    # Cholesky factorization which adds jitter to the diagonal of matrices
+    # that are numerically not positive definite, e.g. because of duplicated
+    # grid points. The jitter is relative to the mean of the diagonal. The
+    # first attempt uses the jitter which worked last time divided by growth
+    # (no jitter once that is below min_jitter), so that a single badly
+    # conditioned matrix doesn't add jitter to all later ones. After a
+    # failure the jitter is estimated from the smallest eigenvalue and then
+    # grown by growth, for at most max_tries factorizations in total.
+    def __init__(self, min_jitter=1e-10, growth=10.0, max_tries=5):
+        self.min_jitter = min_jitter
+        self.growth     = growth
+        self.max_tries  = int(max_tries)
+        self.jitter     = 0.0
+
+    def __call__(self, cov, lower=True):
+        return self.factor(cov, lambda c: spla.cholesky(c, lower=lower))
+
+    def batch(self, cov):
+        # Lower Cholesky factors of a stack of SxNxN matrices. Calling LAPACK
+        # for one matrix at a time is faster than np.linalg.cholesky on the
+        # stack for all but small matrices.
+        return self.factor(cov, lambda c: np.array(
+            [spla.cholesky(c_s, lower=True) for c_s in c]).reshape(c.shape))
+
+    def factor(self, cov, cholesky):
+        scale = np.mean(np.diagonal(cov, axis1=-2, axis2=-1), axis=-1)
+        eye   = np.eye(cov.shape[-1])
+        jitter = self.jitter
+        for attempt in range(self.max_tries):
+            try:
+                if jitter > 0:
+                    chol = cholesky(cov + jitter*scale[...,np.newaxis,np.newaxis]*eye)
+                else:
+                    chol = cholesky(cov)
+                self.jitter = jitter/self.growth
+                if self.jitter < self.min_jitter:
+                    self.jitter = 0.0
+                return chol
+            except np.linalg.LinAlgError:
+                if attempt == 0:
+                    min_eig = np.min(np.linalg.eigvalsh(cov), axis=-1)
+                    jitter = max(jitter*self.growth, self.min_jitter,
+                                 np.max(-min_eig/scale) + self.min_jitter)
+                else:
+                    jitter = jitter*self.growth
+        raise np.linalg.LinAlgError(
+            "Matrix not positive definite after %d jitter attempts"
+            % self.max_tries)
+
+def batch_solve_triangular(chol, b, trans=False):
+    # Solves chol*x = b (or chol'*x = b if trans is set) for a stack of SxNxN
+    # lower Cholesky factors and SxNxK right hand sides, in the precision of
+    # chol and b. BLAS is called for one sample at a time and solves the
+    # transposed system x'*chol' = b' in place, as its Fortran ordered
+    # operands are views of the C ordered stacks. This is about as fast as a
+    # product with the inverse factors without losing accuracy.
+    dtype = np.result_type(chol, b)
+    chol = np.asarray(chol, dtype=dtype)
+    x = np.array(b, dtype=dtype, order='C')
+    trsm = spla.get_blas_funcs('trsm', (chol, x))
+    for s in range(chol.shape[0]):
+        trsm(1.0, chol[s].T, x[s].T, side=1, lower=0,
+             trans_a=1 if trans else 0, overwrite_b=1)
+    return x
+
+def batch_cho_solve(chol, b):
+    # Solves cov*x = b for every sample given the lower Cholesky factors.
+    # b is either SxN or SxNxK.
+    if b.ndim == 2:
+        b = b[:,:,np.newaxis]
+        return batch_cho_solve(chol, b)[:,:,0]
+    return batch_solve_triangular(chol, batch_solve_triangular(chol, b),
+                                  trans=True)
+
+def batch_refine(cov, chol, b, x, refine_steps):
+    # Iterative refinement of the solution x of cov*x = b. For
+    # ill-conditioned matrices (e.g. noiseless with close points) the
+    # residual of the solves can still be large, every step solves for it.
+    for step in range(refine_steps):
+        x = x + batch_cho_solve(chol, b - np.matmul(cov, x))
+    return x
+
+def batch_ei_posterior(cov_func, hypers, comp, pend, vals, fant_randn=None,
+                       cholesky=None, refine_steps=0):
+    # Everything the expected improvement needs that does not depend on the
+    # candidates, for a stack of S hyperparameter samples (see stack_hypers).
+    # Pending points are fantasized using the PxF (shared by all samples) or
+    # SxPxF standard normal draws in fant_randn, which is only needed when
+    # there are pending points. Without pending points the observed values
+    # are treated as a single "fantasy". cholesky is a JitterCholesky and
+    # refine_steps the number of iterative refinement steps of the weights.
+    # Everything is computed in double precision.
+    mean, noise, amp2, ls = hypers
+    num_samples = mean.shape[0]
+    if cholesky is None:
+        cholesky = JitterCholesky()
+
+    if pend.shape[0] == 0:
+        # If there are no pending, don't do anything fancy.
+
+        # The primary covariances for prediction.
+        comp_cov = batch_cov(cov_func, amp2, ls, comp)
+
+        # Compute the required Cholesky.
+        obsv_cov = comp_cov + noise[:,np.newaxis,np.newaxis]*np.eye(comp.shape[0])
+        obsv_chol = cholesky.batch(obsv_cov)
+
+        # Current best.
+        fant_vals = np.broadcast_to(vals[np.newaxis,:,np.newaxis],
+                                    (num_samples, vals.shape[0], 1))
+        bests = np.min(fant_vals, axis=1)
+
+        # Solve the linear systems.
+        diffs = fant_vals - mean[:,np.newaxis,np.newaxis]
+        alpha = batch_refine(obsv_cov, obsv_chol, diffs,
+                             batch_cho_solve(obsv_chol, diffs),
+                             refine_steps)
+
+        return {'x': comp, 'chol': obsv_chol,
+                'alpha': alpha, 'bests': bests}
+    else:
+        # If there are pending experiments, fantasize their outcomes.
+
+        # Create a composite vector of complete and pending.
+        comp_pend = np.concatenate((comp, pend))
+
+        # Compute the covariance and Cholesky decomposition.
+        comp_pend_cov = (batch_cov(cov_func, amp2, ls, comp_pend) +
+                         noise[:,np.newaxis,np.newaxis]*np.eye(comp_pend.shape[0]))
+        comp_pend_chol = cholesky.batch(comp_pend_cov)
+
+        # Compute submatrices.
+        pend_cross = batch_cov(cov_func, amp2, ls, comp, pend)
+        pend_kappa = batch_cov(cov_func, amp2, ls, pend)
+
+        # Use the sub-Cholesky.
+        obsv_chol = comp_pend_chol[:,:comp.shape[0],:comp.shape[0]]
+
+        # Solve the linear systems.
+        alpha = batch_cho_solve(obsv_chol, vals - mean[:,np.newaxis])
+        beta  = batch_cho_solve(obsv_chol, pend_cross)
+
+        # Finding predictive means and variances.
+        pend_m = (np.matmul(alpha[:,np.newaxis,:], pend_cross)[:,0,:]
+                  + mean[:,np.newaxis])
+        pend_K = pend_kappa - np.matmul(np.swapaxes(pend_cross, 1, 2), beta)
+
+        # Take the Cholesky of the predictive covariance. It is nearly
+        # singular for close pending points, so it gets its own jitter.
+        pend_chol = JitterCholesky().batch(pend_K)
+
+        # Make predictions.
+        pend_fant = np.matmul(pend_chol, fant_randn) + pend_m[:,:,np.newaxis]
+        num_fant = pend_fant.shape[2]
+
+        # Include the fantasies.
+        fant_vals = np.concatenate(
+            (np.broadcast_to(vals[np.newaxis,:,np.newaxis],
+                             (num_samples, vals.shape[0], num_fant)),
+             pend_fant), axis=1)
+
+        # Compute bests over the fantasies.
+        bests = np.min(fant_vals, axis=1)
+
+        # Solve the linear systems.
+        diffs = fant_vals - mean[:,np.newaxis,np.newaxis]
+        alpha = batch_refine(comp_pend_cov, comp_pend_chol, diffs,
+                             batch_cho_solve(comp_pend_chol, diffs),
+                             refine_steps)
+
+        return {'x': comp_pend, 'chol': comp_pend_chol,
+                'alpha': alpha, 'bests': bests}
+
+def cast_ei_posterior(hypers, post, dtype):
+    # Copies of the hyperparameters and of the output of batch_ei_posterior
+    # in dtype, so that EI at the candidates can be computed in single
+    # precision from a double precision posterior.
+    hypers = tuple(np.asarray(h, dtype=dtype) for h in hypers)
+    post = dict((key, np.asarray(value, dtype=dtype))
+                for key, value in post.items())
+    return hypers, post
+
+def batch_moments_cand(cov_func, hypers, post, cand, cand_cross=None):
+    # Predictive means (SxMxF, one per fantasy) and latent variances (SxM)
+    # at the candidates given the output of batch_ei_posterior, in the
+    # precision of cand and of the posterior. The SxNxM cross-covariances
+    # are computed unless they are given.
+    mean, noise, amp2, ls = hypers
+
+    # Now generalize from these fantasies.
+    if cand_cross is None:
+        cand_cross = batch_cov(cov_func, amp2, ls, post['x'], cand)
+    beta = batch_solve_triangular(post['chol'], cand_cross)
+
+    # Predict the marginal means and variances at candidates.
+    func_m = (np.matmul(np.swapaxes(cand_cross, 1, 2), post['alpha'])
+              + mean[:,np.newaxis,np.newaxis])
+    func_v = (amp2[:,np.newaxis]*(1+1e-6)
+              - np.einsum('snm,snm->sm', beta, beta))
+    # The difference can cancel to (slightly) below zero at the observed
+    # points, especially in single precision.
+    func_v = np.maximum(func_v,
+                        np.finfo(func_v.dtype).eps*amp2[:,np.newaxis])
+    return func_m, func_v
+
+def batch_ei_moments(bests, func_m, func_v):
+    # Expected improvement over the SxF bests given the predictive means
+    # (SxMxF) and variances (SxM), averaged over the fantasies.
+    func_s = np.sqrt(func_v[:,:,np.newaxis])
+    u      = (bests[:,np.newaxis,:] - func_m) / func_s
+    ncdf   = ndtr(u)
+    npdf   = np.exp(-0.5*u**2) / SQRT_2PI
+    ei     = func_s*( u*ncdf + npdf)
+
+    return np.mean(ei, axis=2)
+
+def batch_ei_cand(cov_func, hypers, post, cand):
+    # Expected improvement at the candidates given the output of
+    # batch_ei_posterior, averaged over the fantasies. Returns an SxM matrix.
+    # It is computed in the precision of cand and of the posterior, see
+    # cast_ei_posterior.
+    func_m, func_v = batch_moments_cand(cov_func, hypers, post, cand)
+    return batch_ei_moments(post['bests'], func_m, func_v)
+
+def batch_mean_grad(cov_func, hypers, post, cand):
+    # Gradient of the predictive mean w.r.t. the candidate locations (SxMxD)
+    # given the output of batch_ei_posterior without pending points,
+    # contracted from the kernel derivative like in batch_ei_grad.
+    mean, noise, amp2, ls = hypers
+    x = post['x']
+    if cov_func.__name__ == 'SE':
+        # SE ignores the length scales.
+        ls = np.ones(ls.shape)
+    kernel = cov_func.evaluate(ls, x, cand, grad=True)
+    weights = (amp2[:,np.newaxis,np.newaxis] * kernel['grad_r2']
+               * post['alpha'][:,:,:1])
+    return (-2.0 / ls[:,np.newaxis,:]**2
+            * (np.matmul(np.swapaxes(weights, 1, 2), x)
+               - cand[np.newaxis,:,:]*np.sum(weights, axis=1)[:,:,np.newaxis]))
+
+def batch_ei_grad(cov_func, hypers, post, cand):
+    # Expected improvement at the candidates given the output of
+    # batch_ei_posterior (SxM, averaged over the fantasies) together with
+    # its gradient with respect to the candidate locations (SxMxD).
+    # The gradient is contracted directly from the kernel derivative, so no
+    # SxNxMxD tensor is built. cov_func has to be a Kernel.
+    mean, noise, amp2, ls = hypers
+    x = post['x']
+    num_fant = post['alpha'].shape[2]
+    if cov_func.__name__ == 'SE':
+        # SE ignores the length scales.
+        ls = np.ones(ls.shape)
+
+    # The distances are shared by the covariance and its derivative.
+    kernel = cov_func.evaluate(ls, x, cand, grad=True)
+    cand_cross = kernel['cov'] * amp2[:,np.newaxis,np.newaxis]
+    beta = batch_solve_triangular(post['chol'], cand_cross)
+
+    # Predict the marginal means and variances at candidates.
+    func_m = (np.matmul(np.swapaxes(cand_cross, 1, 2), post['alpha'])
+              + mean[:,np.newaxis,np.newaxis])
+    func_v = (amp2[:,np.newaxis]*(1+1e-6)
+              - np.einsum('snm,snm->sm', beta, beta))
+
+    # Expected improvement
+    func_s = np.sqrt(func_v[:,:,np.newaxis])
+    u      = (post['bests'][:,np.newaxis,:] - func_m) / func_s
+    ncdf   = sps.norm.cdf(u)
+    npdf   = sps.norm.pdf(u)
+    ei     = func_s*( u*ncdf + npdf)
+
+    # Gradients of the fantasy averaged ei w.r.t. mean and variance
+    g_ei_m  = -ncdf / num_fant
+    g_ei_s2 = np.sum(0.5*npdf / func_s, axis=2) / num_fant
+
+    # Chain rule through the cross-covariance: both the mean and the
+    # variance are weighted sums of the kernel derivative over the
+    # training points.
+    weights_m = np.matmul(post['alpha'], np.swapaxes(g_ei_m, 1, 2))
+    weights_v = batch_solve_triangular(post['chol'], beta, trans=True)
+    weights = (amp2[:,np.newaxis,np.newaxis]
+               * kernel['grad_r2']
+               * (weights_m - 2*g_ei_s2[:,np.newaxis,:]*weights_v))
+    grad_ei = (-2.0 / ls[:,np.newaxis,:]**2
+               * (np.matmul(np.swapaxes(weights, 1, 2), x)
+                  - cand[np.newaxis,:,:]*np.sum(weights, axis=1)[:,:,np.newaxis]))
+
+    return np.mean(ei, axis=2), grad_ei
+
+def ei_chunk_size(post, memory_budget, dtype=np.float64):
+    # Number of candidates whose EI can be evaluated at once within
+    # memory_budget megabytes. Per candidate we hold a few SxN kernel
+    # temporaries and a few SxF fantasy temporaries of dtype.
+    # Chunks are kept a multiple of 64 candidates, so that BLAS processes
+    # every candidate with the same kernel as in the unchunked computation
+    # and the EI values stay bit-for-bit identical.
+    num_samples, num_train, num_fant = post['alpha'].shape
+    cand_bytes = (np.dtype(dtype).itemsize * num_samples
+                  * (4*num_train + 5*num_fant))
+    chunk_size = int(memory_budget * 2**20 // cand_bytes)
+    return max(64, chunk_size // 64 * 64)
+
+def batch_ei_chunks(cov_func, hypers, post, cand, memory_budget=None,
+                    dtype=None):
+    # Yields (start, ei) for consecutive chunks of candidates, so that
+    # the memory used for EI does not grow with the number of candidates.
+    # The values are the same as computing all candidates at once.
+    # If dtype is given (e.g. np.float32), the cross-covariances and EI are
+    # computed in that precision.
+    if dtype is not None:
+        hypers, post = cast_ei_posterior(hypers, post, dtype)
+        cand = np.asarray(cand, dtype=dtype)
+    if memory_budget is None:
+        chunk_size = cand.shape[0]
+    else:
+        chunk_size = ei_chunk_size(post, memory_budget, cand.dtype)
+    for start in range(0, cand.shape[0], chunk_size):
+        yield start, batch_ei_cand(cov_func, hypers, post,
+                                   cand[start:start+chunk_size])
+
+def batch_ei(cov_func, hypers, comp, pend, cand, vals, fant_randn=None,
+             memory_budget=None, cholesky=None, dtype=None, refine_steps=0):
+    # Expected improvement at every candidate for a stack of S hyperparameter
+    # samples, evaluated in chunks of candidates fitting in memory_budget
+    # megabytes, in dtype precision. Returns an SxM matrix.
+    post = batch_ei_posterior(cov_func, hypers, comp, pend, vals, fant_randn,
+                              cholesky, refine_steps)
+    ei = np.empty((hypers[0].shape[0], cand.shape[0]), dtype=dtype)
+    for start, ei_chunk in batch_ei_chunks(cov_func, hypers, post, cand,
+                                           memory_budget, dtype):
+        ei[:,start:start+ei_chunk.shape[1]] = ei_chunk
+    return ei
+
+# Ways to account for the pending points (and for the points already
+# selected by batch_select), "fantasy" is handled by the choosers.
+PENDING_STRATEGIES = ("fantasy", "kriging_believer", "constant_liar",
+                      "local_penalization")
+
+def batch_select(cov_func, hypers, comp, pend, cand, vals, num_points,
+                 strategy="kriging_believer", memory_budget=None,
+                 cholesky=None, dtype=None, refine_steps=0, weights=None):
+    # Greedily selects num_points candidates with the highest expected
+    # improvement averaged over a stack of S hyperparameter samples, using a
+    # single factorization of the observed covariance. The pending points
+    # and the selected candidates are either conditioned on a lie
+    # ("kriging_believer": the predictive mean, "constant_liar": the best
+    # observed value), or they penalize the EI around them
+    # ("local_penalization", Gonzalez et al., 2016).
+    # The lies update the predictive moments with rank-one corrections, which
+    # need the cross-covariances of the candidates with every conditioned
+    # point. Only the candidates with the highest initial EI whose
+    # cross-covariances fit in memory_budget megabytes can be selected then.
+    # The EI of every candidate is multiplied by its entry of weights (e.g.
+    # the inverse of its predicted cost) if given.
+    # Returns the indices of the selected candidates.
+    mean, noise, amp2, ls = hypers
+    if strategy not in PENDING_STRATEGIES[1:]:
+        raise ValueError("Unknown strategy: %s" % strategy)
+    if dtype is None:
+        dtype = np.float64
+    post = batch_ei_posterior(cov_func, hypers, comp, pend[:0], vals,
+                              cholesky=cholesky, refine_steps=refine_steps)
+    c_hypers, c_post = cast_ei_posterior(hypers, post, dtype)
+    c_amp2, c_ls = c_hypers[2], c_hypers[3]
+    num_samples = mean.shape[0]
+    num_cand = cand.shape[0]
+    num_points = min(num_points, num_cand)
+    if weights is None:
+        weights = np.ones(num_cand)
+    points = np.asarray(np.concatenate((cand, pend)), dtype=dtype)
+    bests = post['bests'][:,0]
+    if memory_budget is None:
+        chunk_size = points.shape[0]
+    else:
+        chunk_size = ei_chunk_size(post, memory_budget, dtype)
+
+    # The lies are only propagated to a pool of the candidates (in their
+    # original order) followed by the pending points.
+    num_cond = comp.shape[0] + pend.shape[0] + num_points
+    num_pool = num_cand
+    if memory_budget is not None and strategy != "local_penalization":
+        num_pool = int(memory_budget * 2**20 // (
+            np.dtype(dtype).itemsize * num_samples * num_cond))
+        num_pool = min(num_cand, max(num_pool, num_points))
+    # Cross-covariances of the pool with the conditioned points. If every
+    # candidate is in the pool, they are kept from the moments below.
+    cross = None
+    if strategy != "local_penalization":
+        cross = np.empty((num_samples, num_cond, num_pool + pend.shape[0]),
+                         dtype=dtype)
+    keep_cross = num_pool == num_cand and cross is not None
+
+    # Predictive moments at the candidates and the pending points, and the
+    # largest gradient norm of the mean as an estimate of its Lipschitz
+    # constant.
+    func_m = np.empty((num_samples, points.shape[0]), dtype=dtype)
+    func_v = np.empty((num_samples, points.shape[0]), dtype=dtype)
+    lipschitz = np.zeros(num_samples, dtype=dtype)
+    for start in range(0, points.shape[0], chunk_size):
+        chunk = slice(start, start+chunk_size)
+        cand_cross = None
+        if keep_cross:
+            cand_cross = cross[:,:comp.shape[0],chunk]
+            cand_cross[...] = batch_cov(cov_func, c_amp2, c_ls, c_post['x'],
+                                        points[chunk])
+        m, func_v[:,chunk] = batch_moments_cand(cov_func, c_hypers, c_post,
+                                                points[chunk], cand_cross)
+        func_m[:,chunk] = m[:,:,0]
+        if strategy == "local_penalization":
+            grad = batch_mean_grad(cov_func, c_hypers, c_post, points[chunk])
+            lipschitz = np.maximum(
+                lipschitz, np.max(np.sqrt(np.sum(grad**2, axis=2)), axis=1))
+    ei = batch_ei_moments(bests[:,np.newaxis], func_m[:,:num_cand,np.newaxis],
+                          func_v[:,:num_cand])
+
+    if strategy == "local_penalization":
+        lipschitz = np.maximum(lipschitz, 1e-7)
+        penalty = np.ones((num_samples, num_cand), dtype=dtype)
+        selected = []
+        for j in range(pend.shape[0] + num_points):
+            if j < pend.shape[0]:
+                idx = num_cand + j
+            else:
+                acq = np.mean(ei*penalty, axis=0)*weights
+                acq[selected] = -np.inf
+                idx = int(np.argmax(acq))
+                selected.append(idx)
+            # The ball around the point which likely doesn't contain the
+            # minimum, with a soft boundary given by the predictive std.
+            dist   = np.sqrt(np.sum((points[:num_cand] - points[idx])**2, axis=1))
+            radius = np.maximum(func_m[:,idx] - bests, 0)
+            z = ((lipschitz[:,np.newaxis]*dist - radius[:,np.newaxis])
+                 / np.sqrt(func_v[:,idx])[:,np.newaxis])
+            penalty *= ndtr(z)
+        return selected
+
+    if keep_cross:
+        pool = np.arange(points.shape[0])
+    else:
+        pool = np.sort(np.argsort(-np.mean(ei, axis=0)*weights,
+                                  kind='stable')[:num_pool])
+        pool = np.concatenate((pool, num_cand + np.arange(pend.shape[0])))
+    pool_x = points[pool]
+    pool_m = func_m[:,pool]
+    pool_v = func_v[:,pool]
+    x = post['x']
+    if not keep_cross:
+        for start in range(0, pool.shape[0], chunk_size):
+            chunk = slice(start, start+chunk_size)
+            cross[:,:x.shape[0],chunk] = batch_cov(cov_func, c_amp2, c_ls,
+                                                   c_post['x'], pool_x[chunk])
+
+    # Cholesky factors of the conditioned points.
+    chol = post['chol']
+
+    selected = []
+    for j in range(pend.shape[0] + num_points):
+        if j < pend.shape[0]:
+            idx = num_pool + j
+        else:
+            acq = np.mean(batch_ei_moments(
+                bests[:,np.newaxis], pool_m[:,:num_pool,np.newaxis],
+                pool_v[:,:num_pool]), axis=0)*weights[pool[:num_pool]]
+            acq[selected] = -np.inf
+            idx = int(np.argmax(acq))
+            selected.append(idx)
+            if len(selected) == num_points:
+                break
+
+        if strategy == "kriging_believer":
+            lie = pool_m[:,idx].astype(float)
+            bests = np.minimum(bests, lie)
+        else:
+            lie = post['bests'][:,0]
+
+        # Condition on the lie at the new point, its covariance with the
+        # pool given the points conditioned on so far updates the moments.
+        num_x = x.shape[0]
+        x_new = pool_x[idx][np.newaxis,:].astype(float)
+        l = batch_solve_triangular(
+            chol, batch_cov(cov_func, amp2, ls, x, x_new))[:,:,0]
+        resid = np.maximum(amp2*(1+1e-6) + noise - np.sum(l**2, axis=1),
+                           np.finfo(float).eps*amp2)
+        w = batch_solve_triangular(chol, l[:,:,np.newaxis], trans=True)
+        innov = (lie - pool_m[:,idx]) / resid
+
+        cross[:,num_x,:] = batch_cov(cov_func, c_amp2, c_ls,
+                                     np.asarray(x_new, dtype=dtype), pool_x)[:,0,:]
+        cov_new = (cross[:,num_x,:]
+                   - np.matmul(np.swapaxes(np.asarray(w, dtype=dtype), 1, 2),
+                               cross[:,:num_x,:])[:,0,:])
+        pool_m += cov_new*innov[:,np.newaxis]
+        pool_v -= cov_new**2/resid[:,np.newaxis]
+        pool_v = np.maximum(pool_v, np.finfo(dtype).eps*c_amp2[:,np.newaxis])
+
+        # Append the new point to the Cholesky factors.
+        grown = np.zeros((num_samples, num_x+1, num_x+1))
+        grown[:,:-1,:-1] = chol
+        grown[:,-1,:-1]  = l
+        grown[:,-1,-1]   = np.sqrt(resid)
+        chol = grown
+        x = np.vstack((x, x_new))
+
+    return [int(pool[idx]) for idx in selected]
+
+# Runs one L-BFGS restart of the hyperparameter optimization, module level
+# so that it can be sent to a process pool.
+def optimize_restart(gp, comp, vals, hypers, bounds):
+    nlogprob, grad_nlogprob = gp.hyper_objective(comp, vals)
+    hypers, nlp, _ = spo.fmin_l_bfgs_b(nlogprob, hypers, grad_nlogprob,
+                                       args=(), bounds=bounds, disp=0)
+    return hypers, nlp
+
 class GP:
-    def __init__(self, covar="Matern52", mcmc_iters=10, noiseless=False):
-        self.cov_func        = globals()[covar]
+    def __init__(self, covar="Matern52", mcmc_iters=10, noiseless=False,
+                 num_restarts=1, restart_tol=1e-3, task_dim=None):
+        self.cov_func        = Kernel(covar, task_dim)
+        self.cholesky        = JitterCholesky()
         self.mcmc_iters      = int(mcmc_iters)
         self.D               = -1
         self.hyper_iters     = 1
         self.noiseless       = bool(int(noiseless))
         self.hyper_samples = []
+
+        # Maximum number of L-BFGS starting points in optimize_hypers. The
+        # restarts stop early once two of them agree on the best negative
+        # log likelihood up to restart_tol (relative).
+        self.num_restarts    = int(num_restarts)
+        self.restart_tol     = float(restart_tol)
+        # Log-space (amp2, noise, ls...) found by the previous optimization,
+        # which is used as the first starting point of the next one.
+        self.hypers_opt      = None
         
         self.noise_scale = 0.1  # horseshoe prior 
         self.amp2_scale  = 1    # zero-mean log normal prior
@@ -153,35 +876,26 @@ class GP:
             noise = self.noise
             
             cov   = amp2 * (self.cov_func(self.ls, comp, None) + 1e-6*np.eye(comp.shape[0])) + noise*np.eye(comp.shape[0])
-            chol  = spla.cholesky(cov, lower=True)
+            chol  = self.cholesky(cov)
             solve = spla.cho_solve((chol, True), vals - mean)
             lp    = -np.sum(np.log(np.diag(chol)))-0.5*np.dot(vals-mean, solve)
             return lp
 
-    def optimize_hypers(self, comp, vals):
-        self.mean = np.mean(vals)
-        diffs     = vals - self.mean
+    # Negative log marginal likelihood of log(amp2), log(noise) and
+    # log(ls) together with its gradient, memoizing the factorization.
+    def hyper_objective(self, comp, vals):
+        diffs = vals - self.mean
 
         state = { }
 
+        # None if the covariance can't be factorized even with jitter, the
+        # likelihood of such hyperparameters is 0
         def jitter_chol(covmat):
-            passed = False
-            jitter = 1e-8
-            val = 0
-            while not passed:
-                if (jitter > 100000):
-                    val = spla.cholesky(np.eye(covmat.shape[0]))
-                    break
-                try:
-                    val = spla.cholesky(covmat +
-                        jitter*np.eye(covmat.shape[0]), lower=True)
-                    passed = True
-                except ValueError:
-                    jitter = jitter*1.1
-                    print("Covariance matrix not PSD, adding jitter:", jitter)
-                    passed = False
-            return val
-        
+            try:
+                return self.cholesky(covmat)
+            except np.linalg.LinAlgError:
+                return None
+
         def memoize(amp2, noise, ls):
             if ( 'corr' not in state
                  or state['amp2'] != amp2
@@ -189,21 +903,20 @@ class GP:
                  or np.any(state['ls'] != ls)):
 
                 # Get the correlation matrix
-                (corr, grad_corr) = self.cov_func(ls, comp, None, grad=True)
-        
+                corr = self.cov_func(ls, comp, None)
+
                 # Scale and add noise & jitter.
-                covmat = (amp2 * (corr + 1e-6*np.eye(comp.shape[0])) 
+                covmat = (amp2 * (corr + 1e-6*np.eye(comp.shape[0]))
                           + noise * np.eye(comp.shape[0]))
 
                 # Memoize
                 state['corr']      = corr
-                state['grad_corr'] = grad_corr
                 state['chol']      = jitter_chol(covmat)
                 state['amp2']      = amp2
                 state['noise']     = noise
                 state['ls']        = ls
-                
-            return (state['chol'], state['corr'], state['grad_corr'])
+
+            return (state['chol'], state['corr'])
 
         def nlogprob(hypers):
             amp2  = np.exp(hypers[0])
@@ -211,6 +924,8 @@ class GP:
             ls    = np.exp(hypers[2:])
 
             chol  = memoize(amp2, noise, ls)[0]
+            if chol is None:
+                return np.inf
             solve = spla.cho_solve((chol, True), diffs)
             lp    = -np.sum(np.log(np.diag(chol)))-0.5*np.dot(diffs, solve)
             return -lp
@@ -220,57 +935,166 @@ class GP:
             noise = np.exp(hypers[1])
             ls    = np.exp(hypers[2:])
 
-            chol, corr, grad_corr = memoize(amp2, noise, ls)
+            chol, corr = memoize(amp2, noise, ls)
+            if chol is None:
+                return np.zeros(self.D + 2)
             solve   = spla.cho_solve((chol, True), diffs)
             inv_cov = spla.cho_solve((chol, True), np.eye(chol.shape[0]))
 
+            # d lp / d cov, symmetric. Every trace(jacobian * dcov) below is
+            # an elementwise sum, so nothing costs more than O(D*n^2).
             jacobian = np.outer(solve, solve) - inv_cov
 
             grad = np.zeros(self.D + 2)
 
             # Log amplitude gradient.
-            grad[0] = 0.5 * np.trace(np.dot( jacobian, corr + 1e-6*np.eye(chol.shape[0]))) * amp2
+            grad[0] = 0.5 * (np.sum(jacobian*corr)
+                             + 1e-6*np.trace(jacobian)) * amp2
 
             # Log noise gradient.
-            grad[1] = 0.5 * np.trace(np.dot( jacobian, np.eye(chol.shape[0]))) * noise
+            grad[1] = 0.5 * np.trace(jacobian) * noise
 
             # Log length scale gradients.
-            for dd in range(self.D):
-                grad[dd+2] = 1 * np.trace(np.dot( jacobian, -amp2*grad_corr[:,:,dd]*comp[:,dd][:,np.newaxis]/(np.exp(ls[dd]))))*np.exp(ls[dd])
+            grad[2:] = 0.5 * self.cov_func.grad_ls(ls, comp, None,
+                                                   weights=jacobian) * amp2 * ls
 
             # Roll in the prior variance.
             #grad -= 2*hypers/self.hyper_prior
 
             return -grad
-        
-        # Initial length scales.
-        self.ls = np.ones(self.D)
-        # Initial amplitude.
-        self.amp2 = np.std(vals)
-        # Initial observation noise.
-        self.noise = 1e-3
-        
-        hypers     = np.zeros(self.ls.shape[0]+2)
-        hypers[0]  = np.log(self.amp2)
-        hypers[1]  = np.log(self.noise)
-        hypers[2:] = np.log(self.ls)
-        
+
+        return nlogprob, grad_nlogprob
+
+    # Compare the hyperparameter gradient with central finite differences.
+    # Returns both and the largest difference relative to the largest
+    # gradient entry (or to 1 if they are all smaller).
+    def check_grad_hypers(self, comp, vals, hypers=None, step=1e-6):
+        nlogprob, grad_nlogprob = self.hyper_objective(comp, vals)
+        if hypers is None:
+            hypers = np.concatenate(([np.log(self.amp2), np.log(self.noise)],
+                                     np.log(self.ls)))
+        dx1 = grad_nlogprob(hypers)
+        dx2 = dx1*0
+        idx = np.zeros(hypers.shape[0])
+        for i in range(0, hypers.shape[0]):
+            idx[i] = step
+            dx2[i] = (nlogprob(hypers + idx) - nlogprob(hypers - idx))/(2*step)
+            idx[i] = 0
+        error = np.max(np.abs(dx1 - dx2)) / max(np.max(np.abs(dx1)), 1.0)
+        return dx1, dx2, error
+
+    # Starting points of optimize_hypers: the previous optimum, the default
+    # initialization and then random draws within the bounds.
+    def restart_hypers(self, vals, bounds):
+        starts = []
+        if self.hypers_opt is not None and self.hypers_opt.shape[0] == len(bounds):
+            starts.append(self.hypers_opt)
+
+        default     = np.zeros(len(bounds))
+        default[0]  = np.log(np.std(vals))
+        default[1]  = np.log(1e-3)
+        starts.append(default)
+
+        while len(starts) < self.num_restarts:
+            hypers     = np.zeros(len(bounds))
+            hypers[0]  = default[0] + np.random.randn()
+            hypers[1]  = np.random.uniform(-10, 0)
+            hypers[2:] = np.random.uniform(np.log(0.05), np.log(self.max_ls),
+                                           len(bounds)-2)
+            starts.append(hypers)
+
+        lower, upper = np.array(bounds).T
+        return [np.clip(h, lower, upper) for h in starts[:self.num_restarts]]
+
+    # Multi-start optimization of the marginal likelihood. Restarts run
+    # num_processes at a time, in the pool if one is given.
+    def optimize_hypers(self, comp, vals, pool=None, num_processes=1):
+        self.mean = np.mean(vals)
+
         # Use a bounded bfgs just to prevent the length-scales and noise from 
         # getting into regions that are numerically unstable
         b = [(-10,10),(-10,10)]
         for i in range(comp.shape[1]):
             b.append((-10,5))
-  
-        hypers = spo.fmin_l_bfgs_b(nlogprob, hypers, grad_nlogprob, args=(), bounds=b, disp=0)
-                
-        #hypers = spo.fmin_bfgs(nlogprob, hypers, grad_nlogprob, maxiter=100)
-        hypers = hypers[0]
-        #hypers = spo.fmin_bfgs(nlogprob, hypers, grad_nlogprob, maxiter=100)
+
+        starts = self.restart_hypers(vals, b)
+        if pool is None:
+            num_processes = 1
+
+        results = []
+        for i in range(0, len(starts), num_processes):
+            batch = [(self, comp, vals, h, b) for h in starts[i:i+num_processes]]
+            if pool is None:
+                results += [optimize_restart(*args) for args in batch]
+            else:
+                results += pool.starmap(optimize_restart, batch)
+
+            # Stop when two restarts have converged to the best optimum.
+            nlps = np.sort([nlp for _, nlp in results])
+            if (nlps.shape[0] > 1 and np.isfinite(nlps[1]) and
+                nlps[1] - nlps[0] <= self.restart_tol*max(1.0, abs(nlps[0]))):
+                break
+
+        hypers, nlp = min(results, key=lambda r: r[1])
+        if not np.isfinite(nlp):
+            raise np.linalg.LinAlgError(
+                "The covariance can't be factorized at any of the "
+                "hyperparameters optimize_hypers has tried")
+        self.hypers_opt = hypers
 
         self.amp2  = np.exp(hypers[0])
         self.noise = np.exp(hypers[1])
         self.ls    = np.exp(hypers[2:])
 
+    # Like optimize_hypers, but falls back to unit length scales and
+    # amplitude and small noise if the covariance can't be factorized.
+    def fit_hypers(self, comp, vals, pool=None, num_processes=1):
+        try:
+            self.optimize_hypers(comp, vals, pool, num_processes)
+        except np.linalg.LinAlgError:
+            self.ls    = np.ones(comp.shape[1])
+            self.amp2  = 1.0
+            self.noise = 1e-3
+
+    # The hyperparameter bounds assume values of unit scale, so values of
+    # any scale are standardized first. Returns them and their scale.
+    @staticmethod
+    def standardize(vals):
+        scale = np.std(vals) + 1e-12
+        return (vals - np.mean(vals)) / scale, scale
+
+# Check the hyperparameter gradient of every covariance function against
+# central finite differences at random hyperparameters and num_observations
+# random points of each of the dims. Raises AssertionError if the difference
+# relative to the gradient is larger than tolerance.
+def check_grad_covars(dims=(1, 5), num_observations=20, random_seed=0,
+                      tolerance=1e-4):
+    rng = np.random.RandomState(random_seed)
+    for dim in dims:
+        comp = rng.rand(num_observations, dim)
+        vals = np.sin(3.0*comp).sum(axis=1) + 0.1*rng.randn(num_observations)
+        # With more than one dimension, also with the first coordinate
+        # telling two tasks apart.
+        task_dims = [None, 0] if dim > 1 else [None]
+        for covar in ["SE", "ARDSE", "Matern32", "Matern52"]:
+            for task_dim in task_dims:
+                task_comp = comp.copy()
+                if task_dim is not None:
+                    task_comp[:,task_dim] = rng.choice([0.5, 1.0],
+                                                       num_observations)
+                model = GP(covar=covar, task_dim=task_dim)
+                model.real_init(dim, vals)
+                hypers = np.concatenate((
+                    [rng.uniform(-1, 1), rng.uniform(-6, -2)],
+                    rng.uniform(np.log(0.2), np.log(2.0), dim)))
+                grad, finite_diffs, error = model.check_grad_hypers(
+                    task_comp, vals, hypers, step=1e-5)
+                assert error < tolerance, (
+                    "{} hyperparameter gradient doesn't match finite "
+                    "differences for D={}, task_dim={} (relative error "
+                    "{:.2e}):\n{}\n{}".format(covar, dim, task_dim, error,
+                                              grad, finite_diffs))
+
 def main():
     try:
         import matplotlib.pyplot as plt
@@ -305,4 +1129,6 @@ def main():
         print('Install matplotlib to get figures')
 
 if __name__ == '__main__':
+    check_grad_covars()
+    print('Hyperparameter gradients match finite differences')
     main()
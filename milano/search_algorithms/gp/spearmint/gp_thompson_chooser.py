@@ -0,0 +1,121 @@
+# Copyright (c) 2018 NVIDIA Corporation
+
+"""
+Chooser module for Thompson sampling from a Gaussian process approximated
+with random Fourier features (Rahimi and Recht, "Random Features for
+Large-Scale Kernel Machines", NIPS 2007). The GP becomes a Bayesian linear
+model with num_features features, so a function sample from its posterior
+costs O(n*m^2) for n completed experiments and m features. Every suggested
+point is the minimum of a different sample over the candidate grid, which
+spreads the suggestions of a batch without conditioning on the pending
+experiments. The hyperparameters are optimized on at most max_hyper_points
+completed experiments, so the cost of a suggestion stays linear in n.
+"""
+
+import numpy as np
+import scipy.linalg as spla
+
+from . import gp
+from .utils import WarmStartMixin
+
+
+# degrees of freedom of the Student-t spectral densities of Matern kernels,
+# the squared exponential kernel has a Gaussian one
+SPECTRAL_DOF = {"SE": None, "ARDSE": None, "Matern32": 3.0, "Matern52": 5.0}
+
+
+class GPThompsonChooser(WarmStartMixin):
+  def __init__(self, covar="Matern52", num_features=500, max_hyper_points=200,
+               hyper_restarts=3, noiseless=False):
+    if covar not in SPECTRAL_DOF:
+      raise ValueError(
+        'Unsupported covar: "{}", has to be one of {}'.format(
+          covar, ", ".join(SPECTRAL_DOF),
+        )
+      )
+    self.cov_func = gp.Kernel(covar)
+    self.dof = SPECTRAL_DOF[covar]
+    self.num_features = int(num_features)
+    self.max_hyper_points = int(max_hyper_points)
+    self.hyper_restarts = int(hyper_restarts)
+    self.noiseless = bool(int(noiseless))
+    self.hyper_gp = None
+    self.D = -1
+
+  def _real_init(self, dims, values):
+    self.D = dims
+    self.hyper_gp = gp.GP(self.cov_func.__name__,
+                          num_restarts=self.hyper_restarts,
+                          task_dim=self.cov_func.task_dim)
+    self.hyper_gp.real_init(dims, values)
+
+  def optimize_hypers(self, comp, vals):
+    # the likelihood is cubic in the number of points, so it is only
+    # evaluated on a random subset of them
+    if comp.shape[0] > self.max_hyper_points:
+      subset = np.random.choice(comp.shape[0], self.max_hyper_points,
+                                replace=False)
+      comp, vals = comp[subset], vals[subset]
+    self.hyper_gp.fit_hypers(comp, vals)
+
+  # Random Fourier features of the kernel with the current hyperparameters,
+  # phi(x1).dot(phi(x2)) approximates amp2*k(x1, x2).
+  def sample_features(self):
+    freqs = np.random.randn(self.num_features, self.D)
+    if self.dof is not None:
+      scales = self.dof / np.random.chisquare(self.dof, self.num_features)
+      freqs *= np.sqrt(scales)[:, None]
+      # the factor of the task coordinate is squared exponential
+      task_dim = self.cov_func.task_dim
+      if task_dim is not None:
+        freqs[:, task_dim] /= np.sqrt(scales)
+    # like gp.SE, SE ignores the length scales
+    if self.cov_func.__name__ != "SE":
+      freqs /= self.hyper_gp.ls
+    phases = np.random.uniform(0, 2 * np.pi, self.num_features)
+    scale = np.sqrt(2.0 * self.hyper_gp.amp2 / self.num_features)
+    return lambda x: scale * np.cos(x.dot(freqs.T) + phases)
+
+  # Draws num_samples weight vectors of the features from their posterior.
+  def sample_weights(self, feats, vals, num_samples):
+    noise = 1e-6 if self.noiseless else max(self.hyper_gp.noise, 1e-6)
+    prec = feats.T.dot(feats) + noise * np.eye(self.num_features)
+    chol = spla.cholesky(prec, lower=True)
+    mean = spla.cho_solve((chol, True), feats.T.dot(vals))
+    # chol^-T z has the covariance prec^-1
+    noise_z = spla.solve_triangular(
+      chol, np.random.randn(self.num_features, num_samples), lower=True,
+      trans='T',
+    )
+    return mean[:, None] + np.sqrt(noise) * noise_z
+
+  def next(self, grid, values, durations, candidates, pending, complete):
+    return self.next_batch(grid, values, durations, candidates, pending,
+                           complete, 1)[0]
+
+  def next_batch(self, grid, values, durations, candidates, pending,
+                 complete, num_points):
+    # Don't bother using fancy GP stuff at first.
+    if complete.shape[0] < 2:
+      return [int(cand) for cand in candidates[:num_points]]
+
+    comp = grid[complete, :]
+    cand = grid[candidates, :]
+    vals, _ = gp.GP.standardize(values[complete])
+
+    if self.D == -1:
+      self._real_init(grid.shape[1], vals)
+    self.optimize_hypers(comp, vals)
+
+    features = self.sample_features()
+    weights = self.sample_weights(features(comp), vals - self.hyper_gp.mean,
+                                  num_points)
+    samples = features(cand).dot(weights)
+
+    # every sample is minimized over the candidates no other sample has taken
+    best_cands = []
+    for i in range(min(num_points, cand.shape[0])):
+      if best_cands:
+        samples[best_cands, i] = np.inf
+      best_cands.append(int(np.argmin(samples[:, i])))
+    return [int(candidates[idx]) for idx in best_cands]
@@ -32,22 +32,66 @@ is used to sample Gaussian process hyperparameters for the GP.
 import numpy          as np
 import numpy.random   as npr
 import scipy.linalg   as spla
-import scipy.stats    as sps
 
 from . import gp
-from .utils import slice_sample
+from .utils import batch_slice_sample, WarmStartMixin, WorkerPoolMixin
 
 
-class GPEIChooser:
+class GPEIChooser(WarmStartMixin, WorkerPoolMixin):
   def __init__(self, covar="Matern52", mcmc_iters=10,
-               pending_samples=100, noiseless=False):
-    self.cov_func = getattr(gp, covar)
+               pending_samples=100, noiseless=False, ei_memory_budget=256,
+               num_chains=1, slice_proposals=1, precision="float64",
+               refine_steps=0, hyper_restarts=5, num_processes=1,
+               pending_strategy="fantasy", cost_aware=False, burnin=10):
+    self.cov_func = gp.Kernel(covar)
+    self.cholesky = gp.JitterCholesky()
 
     self.mcmc_iters = int(mcmc_iters)
-    self.pending_samples = pending_samples
+    self.pending_samples = int(pending_samples)
+    # Megabytes available for the candidate EI temporaries
+    self.ei_memory_budget = int(ei_memory_budget)
+    # Precision of the candidate cross-covariances and EI ("float32" or
+    # "float64"). The observed covariance is always factorized in float64,
+    # with refine_steps steps of iterative refinement of its solves.
+    self.ei_dtype = np.dtype(precision).type
+    self.refine_steps = int(refine_steps)
     self.D = -1
     self.hyper_iters = 1
     self.noiseless = bool(int(noiseless))
+    self.hyper_samples = []
+    # The mcmc_iters samples are split between num_chains independent
+    # chains, all chains are advanced together with batched factorizations
+    self.num_chains = int(num_chains)
+    # Number of slice points evaluated at once by every chain
+    self.slice_proposals = int(slice_proposals)
+    # Current (mean, amp2, noise, ls...) state of every chain. The chains
+    # start from dispersed points and run burnin iterations before their
+    # first samples are taken.
+    self.chains = None
+    self.burnin = int(burnin)
+    # With mcmc_iters=0 the hyperparameters are optimized from up to
+    # hyper_restarts starting points, warm-started from the previous call.
+    # The restarts run num_processes at a time in a pool kept between calls.
+    self.hyper_restarts = int(hyper_restarts)
+    self.hyper_gp = None
+    self.num_processes = int(num_processes)
+    self.pool = None
+    # How the pending points and the other points of a batch are accounted
+    # for: "fantasy" samples pending_samples outcomes of all of them, the
+    # others (see gp.batch_select) condition on a single lie or penalize EI
+    # around them and scale to many pending points.
+    if pending_strategy not in gp.PENDING_STRATEGIES:
+      raise ValueError(
+        'Unsupported pending_strategy: "{}", has to be one of {}'.format(
+          pending_strategy, ", ".join(gp.PENDING_STRATEGIES),
+        )
+      )
+    self.pending_strategy = pending_strategy
+    # With cost_aware the EI is divided by the predicted duration of the
+    # experiment (EI per second), the log-durations of the completed
+    # experiments are modelled by a second GP.
+    self.cost_aware = bool(int(cost_aware))
+    self.duration_gp = None
 
     self.noise_scale = 0.1  # horseshoe prior
     self.amp2_scale = 1  # zero-mean log normal prior
@@ -77,232 +121,299 @@ class GPEIChooser:
       return self.amp2 * self.cov_func(self.ls, x1, x2)
 
   def next(self, grid, values, durations, candidates, pending, complete):
+    return self.next_batch(grid, values, durations, candidates, pending,
+                           complete, 1)[0]
+
+  # Suggests num_points candidates at once from a single hyperparameter fit.
+  def next_batch(self, grid, values, durations, candidates, pending,
+                 complete, num_points):
 
     # Don't bother using fancy GP stuff at first.
     if complete.shape[0] < 2:
-      return int(candidates[0])
+      return [int(cand) for cand in candidates[:num_points]]
 
     # Perform the real initialization.
     if self.D == -1:
       self._real_init(grid.shape[1], values[complete])
 
-    # Grab out the relevant sets.
     comp = grid[complete, :]
-    cand = grid[candidates, :]
-    pend = grid[pending, :]
     vals = values[complete]
 
     if self.mcmc_iters > 0:
       # Sample from hyperparameters.
-
-      overall_ei = np.zeros((cand.shape[0], self.mcmc_iters))
-
-      for mcmc_iter in range(self.mcmc_iters):
+      self.hyper_samples = []
+      for mcmc_iter in range(-(-self.mcmc_iters // self.num_chains)):
         self.sample_hypers(comp, vals)
-        overall_ei[:, mcmc_iter] = self.compute_ei(comp, pend, cand, vals)
-
-      best_cand = np.argmax(np.mean(overall_ei, axis=1))
-
-      return int(candidates[best_cand])
+      self.hyper_samples = self.hyper_samples[-self.mcmc_iters:]
 
     else:
       # Optimize hyperparameters
-      try:
-        self.optimize_hypers(comp, vals)
-      except:
-        # Initial length scales.
-        self.ls = np.ones(self.D)
-        # Initial amplitude.
-        self.amp2 = np.std(vals)
-        # Initial observation noise.
-        self.noise = 1e-3
-
-      ei = self.compute_ei(comp, pend, cand, vals)
-      best_cand = np.argmax(ei)
-
-      return int(candidates[best_cand])
-
-  def compute_ei(self, comp, pend, cand, vals):
+      self.optimize_hypers(comp, vals)
+      self.hyper_samples = [(self.mean, self.noise, self.amp2, self.ls)]
+
+    return self.next_batch_with_hypers(self.hyper_samples, grid, values,
+                                       durations, candidates, pending,
+                                       complete, num_points)
+
+  # Suggests num_points candidates with the hyperparameter samples of an
+  # earlier fit, e.g. of another chooser fitted to fewer results, so only
+  # the candidate selection sees the current results.
+  def next_batch_with_hypers(self, hyper_samples, grid, values, durations,
+                             candidates, pending, complete, num_points):
+    # Grab out the relevant sets.
+    comp = grid[complete, :]
+    cand = grid[candidates, :]
+    pend = grid[pending, :]
+    vals = values[complete]
+    weights = self.cost_weights(grid, durations, complete, cand)
+
+    best_cands = self.select_batch(comp, pend, cand, vals, hyper_samples,
+                                   num_points, weights)
+    return [int(candidates[best_cand]) for best_cand in best_cands]
+
+  # Returns the inverse of the predicted duration of every candidate, up to
+  # a constant factor, or None if the EI shouldn't be weighted. The durations
+  # are predicted by the mean of a GP fitted to the standardized
+  # log-durations of the completed experiments that have been timed.
+  def cost_weights(self, grid, durations, complete, cand):
+    if not self.cost_aware:
+      return None
+    timed = complete[np.isfinite(durations[complete])]
+    if timed.shape[0] < 2:
+      return None
+    log_durs, scale = gp.GP.standardize(
+      np.log(np.maximum(durations[timed], 1e-3)),
+    )
+
+    if self.duration_gp is None:
+      self.duration_gp = gp.GP(self.cov_func.__name__,
+                               num_restarts=self.hyper_restarts,
+                               task_dim=self.cov_func.task_dim)
+      self.duration_gp.real_init(grid.shape[1], log_durs)
+    mygp = self.duration_gp
+    mygp.fit_hypers(grid[timed], log_durs)
+    cov = mygp.cov(grid[timed]) + mygp.noise * np.eye(timed.shape[0])
+    alpha = spla.cho_solve((mygp.cholesky(cov), True), log_durs - mygp.mean)
+    pred = mygp.mean + mygp.cov(cand, grid[timed]).dot(alpha)
+    return np.exp(-scale * pred)
+
+  # Selects num_points candidates one after another, the already selected
+  # ones are treated as pending. The EI of the candidates is multiplied by
+  # weights if given.
+  def select_batch(self, comp, pend, cand, vals, hyper_samples, num_points,
+                   weights=None):
+    if self.pending_strategy != "fantasy":
+      return gp.batch_select(
+        self.cov_func, gp.stack_hypers(hyper_samples), comp, pend, cand, vals,
+        num_points, self.pending_strategy, self.ei_memory_budget,
+        self.cholesky, self.ei_dtype, self.refine_steps, weights,
+      )
+    best_cands = []
+    remaining = np.arange(cand.shape[0])
+    for _ in range(min(num_points, cand.shape[0])):
+      best_cand = remaining[self.argmax_ei(
+        comp, np.vstack((pend, cand[best_cands])), cand[remaining], vals,
+        hyper_samples, None if weights is None else weights[remaining],
+      )]
+      best_cands.append(best_cand)
+      remaining = remaining[remaining != best_cand]
+    return best_cands
+
+  # Find the candidate with the highest EI averaged over hyperparameter
+  # samples. Candidates are streamed through the EI computation in chunks
+  # fitting in self.ei_memory_budget, keeping only a running argmax.
+  def argmax_ei(self, comp, pend, cand, vals, hyper_samples, weights=None):
+    hypers = gp.stack_hypers(hyper_samples)
+    post = gp.batch_ei_posterior(self.cov_func, hypers, comp, pend, vals,
+                                 self.fantasy_randn(hyper_samples, pend),
+                                 self.cholesky, self.refine_steps)
+    best_cand = 0
+    best_ei = -np.inf
+    for start, ei in gp.batch_ei_chunks(self.cov_func, hypers, post, cand,
+                                        self.ei_memory_budget, self.ei_dtype):
+      mean_ei = np.mean(ei, axis=0)
+      if weights is not None:
+        mean_ei *= weights[start:start + mean_ei.shape[0]]
+      chunk_best = np.argmax(mean_ei)
+      if mean_ei[chunk_best] > best_ei:
+        best_cand = start + chunk_best
+        best_ei = mean_ei[chunk_best]
+    return best_cand
+
+  # Each hyperparameter sample fantasizes its own pending outcomes.
+  def fantasy_randn(self, hyper_samples, pend):
     if pend.shape[0] == 0:
-      # If there are no pending, don't do anything fancy.
-
-      # Current best.
-      best = np.min(vals)
-
-      # The primary covariances for prediction.
-      comp_cov = self.cov(comp)
-      cand_cross = self.cov(comp, cand)
-
-      # Compute the required Cholesky.
-      obsv_cov = comp_cov + self.noise * np.eye(comp.shape[0])
-      obsv_chol = spla.cholesky(obsv_cov, lower=True)
-
-      # Solve the linear systems.
-      alpha = spla.cho_solve((obsv_chol, True), vals - self.mean)
-      beta = spla.solve_triangular(obsv_chol, cand_cross, lower=True)
-
-      # Predict the marginal means and variances at candidates.
-      func_m = np.dot(cand_cross.T, alpha) + self.mean
-      func_v = self.amp2 * (1 + 1e-6) - np.sum(beta ** 2, axis=0)
+      return None
+    return npr.randn(len(hyper_samples), pend.shape[0], self.pending_samples)
+
+  # Compute EI over hyperparameter samples
+  def ei_over_hypers(self, comp, pend, cand, vals):
+    overall_ei = gp.batch_ei(self.cov_func,
+                             gp.stack_hypers(self.hyper_samples),
+                             comp, pend, cand, vals,
+                             self.fantasy_randn(self.hyper_samples, pend),
+                             self.ei_memory_budget, self.cholesky,
+                             self.ei_dtype, self.refine_steps)
+    return overall_ei.T
 
-      # Expected improvement
-      func_s = np.sqrt(func_v)
-      u = (best - func_m) / func_s
-      ncdf = sps.norm.cdf(u)
-      npdf = sps.norm.pdf(u)
-      ei = func_s * (u * ncdf + npdf)
-
-      return ei
-    else:
-      # If there are pending experiments, fantasize their outcomes.
-
-      # Create a composite vector of complete and pending.
-      comp_pend = np.concatenate((comp, pend))
-
-      # Compute the covariance and Cholesky decomposition.
-      comp_pend_cov = self.cov(comp_pend) + self.noise * np.eye(
-        comp_pend.shape[0])
-      comp_pend_chol = spla.cholesky(comp_pend_cov, lower=True)
-
-      # Compute submatrices.
-      pend_cross = self.cov(comp, pend)
-      pend_kappa = self.cov(pend)
-
-      # Use the sub-Cholesky.
-      obsv_chol = comp_pend_chol[:comp.shape[0], :comp.shape[0]]
-
-      # Solve the linear systems.
-      alpha = spla.cho_solve((obsv_chol, True), vals - self.mean)
-      beta = spla.cho_solve((obsv_chol, True), pend_cross)
-
-      # Finding predictive means and variances.
-      pend_m = np.dot(pend_cross.T, alpha) + self.mean
-      pend_K = pend_kappa - np.dot(pend_cross.T, beta)
-
-      # Take the Cholesky of the predictive covariance.
-      pend_chol = spla.cholesky(pend_K, lower=True)
-
-      # Make predictions.
-      pend_fant = (
-              np.dot(pend_chol, npr.randn(pend.shape[0], self.pending_samples))
-              + pend_m[:, None])
-
-      # Include the fantasies.
-      fant_vals = np.concatenate((np.tile(vals[:, np.newaxis],
-                                          (1, self.pending_samples)),
-                                  pend_fant))
-
-      # Compute bests over the fantasies.
-      bests = np.min(fant_vals, axis=0)
-
-      # Now generalize from these fantasies.
-      cand_cross = self.cov(comp_pend, cand)
-
-      # Solve the linear systems.
-      alpha = spla.cho_solve((comp_pend_chol, True), fant_vals - self.mean)
-      beta = spla.solve_triangular(comp_pend_chol, cand_cross, lower=True)
-
-      # Predict the marginal means and variances at candidates.
-      func_m = np.dot(cand_cross.T, alpha) + self.mean
-      func_v = self.amp2 * (1 + 1e-6) - np.sum(beta ** 2, axis=0)
-
-      # Expected improvement
-      func_s = np.sqrt(func_v[:, np.newaxis])
-      u = (bests[np.newaxis, :] - func_m) / func_s
-      ncdf = sps.norm.cdf(u)
-      npdf = sps.norm.pdf(u)
-      ei = func_s * (u * ncdf + npdf)
+  def compute_ei(self, comp, pend, cand, vals):
+    hyper_samples = [(self.mean, self.noise, self.amp2, self.ls)]
+    return gp.batch_ei(self.cov_func, gp.stack_hypers(hyper_samples),
+                       comp, pend, cand, vals,
+                       self.fantasy_randn(hyper_samples, pend),
+                       self.ei_memory_budget, self.cholesky,
+                       self.ei_dtype, self.refine_steps)[0]
+
+  # Log marginal likelihoods of K stacked hyperparameters given the KxNxN
+  # correlation matrices, factorized together.
+  def batch_logprob(self, corr, vals, mean, noise, amp2):
+    eye = np.eye(corr.shape[1])
+    cov = (amp2[:, np.newaxis, np.newaxis] * (corr + 1e-6 * eye)
+           + noise[:, np.newaxis, np.newaxis] * eye)
+    chol = self.cholesky.batch(cov)
+    lp = np.empty(corr.shape[0])
+    for k in range(corr.shape[0]):
+      solve = spla.solve_triangular(chol[k], vals - mean[k], lower=True)
+      lp[k] = -np.sum(np.log(np.diag(chol[k]))) - 0.5 * np.dot(solve, solve)
+    return lp
+
+  # Log marginal likelihood function of K stacked (mean, amp2, noise) for
+  # the current length scales of the chains. With the eigendecomposition
+  # corr + 1e-6*I = Q*diag(lam)*Q', cov = Q*diag(amp2*lam + noise)*Q', so
+  # after one decomposition per chain every evaluation costs O(N).
+  def fixed_ls_logprob(self, comp, vals):
+    corr = np.array([self.cov_func(chain[3:], comp, None)
+                     for chain in self.chains])
+    lam, vecs = np.linalg.eigh(corr)
+    lam += 1e-6
+    proj_vals = np.matmul(np.swapaxes(vecs, 1, 2), vals)
+    proj_ones = np.sum(vecs, axis=1)
+
+    def logprob(mean, noise, amp2, chains):
+      var = amp2[:, np.newaxis] * lam[chains] + noise[:, np.newaxis]
+      diffs = proj_vals[chains] - mean[:, np.newaxis] * proj_ones[chains]
+      lp = np.zeros(mean.shape[0]) - np.inf
+      valid = np.all(var > 0, axis=1)
+      lp[valid] = (-0.5 * np.sum(np.log(var[valid]), axis=1)
+                   - 0.5 * np.sum(diffs[valid] ** 2 / var[valid], axis=1))
+      return lp
 
-      return np.mean(ei, axis=1)
+    return logprob
 
+  # Advance every chain by one MCMC iteration and save their samples.
   def sample_hypers(self, comp, vals):
+    if self.chains is None:
+      self.chains = self.initial_chains(vals)
+      for mcmc_iter in range(self.burnin):
+        self.advance_chains(comp, vals)
+    self.advance_chains(comp, vals)
+
+    for chain in self.chains:
+      self.hyper_samples.append((chain[0], chain[2], chain[1],
+                                 chain[3:].copy()))
+    self.mean, self.amp2, self.noise = self.chains[0, :3]
+    self.ls = self.chains[0, 3:].copy()
+
+  # The first chain starts from the current hyperparameters, the others from
+  # random points within the support of the priors.
+  def initial_chains(self, vals):
+    chains = np.tile(np.concatenate(
+      ([self.mean, self.amp2, self.noise], self.ls)), (self.num_chains, 1))
+    num_others = self.num_chains - 1
+    chains[1:, 0] = npr.uniform(np.min(vals), np.max(vals), num_others)
+    chains[1:, 1] *= np.exp(self.amp2_scale * npr.randn(num_others))
+    chains[1:, 2] *= np.exp(npr.randn(num_others))
+    chains[1:, 3:] = npr.uniform(0.1, 1.0, (num_others, self.D)) * self.max_ls
+    return chains
+
+  def advance_chains(self, comp, vals):
+    self.chains[:, 0] = self.clip_to_values(self.chains[:, 0], vals)
     if self.noiseless:
-      self.noise = 1e-3
+      self.chains[:, 2] = 1e-3
       self._sample_noiseless(comp, vals)
     else:
       self._sample_noisy(comp, vals)
     self._sample_ls(comp, vals)
 
   def _sample_ls(self, comp, vals):
-    def logprob(ls):
-      if np.any(ls < 0) or np.any(ls > self.max_ls):
-        return -np.inf
-
-      cov = self.amp2 * (self.cov_func(ls, comp, None) + 1e-6 * np.eye(
-        comp.shape[0])) + self.noise * np.eye(comp.shape[0])
-      chol = spla.cholesky(cov, lower=True)
-      solve = spla.cho_solve((chol, True), vals - self.mean)
-      lp = -np.sum(np.log(np.diag(chol))) - 0.5 * np.dot(vals - self.mean,
-                                                         solve)
+    def logprob(ls, chains):
+      lp = np.zeros(ls.shape[0]) - np.inf
+      valid = np.all(ls >= 0, axis=1) & np.all(ls <= self.max_ls, axis=1)
+      if np.any(valid):
+        hypers = self.chains[chains[valid]]
+        lp[valid] = self.batch_logprob(self.cov_func(ls[valid], comp, None),
+                                       vals, hypers[:, 0], hypers[:, 2],
+                                       hypers[:, 1])
       return lp
 
-    self.ls = slice_sample(self.ls, logprob, compwise=True)
+    self.chains[:, 3:] = batch_slice_sample(
+      self.chains[:, 3:], logprob, compwise=True,
+      num_proposals=self.slice_proposals,
+    )[0]
 
   def _sample_noisy(self, comp, vals):
-    def logprob(hypers):
-      mean = hypers[0]
-      amp2 = hypers[1]
-      noise = hypers[2]
+    fixed_ls_logprob = self.fixed_ls_logprob(comp, vals)
 
-      # This is pretty hacky, but keeps things sane.
-      if mean > np.max(vals) or mean < np.min(vals):
-        return -np.inf
+    def logprob(hypers, chains):
+      mean = hypers[:, 0]
+      amp2 = hypers[:, 1]
+      noise = hypers[:, 2]
 
-      if amp2 < 0 or noise < 0:
-        return -np.inf
+      # This is pretty hacky, but keeps things sane.
+      valid = ((mean <= np.max(vals)) & (mean >= np.min(vals))
+               & (amp2 >= 0) & (noise >= 0))
 
-      cov = amp2 * (self.cov_func(self.ls, comp, None) +
-                    1e-6 * np.eye(comp.shape[0])) + noise * np.eye(
-        comp.shape[0])
-      chol = spla.cholesky(cov, lower=True)
-      solve = spla.cho_solve((chol, True), vals - mean)
-      lp = -np.sum(np.log(np.diag(chol))) - 0.5 * np.dot(vals - mean, solve)
+      lp = np.zeros(hypers.shape[0]) - np.inf
+      if np.any(valid):
+        lp[valid] = fixed_ls_logprob(mean[valid], noise[valid], amp2[valid],
+                                     chains[valid])
 
-      # Roll in noise horseshoe prior.
-      lp += np.log(np.log(1 + (self.noise_scale / noise) ** 2))
+        # Roll in noise horseshoe prior.
+        lp[valid] += np.log(np.log(1 + (self.noise_scale / noise[valid]) ** 2))
 
-      # Roll in amplitude lognormal prior
-      lp -= 0.5 * (np.log(amp2) / self.amp2_scale) ** 2
+        # Roll in amplitude lognormal prior
+        lp[valid] -= 0.5 * (np.log(amp2[valid]) / self.amp2_scale) ** 2
 
       return lp
 
-    hypers = slice_sample(np.array([self.mean, self.amp2, self.noise]),
-                          logprob, compwise=False)
-    self.mean = hypers[0]
-    self.amp2 = hypers[1]
-    self.noise = hypers[2]
+    self.chains[:, :3] = batch_slice_sample(
+      self.chains[:, :3], logprob, compwise=False,
+      num_proposals=self.slice_proposals,
+    )[0]
 
   def _sample_noiseless(self, comp, vals):
-    def logprob(hypers):
-      mean = hypers[0]
-      amp2 = hypers[1]
-      noise = 1e-3
+    fixed_ls_logprob = self.fixed_ls_logprob(comp, vals)
 
-      if amp2 < 0:
-        return -np.inf
+    def logprob(hypers, chains):
+      mean = hypers[:, 0]
+      amp2 = hypers[:, 1]
+      noise = np.zeros(hypers.shape[0]) + 1e-3
 
-      cov = amp2 * (self.cov_func(self.ls, comp, None) +
-                    1e-6 * np.eye(comp.shape[0])) + noise * np.eye(
-        comp.shape[0])
-      chol = spla.cholesky(cov, lower=True)
-      solve = spla.cho_solve((chol, True), vals - mean)
-      lp = -np.sum(np.log(np.diag(chol))) - 0.5 * np.dot(vals - mean, solve)
+      lp = np.zeros(hypers.shape[0]) - np.inf
+      valid = amp2 >= 0
+      if np.any(valid):
+        lp[valid] = fixed_ls_logprob(mean[valid], noise[valid], amp2[valid],
+                                     chains[valid])
 
-      # Roll in amplitude lognormal prior
-      lp -= 0.5 * (np.log(amp2) / self.amp2_scale) ** 2
+        # Roll in amplitude lognormal prior
+        lp[valid] -= 0.5 * (np.log(amp2[valid]) / self.amp2_scale) ** 2
 
       return lp
 
-    hypers = slice_sample(np.array([self.mean, self.amp2, self.noise]), logprob,
-                          compwise=False)
-    self.mean = hypers[0]
-    self.amp2 = hypers[1]
-    self.noise = 1e-3
+    self.chains[:, :2] = batch_slice_sample(
+      self.chains[:, :2], logprob, compwise=False,
+      num_proposals=self.slice_proposals,
+    )[0]
 
   def optimize_hypers(self, comp, vals):
-    mygp = gp.GP(self.cov_func.__name__)
-    mygp.real_init(comp.shape[1], vals)
-    mygp.optimize_hypers(comp, vals)
+    if self.hyper_gp is None:
+      self.hyper_gp = gp.GP(self.cov_func.__name__,
+                            num_restarts=self.hyper_restarts,
+                            task_dim=self.cov_func.task_dim)
+      self.hyper_gp.real_init(comp.shape[1], vals)
+    mygp = self.hyper_gp
+    pool = self.get_pool() if self.num_processes > 1 else None
+    mygp.fit_hypers(comp, vals, pool, self.num_processes)
     self.mean = mygp.mean
     self.ls = mygp.ls
     self.amp2 = mygp.amp2
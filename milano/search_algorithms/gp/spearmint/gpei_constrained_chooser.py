@@ -38,12 +38,12 @@ import numpy.random   as npr
 import scipy.linalg   as spla
 import scipy.stats    as sps
 import scipy.optimize as spo
+from scipy.special import ndtr
 import time
 import multiprocessing
-import copy
 
 from . import gp
-from .utils import slice_sample
+from .utils import slice_sample, WarmStartMixin, WorkerPoolMixin
 
 
 # Wrapper function to pass to parallel ei optimization calls
@@ -53,12 +53,17 @@ def optimize_pt(c, b, comp, pend, vals, labels, model):
                             bounds=b, disp=0)
     return ret[0]
 
-class GPConstrainedEIChooser:
+class GPConstrainedEIChooser(WarmStartMixin, WorkerPoolMixin):
     def __init__(self, covar="Matern52", mcmc_iters=20,
                  pending_samples=100, noiseless=False, burnin=100,
                  grid_subset=20, constraint_violating_value=np.inf,
-                 verbosity=0):
-        self.cov_func        = getattr(gp, covar)
+                 verbosity=0, num_processes=None, ei_memory_budget=256,
+                 batch_optimize=False, precision="float64", refine_steps=0):
+        self.cov_func        = gp.Kernel(covar)
+        self.cholesky        = gp.JitterCholesky()
+        # The nearly singular covariance of the pending fantasies keeps its
+        # own jitter.
+        self.pend_cholesky   = gp.JitterCholesky()
 
         self.mcmc_iters      = int(mcmc_iters)
         self.burnin          = int(burnin)
@@ -73,7 +78,26 @@ class GPConstrainedEIChooser:
         self.constraint_hyper_samples = []
         self.ff              = None
         self.ff_samples      = []
+        # Weights of the latent constraint function for every sample, so
+        # that predicting doesn't refactorize the constraint covariance
+        self.constraint_alpha_samples = []
         self.verbosity       = int(verbosity)
+        # Size of the process pool which is kept alive between calls
+        if num_processes is None:
+            num_processes = min(self.grid_subset, multiprocessing.cpu_count())
+        self.num_processes   = int(num_processes)
+        self.pool            = None
+        # Optimize all starting points with a single vectorized L-BFGS run
+        # (faster, but the points differ, see optimize_ei_batch), otherwise
+        # every point is optimized separately in the pool
+        self.batch_optimize  = bool(int(batch_optimize))
+        # Megabytes available for the candidate EI temporaries
+        self.ei_memory_budget = int(ei_memory_budget)
+        # Precision of the candidate EI ("float32" or "float64"), the
+        # gradients and the observed covariance stay in float64
+        self.ei_dtype        = np.dtype(precision).type
+        # Iterative refinement steps of the observed covariance solves
+        self.refine_steps    = int(refine_steps)
 
         self.noise_scale = 0.1  # horseshoe prior
         self.amp2_scale  = 1    # zero-mean log normal prior
@@ -164,6 +188,8 @@ class GPConstrainedEIChooser:
         best_comp = np.argmin(vals)
         cand2 = np.vstack((np.random.randn(10,comp.shape[1])*0.001 +
                            comp[best_comp,:], cand))
+        for dim, value in self.fixed_coords.items():
+            cand2[:,dim] = value
 
         if self.mcmc_iters > 0:
 
@@ -178,41 +204,36 @@ class GPConstrainedEIChooser:
             # Sample from hyperparameters.
             # Adjust the candidates to hit ei/sec peaks
             self.hyper_samples = []
+            self.constraint_hyper_samples = []
+            self.ff_samples = []
+            self.constraint_alpha_samples = []
             for mcmc_iter in range(self.mcmc_iters):
                 self.sample_constraint_hypers(comp, labels)
                 self.sample_hypers(comp[goodvals,:], vals[goodvals])
 
-            comp_preds = np.zeros(labels.shape[0]).flatten()
-
-            preds = self.pred_constraint_voilation(cand, comp, labels).flatten()
-            for ii in range(self.mcmc_iters):
-                constraint_hyper = self.constraint_hyper_samples[ii]
-                self.ff = self.ff_samples[ii]
-                self.constraint_mean = constraint_hyper[0]
-                self.constraint_gain = constraint_hyper[1]
-                self.constraint_amp2 = constraint_hyper[2]
-                self.constraint_ls = constraint_hyper[3]
-                comp_preds += self.pred_constraint_voilation(comp, comp,
-                                                             labels).flatten()
-            comp_preds = comp_preds / float(self.mcmc_iters)
-
             # Pick the top candidates to optimize over
             overall_ei = self.ei_over_hypers(comp,pend,cand2,vals,labels)
             inds = np.argsort(np.mean(overall_ei, axis=1))[-self.grid_subset:]
             cand2 = cand2[inds,:]
 
             # Adjust the candidates to hit ei peaks
-            b = []# optimization bounds
-            for i in range(0, cand.shape[1]):
-                b.append((0, 1))
-
-            # Optimize each point in parallel
-            pool = multiprocessing.Pool(self.grid_subset)
-            results = [pool.apply_async(optimize_pt,args=(
-                        c,b,comp,pend,vals,labels, copy.copy(self))) for c in cand2]
-            for res in results:
-                cand = np.vstack((cand, res.get(1024)))
-            pool.close()
+            b = self.point_bounds(cand.shape[1]) # optimization bounds
+
+            if self.batch_optimize:
+                cand = np.vstack((cand,
+                                  self.optimize_ei_batch(cand2, comp, pend,
+                                                         vals, labels)))
+            else:
+                # Optimize each point in parallel. Every worker gets one
+                # chunk of starting points, so the model and data are
+                # pickled only once per worker.
+                chunksize = int(np.ceil(cand2.shape[0] /
+                                        float(self.num_processes)))
+                results = self.get_pool().starmap(
+                    optimize_pt,
+                    [(c,b,comp,pend,vals,labels,self) for c in cand2],
+                    chunksize=chunksize)
+                cand = np.vstack([cand] + results)
 
             cand = np.vstack((cand, cand2))
 
@@ -238,10 +259,9 @@ class GPConstrainedEIChooser:
 
         # Compute the required Cholesky.
         obsv_cov  = comp_cov + self.constraint_noise*np.eye(comp.shape[0])
-        obsv_chol = spla.cholesky(obsv_cov, lower=True)
+        obsv_chol = self.cholesky(obsv_cov)
 
-        cov_grad_func = getattr(gp, 'grad_' + self.cov_func.__name__)
-        cand_cross_grad = cov_grad_func(self.constraint_ls, comp, cand)
+        cand_cross_grad = self.cov_func.grad_x(self.constraint_ls, comp, cand)
 
         # Predictive things.
         # Solve the linear systems.
@@ -254,27 +274,137 @@ class GPConstrainedEIChooser:
 
         return func_m
 
+    # Standard normal draws used to fantasize the pending outcomes. The random
+    # state is reset so that every evaluation sees the same fantasies.
+    def fantasy_randn(self, pend):
+        if pend.shape[0] == 0:
+            return None
+        npr.set_state(self.randomstate)
+        return npr.randn(pend.shape[0], self.pending_samples)
+
+    # Probability of satisfying the constraints at the candidates for all
+    # samples at once (SxM) and, if compute_grad is set, its gradient with
+    # respect to the candidates (SxMxD). The latent function weights were
+    # cached while sampling, so only the cross-covariances are computed.
+    def constraint_prob(self, comp, cand, labels, compute_grad=False):
+        num_samples = len(self.constraint_alpha_samples)
+
+        # Use standard EI if there aren't enough observations of either
+        # positive or negative constraint violations
+        if np.all(labels > 0) or np.all(labels <= 0):
+            prob = np.ones((num_samples, cand.shape[0]))
+            if compute_grad:
+                return prob, np.zeros(prob.shape + (cand.shape[1],))
+            return prob
+
+        hypers = self.constraint_hyper_samples[:num_samples]
+        gain = np.array([hyper[1] for hyper in hypers])
+        amp2 = np.array([hyper[2] for hyper in hypers])
+        ls   = np.array([hyper[3] for hyper in hypers])
+        if self.cov_func.__name__ == 'SE':
+            # SE ignores the length scales.
+            ls = np.ones(ls.shape)
+        alpha = (amp2[:,np.newaxis] *
+                 np.array(self.constraint_alpha_samples))
+
+        # Predict the latent function and squash it through the probit.
+        kernel = self.cov_func.evaluate(ls, comp, cand, grad=compute_grad)
+        func_m = np.matmul(alpha[:,np.newaxis,:], kernel['cov'])[:,0,:]
+        prob   = sps.norm.cdf(gain[:,np.newaxis]*func_m)
+        if not compute_grad:
+            return prob
+
+        # Chain rule through the cross-covariance, contracted over the
+        # training points as in gp.batch_ei_grad.
+        weights = kernel['grad_r2']*alpha[:,:,np.newaxis]
+        grad_m  = (-2.0 / ls[:,np.newaxis,:]**2
+                   * (np.matmul(np.swapaxes(weights, 1, 2), comp)
+                      - cand[np.newaxis,:,:]*np.sum(weights, axis=1)[:,:,np.newaxis]))
+        grad_prob = ((gain[:,np.newaxis] *
+                      sps.norm.pdf(gain[:,np.newaxis]*func_m))[:,:,np.newaxis]
+                     * grad_m)
+        return prob, grad_prob
+
+    # Everything the objective EI needs that does not depend on the
+    # candidates, for all samples (see gp.batch_ei_posterior). The objective
+    # GP is conditioned on the points which satisfied the constraints.
+    def ei_posterior(self, comp, pend, vals, labels):
+        hypers = gp.stack_hypers(self.hyper_samples[:self.mcmc_iters])
+        post = gp.batch_ei_posterior(self.cov_func, hypers,
+                                     comp[labels > 0,:], pend,
+                                     vals[labels > 0],
+                                     self.fantasy_randn(pend), self.cholesky,
+                                     self.refine_steps)
+        return hypers, post
+
     # Compute EI over hyperparameter samples
     def ei_over_hypers(self,comp,pend,cand,vals,labels):
-        overall_ei = np.zeros((cand.shape[0], self.mcmc_iters))
-        for mcmc_iter in range(self.mcmc_iters):
-            hyper = self.hyper_samples[mcmc_iter]
-            constraint_hyper = self.constraint_hyper_samples[mcmc_iter]
-            self.mean = hyper[0]
-            self.noise = hyper[1]
-            self.amp2 = hyper[2]
-            self.ls = hyper[3]
-
-            self.constraint_mean = constraint_hyper[0]
-            self.constraint_gain = constraint_hyper[1]
-            self.constraint_amp2 = constraint_hyper[2]
-            self.constraint_ls = constraint_hyper[3]
-            overall_ei[:,mcmc_iter] = self.compute_constrained_ei(comp, pend,
-                                                                  cand, vals,
-                                                                  labels)
+        # All samples are evaluated at once as stacked linear algebra, in
+        # chunks of candidates fitting in ei_memory_budget.
+        hypers, post = self.ei_posterior(comp, pend, vals, labels)
+        overall_ei = np.empty((cand.shape[0], hypers[0].shape[0]))
+        for start, ei in gp.batch_ei_chunks(self.cov_func, hypers, post, cand,
+                                            self.ei_memory_budget,
+                                            self.ei_dtype):
+            stop = start + ei.shape[1]
+            prob = self.constraint_prob(comp, cand[start:stop,:], labels)
+            overall_ei[start:stop,:] = (ei*prob).T
 
         return overall_ei
 
+    # Constrained EI summed over the samples and its gradient w.r.t. the
+    # candidates, given the output of ei_posterior.
+    def batch_constrained_ei(self, cand, comp, labels, hypers, post):
+        ei, grad_ei = gp.batch_ei_grad(self.cov_func, hypers, post, cand)
+        prob, grad_prob = self.constraint_prob(comp, cand, labels,
+                                               compute_grad=True)
+        grad = prob[:,:,np.newaxis]*grad_ei + ei[:,:,np.newaxis]*grad_prob
+        return np.sum(ei*prob), np.sum(grad, axis=0)
+
+    # Maximize constrained EI averaged over the samples from every row of
+    # cand as a starting point, packed into a single L-BFGS problem like in
+    # GPEIOptChooser.optimize_ei_batch. The points share the line search and
+    # the stopping criterion, so they don't end up where separate runs would.
+    def optimize_ei_batch(self, cand, comp, pend, vals, labels):
+        hypers, post = self.ei_posterior(comp, pend, vals, labels)
+        num_samples = hypers[0].shape[0]
+
+        def neg_ei(x):
+            ei, grad = self.batch_constrained_ei(x.reshape(cand.shape), comp,
+                                                 labels, hypers, post)
+            return -ei / num_samples, -grad.flatten() / num_samples
+
+        b = self.point_bounds(cand.shape[1]) * cand.shape[0]
+        ret = spo.fmin_l_bfgs_b(neg_ei, cand.flatten(), bounds=b, disp=0)
+        return ret[0].reshape(cand.shape)
+
+    # Optimization bounds of every coordinate of a point, the fixed_coords
+    # can't move.
+    def point_bounds(self, dims):
+        return [(self.fixed_coords[i], self.fixed_coords[i])
+                if i in self.fixed_coords else (0, 1) for i in range(dims)]
+
+    # Compare the gradient of the vectorized objective with central finite
+    # differences
+    def check_grad_ei_batch(self, cand, comp, pend, vals, labels):
+        hypers, post = self.ei_posterior(comp, pend, vals, labels)
+        dx1 = self.batch_constrained_ei(cand, comp, labels, hypers, post)[1]
+        dx2 = dx1*0
+        idx = np.zeros(cand.shape)
+        for i in range(0, cand.shape[0]):
+            for j in range(0, cand.shape[1]):
+                idx[i,j] = 1e-6
+                ei1 = self.batch_constrained_ei(cand + idx, comp, labels,
+                                                hypers, post)[0]
+                ei2 = self.batch_constrained_ei(cand - idx, comp, labels,
+                                                hypers, post)[0]
+                dx2[i,j] = (ei1 - ei2)/(2*1e-6)
+                idx[i,j] = 0
+        print('computed grads', dx1)
+        print('finite diffs', dx2)
+        print(np.sum((dx1 - dx2)**2))
+        return dx1, dx2
+
     # Adjust points by optimizing EI over a set of hyperparameter samples
     def grad_optimize_ei_over_hypers(self, cand, comp, pend, vals, labels,
                                      compute_grad=True):
@@ -284,6 +414,7 @@ class GPConstrainedEIChooser:
         for mcmc_iter in range(self.mcmc_iters):
             hyper = self.hyper_samples[mcmc_iter]
             constraint_hyper = self.constraint_hyper_samples[mcmc_iter]
+            self.ff = self.ff_samples[mcmc_iter]
             self.mean = hyper[0]
             self.noise = hyper[1]
             self.amp2 = hyper[2]
@@ -366,7 +497,7 @@ class GPConstrainedEIChooser:
             # Cholesky decompositions
             obsv_constraint_cov  = (comp_constraint_cov +
                  self.constraint_noise*np.eye(compfull.shape[0]))
-            obsv_constraint_chol = spla.cholesky(obsv_constraint_cov,lower=True)
+            obsv_constraint_chol = self.cholesky(obsv_constraint_cov)
 
             # Linear systems
             t_alpha  = spla.cho_solve((obsv_constraint_chol, True), self.ff)
@@ -378,8 +509,7 @@ class GPConstrainedEIChooser:
             func_constraint_m = sps.norm.cdf(self.constraint_gain*ff)
 
             # Apply covariance function
-            cov_grad_func = getattr(gp, 'grad_' + self.cov_func.__name__)
-            cand_cross_grad = cov_grad_func(self.constraint_ls, compfull, cand)
+            cand_cross_grad = self.cov_func.grad_x(self.constraint_ls, compfull, cand)
             grad_cross_t = np.squeeze(cand_cross_grad)
 
         # Now compute the gradients w.r.t. ei
@@ -395,7 +525,7 @@ class GPConstrainedEIChooser:
         # Compute the covariance and Cholesky decomposition.
         comp_pend_cov  = (self.cov(self.amp2, self.ls, comp_pend) +
                           self.noise*np.eye(comp_pend.shape[0]))
-        comp_pend_chol = spla.cholesky(comp_pend_cov, lower=True)
+        comp_pend_chol = self.cholesky(comp_pend_cov)
 
         # Compute submatrices.
         pend_cross = self.cov(self.amp2, self.ls, comp, pend)
@@ -408,7 +538,7 @@ class GPConstrainedEIChooser:
         #obsv_cov  = comp_cov + self.noise*np.eye(comp.shape[0])
         #obsv_chol = spla.cholesky(obsv_cov, lower=True)
         obsv_cov_full  = comp_cov_full + self.noise*np.eye(compfull.shape[0])
-        obsv_chol_full = spla.cholesky( obsv_cov_full, lower=True)
+        obsv_chol_full = self.cholesky(obsv_cov_full)
 
         # Predictive things.
         # Solve the linear systems.
@@ -420,7 +550,7 @@ class GPConstrainedEIChooser:
         pend_K = pend_kappa - np.dot(pend_cross.T, beta)
 
         # Take the Cholesky of the predictive covariance.
-        pend_chol = spla.cholesky(pend_K, lower=True)
+        pend_chol = self.pend_cholesky(pend_K)
 
         # Make predictions.
         npr.set_state(self.randomstate)
@@ -436,8 +566,7 @@ class GPConstrainedEIChooser:
 
         # Now generalize from these fantasies.
         cand_cross = self.cov(self.amp2, self.ls, comp_pend, cand)
-        cov_grad_func = getattr(gp, 'grad_' + self.cov_func.__name__)
-        cand_cross_grad = cov_grad_func(self.ls, comp_pend, cand)
+        cand_cross_grad = self.cov_func.grad_x(self.ls, comp_pend, cand)
 
         # Solve the linear systems.
         alpha  = spla.cho_solve((comp_pend_chol, True),
@@ -529,7 +658,7 @@ class GPConstrainedEIChooser:
             # Cholesky decompositions
             obsv_constraint_cov  = (comp_constraint_cov +
                  self.constraint_noise*np.eye(compfull.shape[0]))
-            obsv_constraint_chol = spla.cholesky(obsv_constraint_cov,lower=True)
+            obsv_constraint_chol = self.cholesky(obsv_constraint_cov)
 
             # Linear systems
             t_alpha  = spla.cho_solve((obsv_constraint_chol, True), self.ff)
@@ -549,9 +678,9 @@ class GPConstrainedEIChooser:
 
         # Compute the required Cholesky.
         obsv_cov  = comp_cov + self.noise*np.eye(comp.shape[0])
-        obsv_chol = spla.cholesky(obsv_cov, lower=True)
+        obsv_chol = self.cholesky(obsv_cov)
         obsv_cov_full  = comp_cov_full + self.noise*np.eye(compfull.shape[0])
-        obsv_chol_full = spla.cholesky( obsv_cov_full, lower=True)
+        obsv_chol_full = self.cholesky(obsv_cov_full)
 
         # Predictive things.
         # Solve the linear systems.
@@ -579,11 +708,10 @@ class GPConstrainedEIChooser:
         g_ei_s2 = 0.5*npdf / func_s
 
         # Apply covariance function
-        cov_grad_func = getattr(gp, 'grad_' + self.cov_func.__name__)
-        cand_cross_grad = cov_grad_func(self.ls, comp, cand)
+        cand_cross_grad = self.cov_func.grad_x(self.ls, comp, cand)
         grad_cross = np.squeeze(cand_cross_grad)
 
-        cand_cross_grad_full = cov_grad_func(self.ls, compfull, cand)
+        cand_cross_grad_full = self.cov_func.grad_x(self.ls, compfull, cand)
         grad_cross_full = np.squeeze(cand_cross_grad_full)
 
         grad_xp_m = np.dot(alpha.transpose(),grad_cross)
@@ -597,7 +725,7 @@ class GPConstrainedEIChooser:
             return -np.sum(ei), grad_xp.flatten()
 
         # Apply constraint classifier
-        cand_cross_grad = cov_grad_func(self.constraint_ls, compfull, cand)
+        cand_cross_grad = self.cov_func.grad_x(self.constraint_ls, compfull, cand)
         grad_cross_t = np.squeeze(cand_cross_grad)
 
         grad_constraint_xp_m = np.dot(t_alpha.transpose(),grad_cross_t)
@@ -635,8 +763,7 @@ class GPConstrainedEIChooser:
             # Cholesky decompositions
             obsv_constraint_cov  = (comp_constraint_cov +
                 self.constraint_noise*np.eye(compfull.shape[0]))
-            obsv_constraint_chol = spla.cholesky(
-                obsv_constraint_cov, lower=True)
+            obsv_constraint_chol = self.cholesky(obsv_constraint_cov)
 
             # Linear systems
             t_alpha  = spla.cho_solve((obsv_constraint_chol, True), self.ff)
@@ -663,8 +790,8 @@ class GPConstrainedEIChooser:
             obsv_cov  = comp_cov + self.noise*np.eye(comp.shape[0])
             obsv_cov_full  = (comp_cov_full +
                               self.noise*np.eye(compfull.shape[0]))
-            obsv_chol = spla.cholesky( obsv_cov, lower=True)
-            obsv_chol_full = spla.cholesky( obsv_cov_full, lower=True)
+            obsv_chol = self.cholesky(obsv_cov)
+            obsv_chol_full = self.cholesky(obsv_cov_full)
 
             # Solve the linear systems.
             alpha  = spla.cho_solve((obsv_chol, True), vals - self.mean)
@@ -694,7 +821,7 @@ class GPConstrainedEIChooser:
             # Compute the covariance and Cholesky decomposition.
             comp_pend_cov  = (self.cov(self.amp2, self.ls, comp_pend) +
                               self.noise*np.eye(comp_pend.shape[0]))
-            comp_pend_chol = spla.cholesky(comp_pend_cov, lower=True)
+            comp_pend_chol = self.cholesky(comp_pend_cov)
 
             # Compute submatrices.
             pend_cross = self.cov(self.amp2, self.ls, comp, pend)
@@ -712,7 +839,7 @@ class GPConstrainedEIChooser:
             pend_K = pend_kappa - np.dot(pend_cross.T, beta)
 
             # Take the Cholesky of the predictive covariance.
-            pend_chol = spla.cholesky(pend_K, lower=True)
+            pend_chol = self.pend_cholesky(pend_K)
 
             # Make predictions.
             pend_fant = np.dot(pend_chol, npr.randn(pend.shape[0],
@@ -767,7 +894,7 @@ class GPConstrainedEIChooser:
         obsv_constraint_cov  = (comp_constraint_cov +
                                 self.constraint_noise*np.eye(
             compfull.shape[0]))
-        obsv_constraint_chol = spla.cholesky( obsv_constraint_cov, lower=True )
+        obsv_constraint_chol = self.cholesky(obsv_constraint_cov)
 
         # Linear systems
         t_alpha  = spla.cho_solve((obsv_constraint_chol, True), self.ff)
@@ -795,8 +922,8 @@ class GPConstrainedEIChooser:
             obsv_cov  = comp_cov + self.noise*np.eye(comp.shape[0])
             obsv_cov_full  = (comp_cov_full +
                               self.noise*np.eye(compfull.shape[0]))
-            obsv_chol = spla.cholesky( obsv_cov, lower=True )
-            obsv_chol_full = spla.cholesky( obsv_cov_full, lower=True )
+            obsv_chol = self.cholesky(obsv_cov)
+            obsv_chol_full = self.cholesky(obsv_cov_full)
 
             # Solve the linear systems.
             alpha  = spla.cho_solve((obsv_chol, True), vals - self.mean)
@@ -826,7 +953,7 @@ class GPConstrainedEIChooser:
             self.ff_samples = []
             comp_cov  = self.cov(self.constraint_amp2, self.constraint_ls, comp)
             obsv_cov  = comp_cov + 1e-6*np.eye(comp.shape[0])
-            obsv_chol = spla.cholesky(obsv_cov, lower=True)
+            obsv_chol = self.cholesky(obsv_cov)
             self.ff = np.dot(obsv_chol,npr.randn(obsv_chol.shape[0]))
 
         self._sample_constraint_noisy(comp, labels)
@@ -836,8 +963,13 @@ class GPConstrainedEIChooser:
                                               self.constraint_amp2,
                                               self.constraint_ls))
         self.ff_samples.append(self.ff)
+        # The gain is sampled last, so the factorization used by the
+        # elliptical slice sampler is still the one of this sample.
+        self.constraint_alpha_samples.append(
+            spla.cho_solve((self.constraint_chol, True), self.ff))
 
     def sample_hypers(self, comp, vals):
+        self.mean = self.clip_to_values(self.mean, vals)
         if self.noiseless:
             self.noise = 1e-3
             self._sample_noiseless(comp, vals)
@@ -855,7 +987,7 @@ class GPConstrainedEIChooser:
             cov   = (self.amp2 * (self.cov_func(ls, comp, None) +
                                   1e-6*np.eye(comp.shape[0])) +
                      self.noise*np.eye(comp.shape[0]))
-            chol  = spla.cholesky(cov, lower=True)
+            chol  = self.cholesky(cov)
             solve = spla.cho_solve((chol, True), vals - self.mean)
             lp    = (-np.sum(np.log(np.diag(chol))) -
                       0.5*np.dot(vals-self.mean, solve))
@@ -865,7 +997,9 @@ class GPConstrainedEIChooser:
 
     def _sample_constraint_ls(self, comp, vals):
         def lpProbit(ff, gain=self.constraint_gain):
-            probs = sps.norm.cdf(ff*gain)
+            # ndtr is norm.cdf without the argument checking, which
+            # dominates for the many elliptical slice evaluations.
+            probs = ndtr(ff*gain)
             probs[probs <= 0] = 1e-12
             probs[probs >= 1] = 1-1e-12
             llh = np.sum(vals*np.log(probs) +
@@ -880,39 +1014,35 @@ class GPConstrainedEIChooser:
             llh   = np.sum(vals*np.log(probs) + (1-vals)*np.log(1-probs));
             return llh
 
+        # Neither likelihood depends on the constraint covariance, so they
+        # are evaluated without factorizing it.
         def updateGain(gain):
             if gain < 0.01 or gain > 10:
                 return -np.inf
 
-            cov   = (self.constraint_amp2 * (self.cov_func(
-                        self.constraint_ls, comp, None) +
-                                             1e-6*np.eye(comp.shape[0])) +
-                     self.constraint_noise*np.eye(comp.shape[0]))
-            chol  = spla.cholesky(cov, lower=True)
-            solve = spla.cho_solve((chol, True), vals)
             lp   = lpProbit(self.ff, gain)
 
             return lp
 
+        ff_lp = lpProbit(self.ff)
+
         def logprob(ls):
             if np.any(ls < 0) or np.any(ls > self.constraint_max_ls):
                 return -np.inf
 
-            cov   = self.constraint_amp2 * (self.cov_func(ls, comp, None) + 1e-6*np.eye(comp.shape[0])) + self.constraint_noise*np.eye(comp.shape[0])
-            chol  = spla.cholesky(cov, lower=True)
-            solve = spla.cho_solve((chol, True), self.ff)
-            lp   = lpProbit(self.ff)
-
-            return lp
+            return ff_lp
 
         hypers = slice_sample(self.constraint_ls, logprob, compwise=True)
         self.constraint_ls = hypers
 
+        # Factorize once for this length scale sample, the factorization is
+        # cached for the predictions.
         cov   = self.constraint_amp2 * (self.cov_func(self.constraint_ls, comp, None) + 1e-6*np.eye(comp.shape[0])) + self.constraint_noise*np.eye(comp.shape[0])
-        chol  = spla.cholesky(cov, lower=False)
+        self.constraint_chol = self.cholesky(cov)
         ff = self.ff
         for jj in range(20):
-            (ff, lpell) = self.elliptical_slice(ff, chol, lpProbit)
+            (ff, lpell) = self.elliptical_slice(ff, self.constraint_chol.T,
+                                                lpProbit)
 
         self.ff = ff
 
@@ -937,7 +1067,7 @@ class GPConstrainedEIChooser:
             cov   = amp2 * ((self.cov_func(self.ls, comp, None) +
                             1e-6*np.eye(comp.shape[0])) +
                             noise*np.eye(comp.shape[0]))
-            chol  = spla.cholesky(cov, lower=True)
+            chol  = self.cholesky(cov)
             solve = spla.cho_solve((chol, True), vals - mean)
             lp    = -np.sum(np.log(np.diag(chol)))-0.5*np.dot(vals-mean, solve)
 
@@ -958,7 +1088,7 @@ class GPConstrainedEIChooser:
 
     def _sample_constraint_noisy(self, comp, vals):
         def lpProbit(ff, gain=self.constraint_gain):
-            probs = sps.norm.cdf(ff*gain)
+            probs = ndtr(ff*gain)
             probs[probs <= 0] = 1e-12
             probs[probs >= 1] = 1-1e-12
             llh = np.sum(vals*np.log(probs) +
@@ -983,7 +1113,7 @@ class GPConstrainedEIChooser:
 
             noise = self.constraint_noise
             cov   = amp2 * (self.cov_func(self.constraint_ls, comp, None) + 1e-6*np.eye(comp.shape[0])) + noise*np.eye(comp.shape[0])
-            chol  = spla.cholesky(cov, lower=True)
+            chol  = self.cholesky(cov)
             solve = spla.cho_solve((chol, True), ff)
             lp    = -np.sum(np.log(np.diag(chol)))-0.5*np.dot(ff, solve)
 
@@ -1002,7 +1132,7 @@ class GPConstrainedEIChooser:
                     self.cov_func(self.constraint_ls, comp, None) +
                     1e-6*np.eye(comp.shape[0])) +
                                 self.constraint_noise*np.eye(comp.shape[0]))
-        chol  = spla.cholesky(cov, lower=False)
+        chol  = self.cholesky(cov, lower=False)
         ff = self.ff
         for jj in range(50):
             (ff, lpell) = self.elliptical_slice(ff, chol, lpProbit)
@@ -1024,7 +1154,7 @@ class GPConstrainedEIChooser:
             cov   = amp2 * ((self.cov_func(self.ls, comp, None) +
                              1e-6*np.eye(comp.shape[0])) +
                             noise*np.eye(comp.shape[0]))
-            chol  = spla.cholesky(cov, lower=True)
+            chol  = self.cholesky(cov)
             solve = spla.cho_solve((chol, True), vals - mean)
             lp    = -np.sum(np.log(np.diag(chol)))-0.5*np.dot(vals-mean, solve)
 
@@ -38,10 +38,9 @@ import scipy.optimize as spo
 import multiprocessing
 
 import time
-import copy
 
 from . import gp
-from .utils import slice_sample
+from .utils import slice_sample, WarmStartMixin, WorkerPoolMixin
 
 
 def optimize_pt(c, b, comp, pend, vals, model):
@@ -51,11 +50,18 @@ def optimize_pt(c, b, comp, pend, vals, model):
     return ret[0]
 
 
-class GPEIOptChooser:
+class GPEIOptChooser(WarmStartMixin, WorkerPoolMixin):
     def __init__(self, covar="Matern52", mcmc_iters=10,
                  pending_samples=100, noiseless=False, burnin=100,
-                 grid_subset=20, use_multiprocessing=True):
-        self.cov_func        = getattr(gp, covar)
+                 grid_subset=20, use_multiprocessing=True,
+                 ei_memory_budget=256, num_processes=None,
+                 batch_optimize=False, precision="float64", refine_steps=0,
+                 hyper_restarts=5):
+        self.cov_func        = gp.Kernel(covar)
+        self.cholesky        = gp.JitterCholesky()
+        # The nearly singular covariance of the pending fantasies keeps its
+        # own jitter.
+        self.pend_cholesky   = gp.JitterCholesky()
 
         self.mcmc_iters      = int(mcmc_iters)
         self.burnin          = int(burnin)
@@ -72,8 +78,32 @@ class GPEIOptChooser:
         self.amp2_scale  = 1    # zero-mean log normal prior
         self.max_ls      = 2    # top-hat prior on length scales
 
+        # Optimize all starting points with a single vectorized L-BFGS run
+        # (faster, but the points differ, see optimize_ei_batch), otherwise
+        # every point is optimized separately (possibly in the pool)
+        self.batch_optimize = bool(int(batch_optimize))
+
         # If multiprocessing fails or deadlocks, set this to False
         self.use_multiprocessing = bool(int(use_multiprocessing))
+        # Size of the process pool which is kept alive between calls
+        if num_processes is None:
+            num_processes = min(self.grid_subset, multiprocessing.cpu_count())
+        self.num_processes = int(num_processes)
+        self.pool = None
+
+        # Megabytes available for the candidate EI temporaries
+        self.ei_memory_budget = int(ei_memory_budget)
+        # Precision of the candidate EI ("float32" or "float64"), the
+        # gradients and the observed covariance stay in float64
+        self.ei_dtype     = np.dtype(precision).type
+        # Iterative refinement steps of the observed covariance solves
+        self.refine_steps = int(refine_steps)
+
+        # With mcmc_iters=0 the hyperparameters are optimized from up to
+        # hyper_restarts starting points (in the pool when multiprocessing),
+        # warm-started from the previous call
+        self.hyper_restarts = int(hyper_restarts)
+        self.hyper_gp       = None
 
     def _real_init(self, dims, values):
         self.randomstate = npr.get_state()
@@ -128,6 +158,8 @@ class GPEIOptChooser:
         best_comp = np.argmin(vals)
         cand2 = np.vstack((np.random.randn(10,comp.shape[1])*0.001 +
                            comp[best_comp,:], cand))
+        for dim, value in self.fixed_coords.items():
+            cand2[:,dim] = value
 
         if self.mcmc_iters > 0:
 
@@ -143,22 +175,26 @@ class GPEIOptChooser:
             for mcmc_iter in range(self.mcmc_iters):
                 self.sample_hypers(comp, vals)
 
-            b = []# optimization bounds
-            for i in range(0, cand.shape[1]):
-                b.append((0, 1))
+            b = self.point_bounds(cand.shape[1]) # optimization bounds
 
             overall_ei = self.ei_over_hypers(comp,pend,cand2,vals)
             inds = np.argsort(np.mean(overall_ei,axis=1))[-self.grid_subset:]
             cand2 = cand2[inds,:]
 
+            if self.batch_optimize:
+                cand2 = self.optimize_ei_batch(cand2, comp, pend, vals,
+                                               self.hyper_samples[:self.mcmc_iters])
+                cand = np.vstack((cand, cand2))
             # Optimize each point in parallel
-            if self.use_multiprocessing:
-                pool = multiprocessing.Pool(self.grid_subset)
-                results = [pool.apply_async(optimize_pt,args=(
-                            c,b,comp,pend,vals,copy.copy(self))) for c in cand2]
-                for res in results:
-                    cand = np.vstack((cand, res.get(1e8)))
-                pool.close()
+            elif self.use_multiprocessing:
+                # Every worker gets one chunk of starting points, so the
+                # model and data are pickled only once per worker.
+                chunksize = int(np.ceil(cand2.shape[0] /
+                                        float(self.num_processes)))
+                results = self.get_pool().starmap(
+                    optimize_pt, [(c,b,comp,pend,vals,self) for c in cand2],
+                    chunksize=chunksize)
+                cand = np.vstack([cand] + results)
             else:
                 # This is old code to optimize each point in parallel.
                 for i in range(0, cand2.shape[0]):
@@ -180,16 +216,11 @@ class GPEIOptChooser:
             # Optimize hyperparameters
             self.optimize_hypers(comp, vals)
 
-            # Optimize over EI
-            b = []# optimization bounds
-            for i in range(0, cand.shape[1]):
-                b.append((0, 1))
-
-            for i in range(0, cand2.shape[0]):
-                ret = spo.fmin_l_bfgs_b(self.grad_optimize_ei,
-                                        cand2[i,:].flatten(), args=(comp,vals,True),
-                                        bounds=b, disp=0)
-                cand2[i,:] = ret[0]
+            # Optimize over EI from the candidates with the highest EI
+            hyper = [(self.mean, self.noise, self.amp2, self.ls)]
+            ei = self.compute_ei(comp, pend, cand2, vals)
+            cand2 = cand2[np.argsort(ei)[-self.grid_subset:],:]
+            cand2 = self.optimize_ei_batch(cand2, comp, pend, vals, hyper)
             cand = np.vstack((cand, cand2))
 
             ei = self.compute_ei(comp, pend, cand, vals)
@@ -200,18 +231,60 @@ class GPEIOptChooser:
 
             return int(candidates[best_cand])
 
+    # Standard normal draws used to fantasize the pending outcomes. The random
+    # state is reset so that every evaluation sees the same fantasies.
+    def fantasy_randn(self, pend):
+        if pend.shape[0] == 0:
+            return None
+        npr.set_state(self.randomstate)
+        return npr.randn(pend.shape[0], self.pending_samples)
+
+    # Maximize EI averaged over hyper_samples from every row of cand as a
+    # starting point. With batch_optimize all the points are packed into one
+    # L-BFGS problem, so every iteration evaluates EI and its gradient for
+    # all points and samples in a single vectorized call. This is not the
+    # same as optimizing them separately: the points share the line search,
+    # the curvature pairs and the stopping criterion, so a badly conditioned
+    # point shortens the steps of all of them and the converged ones keep
+    # moving until all have converged. Otherwise every point is optimized
+    # separately, with the posterior computed once.
+    def optimize_ei_batch(self, cand, comp, pend, vals, hyper_samples):
+        hypers = gp.stack_hypers(hyper_samples)
+        post = gp.batch_ei_posterior(self.cov_func, hypers, comp, pend, vals,
+                                     self.fantasy_randn(pend), self.cholesky,
+                                     self.refine_steps)
+        num_samples = len(hyper_samples)
+
+        def neg_ei(x):
+            ei, grad = gp.batch_ei_grad(self.cov_func, hypers, post,
+                                        x.reshape(-1, cand.shape[1]))
+            return (-np.sum(ei) / num_samples,
+                    -np.sum(grad, axis=0).flatten() / num_samples)
+
+        starts = [cand] if self.batch_optimize else [c[None] for c in cand]
+        for start in starts:
+            b = self.point_bounds(cand.shape[1]) * start.shape[0]
+            ret = spo.fmin_l_bfgs_b(neg_ei, start.flatten(), bounds=b, disp=0)
+            start[:] = ret[0].reshape(start.shape)
+        return cand
+
+    # Optimization bounds of every coordinate of a point, the fixed_coords
+    # can't move.
+    def point_bounds(self, dims):
+        return [(self.fixed_coords[i], self.fixed_coords[i])
+                if i in self.fixed_coords else (0, 1) for i in range(dims)]
+
     # Compute EI over hyperparameter samples
     def ei_over_hypers(self,comp,pend,cand,vals):
-        overall_ei = np.zeros((cand.shape[0], self.mcmc_iters))
-        for mcmc_iter in range(self.mcmc_iters):
-            hyper = self.hyper_samples[mcmc_iter]
-            self.mean = hyper[0]
-            self.noise = hyper[1]
-            self.amp2 = hyper[2]
-            self.ls = hyper[3]
-            overall_ei[:,mcmc_iter] = self.compute_ei(comp, pend, cand,
-                                                      vals)
-        return overall_ei
+        # All samples are evaluated at once as stacked linear algebra and
+        # share the same fantasies for the pending experiments.
+        fant_randn = self.fantasy_randn(pend)
+        overall_ei = gp.batch_ei(self.cov_func,
+                                 gp.stack_hypers(self.hyper_samples[:self.mcmc_iters]),
+                                 comp, pend, cand, vals, fant_randn,
+                                 self.ei_memory_budget, self.cholesky,
+                                 self.ei_dtype, self.refine_steps)
+        return overall_ei.T
 
     def check_grad_ei(self, cand, comp, pend, vals):
         (ei,dx1) = self.grad_optimize_ei_over_hypers(cand, comp, pend, vals)
@@ -272,10 +345,9 @@ class GPEIOptChooser:
 
             # Compute the required Cholesky.
             obsv_cov  = comp_cov + self.noise*np.eye(comp.shape[0])
-            obsv_chol = spla.cholesky(obsv_cov, lower=True)
+            obsv_chol = self.cholesky(obsv_cov)
 
-            cov_grad_func = getattr(gp, 'grad_' + self.cov_func.__name__)
-            cand_cross_grad = cov_grad_func(self.ls, comp, cand)
+            cand_cross_grad = self.cov_func.grad_x(self.ls, comp, cand)
 
             # Predictive things.
             # Solve the linear systems.
@@ -322,7 +394,7 @@ class GPEIOptChooser:
             # Compute the covariance and Cholesky decomposition.
             comp_pend_cov  = (self.cov(comp_pend) +
                               self.noise*np.eye(comp_pend.shape[0]))
-            comp_pend_chol = spla.cholesky(comp_pend_cov, lower=True)
+            comp_pend_chol = self.cholesky(comp_pend_cov)
 
             # Compute submatrices.
             pend_cross = self.cov(comp, pend)
@@ -340,7 +412,7 @@ class GPEIOptChooser:
             pend_K = pend_kappa - np.dot(pend_cross.T, beta)
 
             # Take the Cholesky of the predictive covariance.
-            pend_chol = spla.cholesky(pend_K, lower=True)
+            pend_chol = self.pend_cholesky(pend_K)
 
             # Make predictions.
             npr.set_state(self.randomstate)
@@ -356,8 +428,7 @@ class GPEIOptChooser:
 
             # Now generalize from these fantasies.
             cand_cross = self.cov(comp_pend, cand)
-            cov_grad_func = getattr(gp, 'grad_' + self.cov_func.__name__)
-            cand_cross_grad = cov_grad_func(self.ls, comp_pend, cand)
+            cand_cross_grad = self.cov_func.grad_x(self.ls, comp_pend, cand)
 
             # Solve the linear systems.
             alpha  = spla.cho_solve((comp_pend_chol, True),
@@ -398,100 +469,15 @@ class GPEIOptChooser:
             return ei, grad_xp.flatten()
 
     def compute_ei(self, comp, pend, cand, vals):
-        if pend.shape[0] == 0:
-            # If there are no pending, don't do anything fancy.
-
-            # Current best.
-            best = np.min(vals)
-
-            # The primary covariances for prediction.
-            comp_cov   = self.cov(comp)
-            cand_cross = self.cov(comp, cand)
-
-            # Compute the required Cholesky.
-            obsv_cov  = comp_cov + self.noise*np.eye(comp.shape[0])
-            obsv_chol = spla.cholesky( obsv_cov, lower=True )
-
-            # Solve the linear systems.
-            alpha  = spla.cho_solve((obsv_chol, True), vals - self.mean)
-            beta   = spla.solve_triangular(obsv_chol, cand_cross, lower=True)
-
-            # Predict the marginal means and variances at candidates.
-            func_m = np.dot(cand_cross.T, alpha) + self.mean
-            func_v = self.amp2*(1+1e-6) - np.sum(beta**2, axis=0)
-
-            # Expected improvement
-            func_s = np.sqrt(func_v)
-            u      = (best - func_m) / func_s
-            ncdf   = sps.norm.cdf(u)
-            npdf   = sps.norm.pdf(u)
-            ei     = func_s*( u*ncdf + npdf)
-
-            return ei
-        else:
-            # If there are pending experiments, fantasize their outcomes.
-
-            # Create a composite vector of complete and pending.
-            comp_pend = np.concatenate((comp, pend))
-
-            # Compute the covariance and Cholesky decomposition.
-            comp_pend_cov  = (self.cov(comp_pend) +
-                              self.noise*np.eye(comp_pend.shape[0]))
-            comp_pend_chol = spla.cholesky(comp_pend_cov, lower=True)
-
-            # Compute submatrices.
-            pend_cross = self.cov(comp, pend)
-            pend_kappa = self.cov(pend)
-
-            # Use the sub-Cholesky.
-            obsv_chol = comp_pend_chol[:comp.shape[0],:comp.shape[0]]
-
-            # Solve the linear systems.
-            alpha  = spla.cho_solve((obsv_chol, True), vals - self.mean)
-            beta   = spla.cho_solve((obsv_chol, True), pend_cross)
-
-            # Finding predictive means and variances.
-            pend_m = np.dot(pend_cross.T, alpha) + self.mean
-            pend_K = pend_kappa - np.dot(pend_cross.T, beta)
-
-            # Take the Cholesky of the predictive covariance.
-            pend_chol = spla.cholesky(pend_K, lower=True)
-
-            # Make predictions.
-            npr.set_state(self.randomstate)
-            pend_fant = np.dot(pend_chol, npr.randn(pend.shape[0],self.pending_samples)) + pend_m[:,None]
-
-            # Include the fantasies.
-            fant_vals = np.concatenate(
-                (np.tile(vals[:,np.newaxis],
-                         (1,self.pending_samples)), pend_fant))
-
-            # Compute bests over the fantasies.
-            bests = np.min(fant_vals, axis=0)
-
-            # Now generalize from these fantasies.
-            cand_cross = self.cov(comp_pend, cand)
-
-            # Solve the linear systems.
-            alpha  = spla.cho_solve((comp_pend_chol, True),
-                                    fant_vals - self.mean)
-            beta   = spla.solve_triangular(comp_pend_chol, cand_cross,
-                                           lower=True)
-
-            # Predict the marginal means and variances at candidates.
-            func_m = np.dot(cand_cross.T, alpha) + self.mean
-            func_v = self.amp2*(1+1e-6) - np.sum(beta**2, axis=0)
-
-            # Expected improvement
-            func_s = np.sqrt(func_v[:,np.newaxis])
-            u      = (bests[np.newaxis,:] - func_m) / func_s
-            ncdf   = sps.norm.cdf(u)
-            npdf   = sps.norm.pdf(u)
-            ei     = func_s*( u*ncdf + npdf)
-
-            return np.mean(ei, axis=1)
+        hypers = gp.stack_hypers([(self.mean, self.noise, self.amp2, self.ls)])
+        fant_randn = self.fantasy_randn(pend)
+        return gp.batch_ei(self.cov_func, hypers, comp, pend, cand, vals,
+                           fant_randn, self.ei_memory_budget,
+                           self.cholesky, self.ei_dtype,
+                           self.refine_steps)[0]
 
     def sample_hypers(self, comp, vals):
+        self.mean = self.clip_to_values(self.mean, vals)
         if self.noiseless:
             self.noise = 1e-3
             self._sample_noiseless(comp, vals)
@@ -507,7 +493,7 @@ class GPEIOptChooser:
 
             cov   = (self.amp2 * (self.cov_func(ls, comp, None) +
                 1e-6*np.eye(comp.shape[0])) + self.noise*np.eye(comp.shape[0]))
-            chol  = spla.cholesky(cov, lower=True)
+            chol  = self.cholesky(cov)
             solve = spla.cho_solve((chol, True), vals - self.mean)
             lp    = (-np.sum(np.log(np.diag(chol))) -
                       0.5*np.dot(vals-self.mean, solve))
@@ -530,7 +516,7 @@ class GPEIOptChooser:
 
             cov   = (amp2 * (self.cov_func(self.ls, comp, None) +
                 1e-6*np.eye(comp.shape[0])) + noise*np.eye(comp.shape[0]))
-            chol  = spla.cholesky(cov, lower=True)
+            chol  = self.cholesky(cov)
             solve = spla.cho_solve((chol, True), vals - mean)
             lp    = -np.sum(np.log(np.diag(chol)))-0.5*np.dot(vals-mean, solve)
 
@@ -563,7 +549,7 @@ class GPEIOptChooser:
 
             cov   = (amp2 * (self.cov_func(self.ls, comp, None) +
                 1e-6*np.eye(comp.shape[0])) + noise*np.eye(comp.shape[0]))
-            chol  = spla.cholesky(cov, lower=True)
+            chol  = self.cholesky(cov)
             solve = spla.cho_solve((chol, True), vals - mean)
             lp    = -np.sum(np.log(np.diag(chol)))-0.5*np.dot(vals-mean, solve)
 
@@ -579,9 +565,16 @@ class GPEIOptChooser:
         self.noise = 1e-3
 
     def optimize_hypers(self, comp, vals):
-        mygp = gp.GP(self.cov_func.__name__)
-        mygp.real_init(comp.shape[1], vals)
-        mygp.optimize_hypers(comp,vals)
+        if self.hyper_gp is None:
+            self.hyper_gp = gp.GP(self.cov_func.__name__,
+                                  num_restarts=self.hyper_restarts,
+                                  task_dim=self.cov_func.task_dim)
+            self.hyper_gp.real_init(comp.shape[1], vals)
+        mygp = self.hyper_gp
+        if self.use_multiprocessing and self.num_processes > 1:
+            mygp.fit_hypers(comp, vals, self.get_pool(), self.num_processes)
+        else:
+            mygp.fit_hypers(comp, vals)
         self.mean = mygp.mean
         self.ls = mygp.ls
         self.amp2 = mygp.amp2
@@ -0,0 +1,168 @@
+# Copyright (c) 2018 NVIDIA Corporation
+
+"""
+Chooser module for multi-fidelity Bayesian optimization. The last input
+dimension is the fidelity (e.g. the number of epochs or the fraction of the
+dataset), so the GP models the objective jointly over the parameters and the
+fidelity, with a separate length scale for the fidelity. Every candidate is
+paired with each of the fidelity_levels, and the pair with the largest
+information gain about the minimum at the full fidelity (the last level) per
+unit of cost is selected. The information gain is the approximation of Moss
+et al. ("GIBBON: General-purpose Information-Based Bayesian OptimisatioN",
+JMLR 2021) with minimum values sampled from the independent marginals at the
+full fidelity (Wang and Jegelka, "Max-value Entropy Search for Efficient
+Bayesian Optimization", ICML 2017). Pending experiments are included with
+their outcomes fixed to the predicted mean, which lowers the information
+gain of the points close to them.
+"""
+
+import numpy as np
+import scipy.linalg as spla
+from scipy.special import log_ndtr
+
+from . import gp
+from .utils import WarmStartMixin
+
+
+class MFChooser(WarmStartMixin):
+  def __init__(self, fidelity_levels, fidelity_costs, covar="Matern52",
+               num_min_samples=10, hyper_restarts=3, noiseless=False):
+    self.cov_func = gp.Kernel(covar)
+    self.cholesky = gp.JitterCholesky()
+    # unit hypercube coordinates of the fidelities and their relative costs
+    self.fidelity_levels = np.array(fidelity_levels, dtype=float)
+    self.fidelity_costs = np.array(fidelity_costs, dtype=float)
+    self.num_min_samples = int(num_min_samples)
+    self.hyper_restarts = int(hyper_restarts)
+    self.noiseless = bool(int(noiseless))
+    self.hyper_gp = None
+    self.D = -1
+    # (grid index, fidelity level) pairs that have already been suggested
+    self.suggested = set()
+
+  def _real_init(self, dims, values):
+    self.D = dims
+    self.hyper_gp = gp.GP(self.cov_func.__name__,
+                          num_restarts=self.hyper_restarts,
+                          task_dim=self.cov_func.task_dim)
+    self.hyper_gp.real_init(dims, values)
+
+  def _with_fidelity(self, x, level):
+    point = x.copy()
+    point[-1] = self.fidelity_levels[level]
+    return point
+
+  def _sample_minimums(self, mean, std, best):
+    """Samples the minimum of independent Gaussians with ``mean`` and
+    ``std`` by inverting its distribution function at evenly spaced
+    quantiles with bisection. The minimum can't exceed ``best``.
+    """
+    quantiles = (np.arange(self.num_min_samples) + 0.5) / self.num_min_samples
+    lower = np.zeros(self.num_min_samples) + np.min(mean - 10 * std)
+    upper = np.zeros(self.num_min_samples) + np.min(mean + 10 * std)
+    for _ in range(50):
+      mid = 0.5 * (lower + upper)
+      # log P(min > mid)
+      log_surv = np.sum(log_ndtr((mean[None] - mid[:, None]) / std[None]),
+                        axis=1)
+      above = log_surv > np.log(1.0 - quantiles)
+      lower = np.where(above, mid, lower)
+      upper = np.where(above, upper, mid)
+    return np.minimum(0.5 * (lower + upper), best)
+
+  def _acquisition(self, comp, vals, pend, cand):
+    """Returns the information gain per unit of cost of every candidate at
+    every fidelity level, an array of shape (#cand, #levels).
+    """
+    mygp = self.hyper_gp
+    noise = 1e-6 if self.noiseless else mygp.noise
+    diffs = vals - mygp.mean
+    cov = mygp.cov(comp) + noise * np.eye(comp.shape[0])
+    chol = self.cholesky(cov)
+    if pend.shape[0] > 0:
+      # the pending outcomes are the predicted means, which only lowers the
+      # variances
+      pend_mean = mygp.mean + mygp.cov(pend, comp).dot(
+        spla.cho_solve((chol, True), diffs)
+      )
+      comp = np.vstack((comp, pend))
+      diffs = np.hstack((diffs, pend_mean - mygp.mean))
+      cov = mygp.cov(comp) + noise * np.eye(comp.shape[0])
+      chol = self.cholesky(cov)
+    alpha = spla.cho_solve((chol, True), diffs)
+
+    num_levels = self.fidelity_levels.shape[0]
+    points = np.tile(cand, (num_levels, 1))
+    points[:, -1] = np.repeat(self.fidelity_levels, cand.shape[0])
+    cand_cross = mygp.cov(comp, points)
+    means = mygp.mean + cand_cross.T.dot(alpha)
+    beta = spla.solve_triangular(chol, cand_cross, lower=True)
+    beta = beta.reshape(beta.shape[0], num_levels, cand.shape[0])
+    means = means.reshape(num_levels, cand.shape[0])
+    variances = mygp.amp2 * (1 + 1e-6) - np.sum(beta ** 2, axis=0)
+    variances = np.maximum(variances, 1e-12)
+    # the prior covariance of two points that differ only in the fidelity
+    same_cand = points[::cand.shape[0]]
+    prior_cross = mygp.cov(same_cand, same_cand[-1:])[:, 0]
+    cross = (prior_cross[:, None] -
+             np.sum(beta * beta[:, -1:], axis=0))
+
+    target_std = np.sqrt(variances[-1])
+    observed = (np.abs(comp[:vals.shape[0], -1] - self.fidelity_levels[-1]) <
+                1e-9)
+    best = np.min(vals[observed]) if np.any(observed) else np.inf
+    mins = self._sample_minimums(means[-1], target_std, best)
+    gamma = (means[-1][None] - mins[:, None]) / target_std[None]
+    ratio = np.exp(-0.5 * gamma ** 2 - 0.5 * np.log(2 * np.pi) -
+                   log_ndtr(gamma))
+    # variance reduction of the truncated full fidelity outcome
+    shrinkage = np.mean(gamma * ratio + ratio ** 2, axis=0)
+    corr2 = cross ** 2 / ((variances + noise) * variances[-1:])
+    gain = -0.5 * np.log(np.maximum(1.0 - corr2 * shrinkage[None], 1e-12))
+    return (gain / self.fidelity_costs[:, None]).T
+
+  def next(self, grid, values, durations, candidates, pending, complete):
+    return self.next_batch(grid, values, durations, candidates, pending,
+                           complete, 1)[0]
+
+  def next_batch(self, grid, values, durations, candidates, pending,
+                 complete, num_points):
+    results = []
+    # the initial experiments are random candidates at the lowest fidelity,
+    # or uniformly random points once the candidates are used up
+    if complete.shape[0] < 2:
+      fresh = [idx for idx in candidates if (idx, 0) not in self.suggested]
+      for k in range(num_points):
+        if k < len(fresh):
+          self.suggested.add((int(fresh[k]), 0))
+          point = grid[fresh[k]]
+        else:
+          point = np.random.rand(grid.shape[1])
+          for dim, value in self.fixed_coords.items():
+            point[dim] = value
+        results.append((grid.shape[0] + k, self._with_fidelity(point, 0)))
+      return results
+
+    comp = grid[complete, :]
+    vals, _ = gp.GP.standardize(values[complete])
+    if self.D == -1:
+      self._real_init(grid.shape[1], vals)
+    self.hyper_gp.fit_hypers(comp, vals)
+
+    pend = grid[pending, :]
+    cand = grid[candidates, :]
+    for k in range(num_points):
+      acq = self._acquisition(comp, vals, pend, cand)
+      # the suggestions are new points, so the candidates stay candidates
+      # and have to be excluded at the fidelities they were suggested with
+      for idx, level in self.suggested:
+        pos = np.searchsorted(candidates, idx)
+        if pos < candidates.shape[0] and candidates[pos] == idx:
+          acq[pos, level] = -np.inf
+      best, level = np.unravel_index(np.argmax(acq), acq.shape)
+      self.suggested.add((int(candidates[best]), int(level)))
+      point = self._with_fidelity(cand[best], level)
+      results.append((grid.shape[0] + k, point))
+      # the rest of the batch treats the point as pending
+      pend = np.vstack((pend, point))
+    return results
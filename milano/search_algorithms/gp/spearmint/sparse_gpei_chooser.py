@@ -0,0 +1,265 @@
+# Copyright (c) 2018 NVIDIA Corporation
+
+"""
+Chooser module for the Gaussian process expected improvement acquisition
+function using the FITC sparse approximation (Snelson and Ghahramani,
+"Sparse Gaussian Processes using Pseudo-inputs", NIPS 2005). The GP is
+conditioned on m inducing points selected from the completed experiments,
+so that every likelihood evaluation and prediction costs O(n*m^2) instead
+of O(n^3). This makes slice sampling of the hyperparameters affordable for
+studies with thousands of completed experiments. Pending experiments are
+included with their outcomes fixed to the predicted mean.
+"""
+
+import numpy          as np
+import scipy.linalg   as spla
+import scipy.optimize as spo
+import scipy.stats    as sps
+
+from . import gp
+from .utils import slice_sample, WarmStartMixin
+
+
+class SparseGPEIChooser(WarmStartMixin):
+  def __init__(self, covar="Matern52", mcmc_iters=10, num_inducing=100,
+               noiseless=False):
+    self.cov_func = gp.Kernel(covar)
+    self.cholesky = gp.JitterCholesky()
+
+    self.mcmc_iters = int(mcmc_iters)
+    self.num_inducing = int(num_inducing)
+    self.D = -1
+    self.noiseless = bool(int(noiseless))
+    self.hyper_samples = []
+
+    self.noise_scale = 0.1  # horseshoe prior
+    self.amp2_scale = 1  # zero-mean log normal prior
+    self.max_ls = 2  # top-hat prior on length scales
+
+  def _real_init(self, dims, values):
+    # Input dimensionality.
+    self.D = dims
+
+    # Initial length scales.
+    self.ls = np.ones(self.D)
+
+    # Initial amplitude.
+    self.amp2 = np.std(values) + 1e-4
+
+    # Initial observation noise.
+    self.noise = 1e-3
+
+    # Initial mean.
+    self.mean = np.mean(values)
+
+  def next(self, grid, values, durations, candidates, pending, complete):
+
+    # Don't bother using fancy GP stuff at first.
+    if complete.shape[0] < 2:
+      return int(candidates[0])
+
+    # Perform the real initialization.
+    if self.D == -1:
+      self._real_init(grid.shape[1], values[complete])
+
+    # Grab out the relevant sets.
+    comp = grid[complete, :]
+    cand = grid[candidates, :]
+    pend = grid[pending, :]
+    vals = values[complete]
+
+    inducing = self.select_inducing(comp, vals)
+
+    self.hyper_samples = []
+    if self.mcmc_iters > 0:
+      # Sample from hyperparameters.
+      for mcmc_iter in range(self.mcmc_iters):
+        self.sample_hypers(inducing, comp, vals)
+    else:
+      # Optimize hyperparameters
+      self.optimize_hypers(inducing, comp, vals)
+
+    overall_ei = np.zeros(cand.shape[0])
+    for hyper in self.hyper_samples:
+      overall_ei += self.compute_ei(inducing, comp, pend, cand, vals, hyper)
+    best_cand = np.argmax(overall_ei)
+
+    return int(candidates[best_cand])
+
+  def select_inducing(self, comp, vals):
+    # Greedy farthest point selection starting from the best observation,
+    # which spreads the inducing points over the explored region and keeps
+    # the incumbent exactly represented. O(n*m) distance evaluations.
+    num_inducing = min(self.num_inducing, comp.shape[0])
+    chosen = [np.argmin(vals)]
+    min_dist = np.sum((comp - comp[chosen[0]]) ** 2, axis=1)
+    for _ in range(num_inducing - 1):
+      chosen.append(np.argmax(min_dist))
+      min_dist = np.minimum(min_dist,
+                            np.sum((comp - comp[chosen[-1]]) ** 2, axis=1))
+    return comp[chosen]
+
+  def fitc(self, inducing, comp, vals, mean, noise, amp2, ls):
+    # Returns the factorizations needed for prediction together with the
+    # log marginal likelihood of the FITC approximation.
+    num_inducing = inducing.shape[0]
+    ind_cov = amp2 * (self.cov_func(ls, inducing, None)
+                      + 1e-6 * np.eye(num_inducing))
+    ind_cross = amp2 * self.cov_func(ls, inducing, comp)
+    ind_chol = self.cholesky(ind_cov)
+
+    # V'V is the Nystrom approximation of the data covariance.
+    V = spla.solve_triangular(ind_chol, ind_cross, lower=True)
+
+    # Diagonal correction plus observation noise.
+    lam = np.maximum(amp2 * (1 + 1e-6) - np.sum(V ** 2, axis=0), 0.0) + noise
+    V_lam = V / np.sqrt(lam)
+    A_chol = self.cholesky(np.eye(num_inducing) + np.dot(V_lam, V_lam.T))
+
+    diffs = (vals - mean) / np.sqrt(lam)
+    gamma = spla.solve_triangular(A_chol, np.dot(V_lam, diffs), lower=True)
+
+    lp = (-0.5 * np.sum(np.log(lam)) - np.sum(np.log(np.diag(A_chol)))
+          - 0.5 * (np.dot(diffs, diffs) - np.dot(gamma, gamma)))
+
+    # Weights of the inducing cross-covariance in the predictive mean.
+    alpha = spla.solve_triangular(
+      ind_chol.T, spla.solve_triangular(A_chol.T, gamma, lower=False),
+      lower=False,
+    )
+    return ind_chol, A_chol, alpha, lp
+
+  def logprob(self, inducing, comp, vals, mean, noise, amp2, ls):
+    try:
+      return self.fitc(inducing, comp, vals, mean, noise, amp2, ls)[3]
+    except (np.linalg.LinAlgError, ValueError):
+      return -np.inf
+
+  def predict(self, inducing, comp, vals, cand, hyper):
+    mean, noise, amp2, ls = hyper
+    ind_chol, A_chol, alpha, _ = self.fitc(inducing, comp, vals,
+                                           mean, noise, amp2, ls)
+    cand_cross = amp2 * self.cov_func(ls, inducing, cand)
+    u = spla.solve_triangular(ind_chol, cand_cross, lower=True)
+    v = spla.solve_triangular(A_chol, u, lower=True)
+
+    # Predict the marginal means and variances at candidates.
+    func_m = np.dot(cand_cross.T, alpha) + mean
+    func_v = (amp2 * (1 + 1e-6) - np.sum(u ** 2, axis=0)
+              + np.sum(v ** 2, axis=0))
+    return func_m, np.maximum(func_v, 1e-12)
+
+  def compute_ei(self, inducing, comp, pend, cand, vals, hyper):
+    best = np.min(vals)
+    if pend.shape[0] > 0:
+      # Fix the pending outcomes to their predicted means.
+      pend_m = self.predict(inducing, comp, vals, pend, hyper)[0]
+      comp = np.concatenate((comp, pend))
+      vals = np.concatenate((vals, pend_m))
+
+    func_m, func_v = self.predict(inducing, comp, vals, cand, hyper)
+
+    # Expected improvement
+    func_s = np.sqrt(func_v)
+    u = (best - func_m) / func_s
+    ncdf = sps.norm.cdf(u)
+    npdf = sps.norm.pdf(u)
+    ei = func_s * (u * ncdf + npdf)
+
+    return ei
+
+  def sample_hypers(self, inducing, comp, vals):
+    self.mean = self.clip_to_values(self.mean, vals)
+    if self.noiseless:
+      self.noise = 1e-3
+      self._sample_noiseless(inducing, comp, vals)
+    else:
+      self._sample_noisy(inducing, comp, vals)
+    self._sample_ls(inducing, comp, vals)
+    self.hyper_samples.append((self.mean, self.noise, self.amp2, self.ls))
+
+  def _sample_ls(self, inducing, comp, vals):
+    def logprob(ls):
+      if np.any(ls < 0) or np.any(ls > self.max_ls):
+        return -np.inf
+      return self.logprob(inducing, comp, vals,
+                          self.mean, self.noise, self.amp2, ls)
+
+    self.ls = slice_sample(self.ls, logprob, compwise=True)
+
+  def _sample_noisy(self, inducing, comp, vals):
+    def logprob(hypers):
+      mean = hypers[0]
+      amp2 = hypers[1]
+      noise = hypers[2]
+
+      # This is pretty hacky, but keeps things sane.
+      if mean > np.max(vals) or mean < np.min(vals):
+        return -np.inf
+
+      if amp2 < 0 or noise < 0:
+        return -np.inf
+
+      lp = self.logprob(inducing, comp, vals, mean, noise, amp2, self.ls)
+
+      # Roll in noise horseshoe prior.
+      lp += np.log(np.log(1 + (self.noise_scale / noise) ** 2))
+
+      # Roll in amplitude lognormal prior
+      lp -= 0.5 * (np.log(amp2) / self.amp2_scale) ** 2
+
+      return lp
+
+    hypers = slice_sample(np.array([self.mean, self.amp2, self.noise]),
+                          logprob, compwise=False)
+    self.mean = hypers[0]
+    self.amp2 = hypers[1]
+    self.noise = hypers[2]
+
+  def _sample_noiseless(self, inducing, comp, vals):
+    def logprob(hypers):
+      mean = hypers[0]
+      amp2 = hypers[1]
+      noise = 1e-3
+
+      if amp2 < 0:
+        return -np.inf
+
+      lp = self.logprob(inducing, comp, vals, mean, noise, amp2, self.ls)
+
+      # Roll in amplitude lognormal prior
+      lp -= 0.5 * (np.log(amp2) / self.amp2_scale) ** 2
+
+      return lp
+
+    hypers = slice_sample(np.array([self.mean, self.amp2, self.noise]),
+                          logprob, compwise=False)
+    self.mean = hypers[0]
+    self.amp2 = hypers[1]
+    self.noise = 1e-3
+
+  def optimize_hypers(self, inducing, comp, vals):
+    # Point estimate of log amplitude, log noise and log length scales
+    # maximizing the FITC marginal likelihood.
+    self.mean = np.mean(vals)
+
+    def nlogprob(hypers):
+      noise = 1e-3 if self.noiseless else np.exp(hypers[1])
+      lp = self.logprob(inducing, comp, vals, self.mean,
+                        noise, np.exp(hypers[0]), np.exp(hypers[2:]))
+      return -lp if np.isfinite(lp) else 1e10
+
+    hypers = np.zeros(self.D + 2)
+    hypers[0] = np.log(np.std(vals) + 1e-4)
+    hypers[1] = np.log(1e-3)
+
+    # Use a bounded bfgs just to prevent the length-scales and noise from
+    # getting into regions that are numerically unstable
+    b = [(-10, 10), (-10, 10)] + [(-10, 5)] * self.D
+    hypers = spo.fmin_l_bfgs_b(nlogprob, hypers, approx_grad=True,
+                               bounds=b, disp=0)[0]
+
+    self.amp2 = np.exp(hypers[0])
+    self.noise = 1e-3 if self.noiseless else np.exp(hypers[1])
+    self.ls = np.exp(hypers[2:])
+    self.hyper_samples.append((self.mean, self.noise, self.amp2, self.ls))
@@ -0,0 +1,237 @@
+# Copyright (c) 2018 NVIDIA Corporation
+
+"""
+Chooser module for trust region Bayesian optimization (Eriksson et al.,
+"Scalable Global Optimization via Local Bayesian Optimization", NeurIPS
+2019). Every trust region is a box around the best point it has found so
+far, stretched along the length scales of a GP that is fitted only to the
+points close to that center. Candidates are perturbations of the center
+within the box and the one with the highest expected improvement is
+selected. The box grows after success_tol consecutive improvements and
+shrinks after failure_tol consecutive failures. A region that shrinks below
+length_min restarts with a new initial design, so the cost of a suggestion is
+bounded by max_local_points rather than by the total number of experiments.
+"""
+
+import numpy as np
+
+from . import gp
+from .utils import WarmStartMixin
+
+
+class _TrustRegion:
+  def __init__(self, length):
+    self.length = length
+    self.num_successes = 0
+    self.num_failures = 0
+    self.best = np.inf
+    # grid indices of the completed experiments proposed by this region
+    # since its last restart
+    self.points = []
+    self.epoch = 0
+    self.gp = None
+
+
+class TuRBOChooser(WarmStartMixin):
+  def __init__(self, covar="Matern52", num_trust_regions=1, num_init=None,
+               length_init=0.8, length_min=0.5 ** 7, length_max=1.6,
+               success_tol=3, failure_tol=None, max_local_points=200,
+               num_candidates=None, hyper_restarts=3, ei_memory_budget=256):
+    self.cov_func = gp.Kernel(covar)
+    self.cholesky = gp.JitterCholesky()
+    self.num_init = num_init
+    self.length_init = float(length_init)
+    self.length_min = float(length_min)
+    self.length_max = float(length_max)
+    self.success_tol = int(success_tol)
+    self.failure_tol = failure_tol
+    self.max_local_points = int(max_local_points)
+    self.num_candidates = num_candidates
+    self.hyper_restarts = int(hyper_restarts)
+    self.ei_memory_budget = ei_memory_budget
+    self.D = -1
+    self.regions = [_TrustRegion(self.length_init)
+                    for _ in range(int(num_trust_regions))]
+    # (region, epoch, whether proposed from the trust region) for every grid
+    # index suggested by this chooser
+    self.owners = {}
+    self.processed = set()
+
+  def _real_init(self, dims):
+    self.D = dims
+    if self.num_init is None:
+      self.num_init = 2 * dims
+    if self.failure_tol is None:
+      self.failure_tol = max(4, dims)
+    if self.num_candidates is None:
+      self.num_candidates = min(100 * dims, 5000)
+
+  def _restart(self, region):
+    region.length = self.length_init
+    region.num_successes = 0
+    region.num_failures = 0
+    region.best = np.inf
+    region.points = []
+    region.epoch += 1
+
+  # Updates the regions with the experiments completed since the last call.
+  def _update(self, values, complete):
+    for idx in complete:
+      if idx in self.processed:
+        continue
+      self.processed.add(idx)
+      if idx not in self.owners:
+        continue
+      region_id, epoch, from_region = self.owners[idx]
+      region = self.regions[region_id]
+      if epoch != region.epoch:
+        continue
+      region.points.append(idx)
+      value = values[idx]
+      improved = value < region.best - 1e-3 * abs(region.best)
+      region.best = min(region.best, value)
+      # the initial design doesn't count as successes or failures
+      if not from_region:
+        continue
+      if improved:
+        region.num_successes += 1
+        region.num_failures = 0
+      else:
+        region.num_successes = 0
+        region.num_failures += 1
+      if region.num_successes == self.success_tol:
+        region.length = min(2.0 * region.length, self.length_max)
+        region.num_successes = 0
+      elif region.num_failures == self.failure_tol:
+        region.length /= 2.0
+        region.num_failures = 0
+      if region.length < self.length_min:
+        self._restart(region)
+
+  def _num_pending(self, pending):
+    counts = np.zeros(len(self.regions), dtype=int)
+    for idx in pending:
+      if idx in self.owners:
+        region_id, epoch, _ = self.owners[idx]
+        if epoch == self.regions[region_id].epoch:
+          counts[region_id] += 1
+    return counts
+
+  # Fits the local GP of the region and returns its hyperparameters, the
+  # bounds of the box and its center.
+  def _fit_region(self, region, grid, values):
+    points = np.array(region.points)
+    center = grid[points[np.argmin(values[points])]]
+    ls = np.ones(self.D) if region.gp is None else region.gp.ls
+    weights = ls / np.mean(ls)
+    weights /= np.prod(weights) ** (1.0 / self.D)
+    half = 0.5 * region.length * weights
+
+    # points closest to the center in the metric of the box, those inside the
+    # box first, but at least D + 1 of them and no more than max_local_points
+    dists = np.max(np.abs(grid[points] - center) / half, axis=1)
+    order = np.argsort(dists, kind='stable')
+    num_local = max(np.sum(dists <= 1.0), min(self.D + 1, points.shape[0]))
+    local = points[order[:min(num_local, self.max_local_points)]]
+    comp = grid[local]
+    # EI is invariant to the scale of the values, but the hyperparameter
+    # bounds aren't
+    vals, _ = gp.GP.standardize(values[local])
+
+    if region.gp is None:
+      region.gp = gp.GP(self.cov_func.__name__,
+                        num_restarts=self.hyper_restarts,
+                        task_dim=self.cov_func.task_dim)
+      region.gp.real_init(self.D, vals)
+    region.gp.fit_hypers(comp, vals)
+    mygp = region.gp
+    # with few local points the likelihood often drives length scales to the
+    # bound, which would stretch the box over whole dimensions
+    mygp.ls = np.clip(mygp.ls, 1e-3, mygp.max_ls)
+    hypers = gp.stack_hypers([(mygp.mean, mygp.noise, mygp.amp2, mygp.ls)])
+
+    weights = mygp.ls / np.mean(mygp.ls)
+    weights /= np.prod(weights) ** (1.0 / self.D)
+    half = 0.5 * region.length * weights
+    lower = np.clip(center - half, 0.0, 1.0)
+    upper = np.clip(center + half, 0.0, 1.0)
+    return hypers, comp, vals, lower, upper, center
+
+  def _fix_coords(self, points):
+    for dim, value in self.fixed_coords.items():
+      points[..., dim] = value
+    return points
+
+  # Perturbs a random subset of the center's coordinates within the box.
+  def _candidates(self, lower, upper, center):
+    num_cand = self.num_candidates
+    perturbed = lower + (upper - lower) * np.random.rand(num_cand, self.D)
+    mask = np.random.rand(num_cand, self.D) < min(20.0 / self.D, 1.0)
+    empty = np.nonzero(~np.any(mask, axis=1))[0]
+    mask[empty, np.random.randint(self.D, size=empty.shape[0])] = True
+    return self._fix_coords(np.where(mask, perturbed, center))
+
+  def next(self, grid, values, durations, candidates, pending, complete):
+    return self.next_batch(grid, values, durations, candidates, pending,
+                           complete, 1)[0]
+
+  def next_batch(self, grid, values, durations, candidates, pending,
+                 complete, num_points):
+    if self.D < 0:
+      self._real_init(grid.shape[1])
+    self._update(values, complete)
+
+    # the points go to the regions with the fewest pending experiments
+    num_pending = self._num_pending(pending)
+    counts = num_pending.copy()
+    region_points = np.zeros(len(self.regions), dtype=int)
+    for _ in range(num_points):
+      region_id = np.argmin(counts)
+      counts[region_id] += 1
+      region_points[region_id] += 1
+
+    results = []
+    num_added = 0
+    remaining = list(np.random.permutation(candidates))
+    for region_id, region in enumerate(self.regions):
+      num_region = region_points[region_id]
+      if num_region == 0:
+        continue
+      num_design = len(region.points) + num_pending[region_id]
+      num_random = int(np.clip(self.num_init - num_design, 0, num_region))
+      # the local GP needs some completed experiments, which might still be
+      # running with many workers
+      if len(region.points) < 2:
+        num_random = num_region
+      # initial design comes from the grid, or is uniformly random once the
+      # grid is used up
+      for _ in range(num_random):
+        if remaining:
+          idx = int(remaining.pop())
+          results.append(idx)
+        else:
+          idx = grid.shape[0] + num_added
+          num_added += 1
+          results.append((idx, self._fix_coords(np.random.rand(self.D))))
+        self.owners[idx] = (region_id, region.epoch, False)
+      num_region -= num_random
+      if num_region == 0:
+        continue
+
+      hypers, comp, vals, lower, upper, center = self._fit_region(
+        region, grid, values,
+      )
+      pend = grid[pending]
+      pend = pend[np.all((pend >= lower) & (pend <= upper), axis=1)]
+      cand = self._candidates(lower, upper, center)
+      best_cands = gp.batch_select(
+        self.cov_func, hypers, comp, pend, cand, vals, num_region,
+        "kriging_believer", self.ei_memory_budget, self.cholesky,
+      )
+      # the new points are appended to the grid one after another
+      for best_cand in best_cands:
+        idx = grid.shape[0] + num_added
+        num_added += 1
+        self.owners[idx] = (region_id, region.epoch, True)
+        results.append((idx, cand[best_cand]))
+    return results
@@ -22,6 +22,10 @@
 
 # This code was modified to be compatible with NVAML project
 
+import multiprocessing
+import os
+import weakref
+
 import numpy        as np
 import numpy.random as npr
 
@@ -91,6 +95,210 @@ def slice_sample(init_x, logprob, sigma=1.0, step_out=True, max_steps_out=1000,
     return direction_slice(direction, init_x)
 
 
+def batch_slice_sample(init_x, batch_logprob, init_lp=None, sigma=1.0,
+                       step_out=True, max_steps_out=1000, compwise=False,
+                       num_proposals=1):
+  """Slice sampling of several independent chains that evaluates all the
+  log-probabilities needed by one step of every chain with a single call of
+  ``batch_logprob(xs, chains)``, which gets a KxD matrix of points and the
+  indices of the chains they belong to and returns K log-probabilities.
+
+  ``init_x`` is a CxD matrix with the current state of C chains (or a vector
+  for a single chain). Both bounds are stepped out at the same time
+  ``num_proposals`` steps at once and ``num_proposals`` points are drawn
+  from the slice per shrinkage round. Points falling out of the interval
+  shrunk by an earlier point of the same round are skipped, so the samples
+  have the same distribution as with ``slice_sample``. Log-probabilities of
+  points that were already evaluated, e.g. the current states, are reused.
+  Returns the new states and their log-probabilities.
+  """
+  single_chain = np.ndim(init_x) < 2
+  cur_x = np.array(init_x, dtype=float, ndmin=2)
+  num_chains, dims = cur_x.shape
+  memo = {}
+
+  def evaluate(xs, chains):
+    lps = np.empty(xs.shape[0])
+    todo = []
+    for i in range(xs.shape[0]):
+      key = (chains[i], xs[i].tobytes())
+      if key in memo:
+        lps[i] = memo[key]
+      else:
+        todo.append(i)
+    if todo:
+      lps[todo] = batch_logprob(xs[todo], chains[todo])
+      for i in todo:
+        memo[(chains[i], xs[i].tobytes())] = lps[i]
+    return lps
+
+  def direction_slice(directions, cur_x, cur_lp):
+    chains = np.arange(num_chains)
+    upper = sigma * npr.rand(num_chains)
+    lower = upper - sigma
+    llh_s = np.log(npr.rand(num_chains)) + cur_lp
+
+    if step_out:
+      # Step out the lower (side 0) and upper (side 1) bounds of all chains
+      bounds = np.vstack((lower, upper))
+      steps = np.zeros((2, num_chains), dtype=int)
+      active = [(side, c) for side in range(2) for c in chains]
+      while active:
+        zs, owners = [], []
+        for side, c in active:
+          num = min(num_proposals, max_steps_out - steps[side, c] + 1)
+          for k in range(num):
+            zs.append(bounds[side, c] + (2 * side - 1) * k * sigma)
+            owners.append((side, c, k))
+        owner_chains = np.array([c for _, c, _ in owners])
+        lps = evaluate(cur_x[owner_chains] +
+                       np.array(zs)[:, np.newaxis] * directions[owner_chains],
+                       owner_chains)
+        done = set()
+        for (side, c, k), lp in zip(owners, lps):
+          if (side, c) in done:
+            continue
+          if lp <= llh_s[c] or steps[side, c] + k >= max_steps_out:
+            bounds[side, c] += (2 * side - 1) * k * sigma
+            steps[side, c] += k
+            done.add((side, c))
+        for side, c in active:
+          if (side, c) not in done:
+            bounds[side, c] += (2 * side - 1) * num_proposals * sigma
+            steps[side, c] += num_proposals
+        active = [owner for owner in active if owner not in done]
+      lower, upper = bounds
+
+    new_x = cur_x.copy()
+    new_lp = cur_lp.copy()
+    active = list(chains)
+    while active:
+      owner_chains = np.repeat(active, num_proposals)
+      zs = ((upper[owner_chains] - lower[owner_chains])
+            * npr.rand(owner_chains.shape[0]) + lower[owner_chains])
+      points = cur_x[owner_chains] + zs[:, np.newaxis] * directions[owner_chains]
+      lps = evaluate(points, owner_chains)
+      accepted = set()
+      for i, c in enumerate(owner_chains):
+        z = zs[i]
+        if c in accepted or z <= lower[c] or z >= upper[c]:
+          continue
+        if np.isnan(lps[i]):
+          print(z, points[i], lps[i], llh_s[c], cur_x[c], cur_lp[c])
+          raise Exception("Slice sampler got a NaN")
+        if lps[i] > llh_s[c]:
+          new_x[c] = points[i]
+          new_lp[c] = lps[i]
+          accepted.add(c)
+        elif z < 0:
+          lower[c] = z
+        elif z > 0:
+          upper[c] = z
+        else:
+          raise Exception("Slice sampler shrank to zero!")
+      active = [c for c in active if c not in accepted]
+
+    return new_x, new_lp
+
+  chains = np.arange(num_chains)
+  if init_lp is None:
+    cur_lp = evaluate(cur_x, chains)
+  else:
+    cur_lp = np.array(init_lp, dtype=float, ndmin=1)
+    for c in chains:
+      memo[(c, cur_x[c].tobytes())] = cur_lp[c]
+
+  if compwise:
+    ordering = np.arange(dims)
+    npr.shuffle(ordering)
+    for d in ordering:
+      directions = np.zeros((num_chains, dims))
+      directions[:, d] = 1.0
+      cur_x, cur_lp = direction_slice(directions, cur_x, cur_lp)
+  else:
+    directions = npr.randn(num_chains, dims)
+    directions /= np.sqrt(np.sum(directions ** 2, axis=1))[:, np.newaxis]
+    cur_x, cur_lp = direction_slice(directions, cur_x, cur_lp)
+
+  if single_chain:
+    return cur_x[0], cur_lp[0]
+  return cur_x, cur_lp
+
+
+def single_threaded_pool(num_processes):
+  """Creates a pool of freshly spawned processes that use single-threaded BLAS,
+  so that the parallel workers don't oversubscribe the cores.
+  """
+  blas_vars = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"]
+  saved_env = {var: os.environ.get(var) for var in blas_vars}
+  # spawned processes copy the environment when they start
+  os.environ.update({var: "1" for var in blas_vars})
+  try:
+    return multiprocessing.get_context("spawn").Pool(num_processes)
+  finally:
+    for var, val in saved_env.items():
+      if val is None:
+        del os.environ[var]
+      else:
+        os.environ[var] = val
+
+
+class WorkerPoolMixin:
+  """Process pool of a chooser with ``self.num_processes`` single-threaded
+  workers (see ``single_threaded_pool``). It is started on the first
+  ``get_pool`` call, kept alive between calls and shut down by ``close``,
+  which should be called when the study is over. The chooser has to set
+  ``self.pool = None`` in its constructor.
+  """
+  def get_pool(self):
+    if self.pool is None:
+      self.pool = single_threaded_pool(self.num_processes)
+      # don't leave the workers behind if close() is never called
+      self._pool_finalizer = weakref.finalize(self, self.pool.terminate)
+    return self.pool
+
+  def close(self):
+    if self.pool is not None:
+      self._pool_finalizer.detach()
+      self.pool.close()
+      self.pool.join()
+      self.pool = None
+
+  def __getstate__(self):
+    # the pool stays in the parent process when the chooser is sent to its
+    # workers
+    state = self.__dict__.copy()
+    state['pool'] = None
+    state.pop('_pool_finalizer', None)
+    return state
+
+
+
+class WarmStartMixin:
+  """Lets GPSearch put the results of previous studies in the grid of a
+  chooser, see ``set_task``. The previous results are rescaled whenever the
+  current study gets new ones, so hyperparameters carried over between calls
+  have to be kept in the range of the values (see ``clip_to_values``). The
+  chooser has to keep its covariance function in ``self.cov_func`` and pass
+  ``self.cov_func.task_dim`` on to the GPs it creates.
+  """
+  # coordinates the suggested points keep, by dimension
+  fixed_coords = {}
+
+  def set_task(self, dim, value):
+    """The grid coordinate ``dim`` tells the studies apart and is ``value``
+    in the current one. The covariance gets a separate factor for it (see
+    ``gp.Kernel``) and the points suggested outside of the grid keep it.
+    """
+    self.cov_func.task_dim = dim
+    self.cov_func.cache = []
+    self.fixed_coords = {dim: value}
+
+  def clip_to_values(self, mean, vals):
+    # the slice sampler can't start from a mean outside of the values
+    return np.clip(mean, np.min(vals), np.max(vals))
+
+
 class Parameter:
   def __init__(self):
     self.type = []
@@ -142,11 +350,20 @@ class GridMap:
                   variable['max'] - variable['min'])
           index += 1
 
+      elif variable['type'] == 'log_float':
+        for dd in range(variable['size']):
+          unit[index] = (np.log(float(v.pop(0))) - np.log(variable['min'])) / (
+                  np.log(variable['max']) - np.log(variable['min']))
+          index += 1
+
       elif variable['type'] == 'enum':
+        # the options are compared as strings, since the values might come
+        # from the command line, and mapped to the middle of their intervals
+        options = [str(option) for option in variable['options']]
         for dd in range(variable['size']):
-          unit[index] = variable['options'].index(v.pop(0))
+          unit[index] = self._index_unmap(options.index(str(v.pop(0))) + 0.5,
+                                          len(options))
           index += 1
-      # TODO: add log_float if this function is going to be used
       else:
         raise Exception("Unknown parameter type.")
 
@@ -0,0 +1,30 @@
+# Copyright (c) 2018 NVIDIA Corporation
+from typing import Mapping
+
+from milano.search_algorithms.gp.gp_search import GPSearch
+from milano.search_algorithms.gp.spearmint.turbo_chooser import TuRBOChooser
+
+
+class TuRBOSearch(GPSearch):
+  """Trust region Bayesian optimization for high-dimensional spaces.
+
+  This is ``GPSearch`` with ``TuRBOChooser``: every trust region fits a
+  local GP only on the completed jobs close to its best point and suggests
+  points inside a box around it, which grows or shrinks depending on
+  whether the suggestions improve on that point. ``chooser_params`` are
+  passed to ``TuRBOChooser``, all other parameters are the same as for
+  ``GPSearch``.
+  """
+  def __init__(self,
+               params_to_tune: Mapping,
+               params_to_try_first: Mapping,
+               objective: str,
+               num_evals: int,
+               random_seed: int = None,
+               chooser_params: Mapping = None,
+               **kwargs) -> None:
+    super().__init__(params_to_tune, params_to_try_first,
+                     objective, num_evals, random_seed,
+                     chooser=TuRBOChooser,
+                     chooser_params=chooser_params,
+                     **kwargs)
@@ -0,0 +1,197 @@
+# Copyright (c) 2018 NVIDIA Corporation
+import os
+import numpy as np
+from typing import Iterable, Mapping, Optional
+
+from .base import SearchAlgorithm
+
+
+class PBTSearch(SearchAlgorithm):
+  """Population-Based Training.
+
+  Every job trains one member of the population. It gets its own
+  checkpoint directory as ``checkpoint_param`` parameter and should
+  periodically report intermediate results (by printing the result pattern
+  followed by the value, just like the final result). Each intermediate
+  result ends a generation of the member. Before reporting the result of its
+  n-th generation (counted from 1 in every job), the job has to save its
+  checkpoint in the "generation_<n>" subdirectory of its checkpoint
+  directory and never change it afterwards.
+
+  When a member reports the result of a generation which at least
+  ``min_peers`` members have reached, it is compared to their results of
+  that generation. If it is in the bottom ``quantile``, the job is stopped
+  (see ``ExecutionManager``) and a new job continues training from the
+  checkpoint of a random member in the top ``quantile`` that hasn't
+  finished training yet: it gets the subdirectory with that member's
+  checkpoint of the last generation it reported as ``restore_param``
+  parameter and its hyperparameters, perturbed. The donor keeps training
+  meanwhile, but doesn't touch that checkpoint, and the generations of the
+  new member are counted from that generation. When
+  a member finishes training or fails, a new member with random
+  hyperparameters is started instead.
+
+  The checkpoint directories are passed as regular parameters, so this works
+  with every backend, but they must not contain spaces or "=" signs.
+  """
+  def __init__(self,
+               params_to_tune: Mapping,
+               params_to_try_first: Mapping,
+               objective: str,
+               num_evals: int,
+               random_seed: int = None,
+               population_size=10,
+               checkpoint_dir="pbt_checkpoints",
+               checkpoint_param="--checkpoint_dir",
+               restore_param="--restore_from",
+               quantile=0.25,
+               min_peers=None,
+               resample_prob=0.25,
+               perturb_factors=(0.8, 1.2)) -> None:
+    super().__init__(params_to_tune, params_to_try_first,
+                     objective, num_evals, random_seed)
+    self._population_size = population_size
+    self._checkpoint_dir = checkpoint_dir
+    self._checkpoint_param = checkpoint_param
+    self._restore_param = restore_param
+    self._quantile = quantile
+    if min_peers is None:
+      min_peers = min(population_size, int(np.ceil(2.0 / quantile)))
+    self._min_peers = min_peers
+    self._resample_prob = resample_prob
+    self._perturb_factors = perturb_factors
+
+    # for every member: its parameters, the generation it started from
+    # (restored members continue from the generation of their donor) and the
+    # last generation it reported
+    self._members = {}
+    self._first_gen = {}
+    self._compared = {}
+    # results of every generation of all members, for the comparisons
+    self._generations = []
+    # members that should_stop asked to stop and the ones that were stopped,
+    # with the generation they were stopped at
+    self._stopping = {}
+    self._stopped = {}
+    self._finished = set()
+    self._evals_count = 0
+
+  def _perturb(self, params: Mapping) -> dict:
+    """Returns the explored copy of ``params``: every parameter is either
+    resampled or multiplied by one of the ``perturb_factors`` ("values"
+    parameters are shifted to a neighbouring value instead).
+    """
+    new_params = {}
+    for pm_name, pm_dict in self._params_to_tune.items():
+      if np.random.uniform() < self._resample_prob:
+        new_params[pm_name] = self._sample_param(pm_name)
+      elif pm_dict["type"] == "values":
+        values = pm_dict["values"]
+        idx = (self._value_index(pm_name, params[pm_name]) +
+               np.random.choice([-1, 1]))
+        new_params[pm_name] = values[int(np.clip(idx, 0, len(values) - 1))]
+      else:
+        value = (float(params[pm_name]) *
+                 np.random.choice(self._perturb_factors))
+        new_params[pm_name] = float(np.clip(value, pm_dict["min"],
+                                            pm_dict["max"]))
+    return new_params
+
+  def _new_member(self, params: dict, restore_from=None) -> dict:
+    member = os.path.join(self._checkpoint_dir,
+                          "member_{}".format(self._evals_count))
+    self._members[member] = dict(params)
+    self._first_gen[member] = 0
+    if restore_from is not None:
+      self._first_gen[member] = self._compared[restore_from]
+      params[self._restore_param] = os.path.join(
+        restore_from, "generation_{}".format(
+          self._compared[restore_from] - self._first_gen[restore_from],
+        ),
+      )
+    self._compared[member] = self._first_gen[member]
+    params[self._checkpoint_param] = member
+    self._evals_count += 1
+    return params
+
+  def _peers(self, generation: int):
+    """Returns the members that reported the ``generation`` and their
+    results of that generation.
+    """
+    if generation > len(self._generations):
+      return [], np.zeros(0)
+    peers = self._generations[generation - 1]
+    return list(peers), np.array(list(peers.values()))
+
+  def gen_initial_params(self) -> Iterable[Mapping]:
+    init_params = super().gen_initial_params()
+    params = []
+    if init_params is not None:
+      for cur_params in init_params:
+        # the parameters that are not specified are sampled
+        member_params = self._sample_params()
+        member_params.update(cur_params)
+        params.append(self._new_member(member_params))
+    num_random = min(self._num_evals, self._population_size) - len(params)
+    params += [self._new_member(self._sample_params())
+               for _ in range(max(num_random, 0))]
+    return params
+
+  def should_stop(self,
+                  params: Mapping,
+                  intermediate_results: Iterable[float]) -> bool:
+    member = params.get(self._checkpoint_param)
+    if member not in self._compared:
+      return False
+    results = list(intermediate_results)
+    if self._objective == "maximize":
+      results = [-result for result in results]
+    first_gen = self._first_gen[member]
+    generation = first_gen + len(results)
+    if generation <= self._compared[member]:
+      return False
+    # recording all generations, including the ones between the polls
+    for cur_gen in range(self._compared[member] + 1, generation + 1):
+      while cur_gen > len(self._generations):
+        self._generations.append({})
+      self._generations[cur_gen - 1][member] = results[cur_gen - first_gen - 1]
+    self._compared[member] = generation
+
+    peers, values = self._peers(generation)
+    if len(peers) < self._min_peers:
+      return False
+    num_worse = np.sum(values > results[-1])
+    if num_worse >= len(peers) * self._quantile:
+      return False
+    # the job might keep running if it can't be killed
+    self._stopping[member] = generation
+    return True
+
+  def record_early_stop(self, params: Mapping) -> None:
+    member = params.get(self._checkpoint_param)
+    if member in self._stopping:
+      self._stopped[member] = self._stopping.pop(member)
+
+  def gen_new_params(self,
+                     result: float,
+                     params: Mapping,
+                     evaluation_succeeded: bool) -> Iterable[Optional[Mapping]]:
+    if self._evals_count == self._num_evals:
+      return [None]
+    member = params.get(self._checkpoint_param)
+    self._stopping.pop(member, None)
+    if member not in self._stopped:
+      self._finished.add(member)
+      return [self._new_member(self._sample_params())]
+
+    # exploiting one of the best members and exploring around it, members
+    # that have finished training can't be trained any further
+    peers, values = self._peers(self._stopped.pop(member))
+    num_top = max(1, int(np.floor(len(peers) * self._quantile)))
+    top = [peers[idx] for idx in np.argsort(values, kind='stable')[:num_top]
+           if peers[idx] not in self._finished]
+    if not top:
+      return [self._new_member(self._sample_params())]
+    donor = top[np.random.randint(len(top))]
+    return [self._new_member(self._perturb(self._members[donor]),
+                             restore_from=donor)]
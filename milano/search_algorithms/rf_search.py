@@ -0,0 +1,470 @@
+# Copyright (c) 2018 NVIDIA Corporation
+import multiprocessing
+import numpy as np
+from scipy.special import ndtr
+from typing import Iterable, Mapping, Optional, Tuple
+
+from .base import SearchAlgorithm
+
+
+class RFSearch(SearchAlgorithm):
+  """Random forest surrogate search (SMAC).
+
+  A random forest of regression trees is fitted to the completed jobs.
+  "range" and "log_range" parameters are split by thresholds in linear and
+  logarithmic space respectively, "values" parameters by subsets of their
+  values, so they don't have to be embedded in a continuous space. The
+  mean and the variance of the trees' predictions give the expected
+  improvement, which is maximized by local search starting from the best
+  completed jobs and random points. With probability ``random_prob`` the
+  job is random instead.
+
+  The forest is updated incrementally: every result is added to the
+  leaves of all trees with a random bootstrap weight and only
+  ``num_rebuilt_trees`` trees are grown from scratch, which is done in a
+  pool of ``num_processes`` worker processes. Running jobs are assumed to
+  get the worst result observed so far, so that the workers don't all get
+  the same suggestion.
+  """
+  PENDING_STATUS = 0
+  COMPLETE_STATUS = 1
+  FAILED_STATUS = 2
+
+  def __init__(self,
+               params_to_tune: Mapping,
+               params_to_try_first: Mapping,
+               objective: str,
+               num_evals: int,
+               random_seed: int = None,
+               num_init_jobs=1,
+               num_jobs_to_launch_each_time=1,
+               num_startup_jobs=10,
+               num_trees=10,
+               num_rebuilt_trees=None,
+               max_features=5.0 / 6.0,
+               min_samples_split=3,
+               num_local_searches=10,
+               num_random_starts=10,
+               max_local_steps=20,
+               random_prob=0.2,
+               num_processes=1) -> None:
+    super().__init__(params_to_tune, params_to_try_first,
+                     objective, num_evals, random_seed)
+    self._num_init_jobs = num_init_jobs
+    self._num_jobs_to_launch_each_time = num_jobs_to_launch_each_time
+    self._num_startup_jobs = num_startup_jobs
+    self._num_trees = num_trees
+    if num_rebuilt_trees is None:
+      num_rebuilt_trees = max(num_trees // 5, num_processes)
+    self._num_rebuilt_trees = min(num_rebuilt_trees, num_trees)
+    self._max_features = max_features
+    self._min_samples_split = min_samples_split
+    self._num_local_searches = num_local_searches
+    self._num_random_starts = num_random_starts
+    self._max_local_steps = max_local_steps
+    self._random_prob = random_prob
+    self._num_processes = num_processes
+    self._pool = None
+
+    # "range" and "log_range" parameters are mapped to [0, 1] in linear and
+    # logarithmic space respectively, "values" parameters to value indices
+    self._pm_names = list(self._params_to_tune)
+    self._low, self._high, self._is_log = self._param_bounds(self._pm_names)
+    self._num_values = np.array([
+      len(self._params_to_tune[pm_name]["values"])
+      if self._params_to_tune[pm_name]["type"] == "values" else 0
+      for pm_name in self._pm_names
+    ], dtype=int)
+    self._is_cat = self._num_values > 0
+
+    max_jobs = num_evals + max(self._pre_configs_counter, 0)
+    self._x = np.zeros((max_jobs, len(self._pm_names)))
+    self._values = np.zeros(max_jobs) + np.inf
+    self._status = np.zeros(max_jobs, dtype=int) + RFSearch.PENDING_STATUS
+    self._num_jobs = 0
+
+    self._trees = []
+    # completed jobs that haven't been added to the forest yet
+    self._new_jobs = []
+    self._next_rebuilt = 0
+
+    self._evals_count = 0
+
+  def _add_job(self, params: Mapping) -> None:
+    # jobs that don't specify all parameters can't be used by the model
+    job_id = None
+    if self._has_all_params(params):
+      job_id = self._num_jobs
+      self._num_jobs += 1
+      for i, pm_name in enumerate(self._pm_names):
+        if self._is_cat[i]:
+          self._x[job_id, i] = self._value_index(pm_name, params[pm_name])
+        else:
+          value = float(params[pm_name])
+          if self._is_log[i]:
+            value = np.log(value)
+          self._x[job_id, i] = ((value - self._low[i]) /
+                                (self._high[i] - self._low[i]))
+    self._add_job_id(params, job_id)
+
+  def _get_pool(self):
+    if self._pool is None:
+      self._pool = multiprocessing.get_context("spawn").Pool(
+        self._num_processes
+      )
+    return self._pool
+
+  def _training_values(self, values):
+    # results of the jobs that violated constraints are infinite, they are
+    # modeled as the worst finite result
+    finite = self._values[self._status == RFSearch.COMPLETE_STATUS]
+    finite = finite[np.isfinite(finite)]
+    worst = np.max(finite) if finite.shape[0] > 0 else 0.0
+    return np.where(np.isfinite(values), values, worst)
+
+  def _update_forest(self) -> None:
+    """Adds the new results to the leaves of the trees and grows
+    ``num_rebuilt_trees`` of them again (all of them the first time).
+    """
+    complete = np.nonzero(self._status == RFSearch.COMPLETE_STATUS)[0]
+    x = self._x[complete]
+    y = self._training_values(self._values[complete])
+    if self._trees:
+      new_jobs = np.array(self._new_jobs, dtype=int)
+      new_y = self._training_values(self._values[new_jobs])
+      for tree in self._trees:
+        weights = np.random.poisson(1.0, size=new_jobs.shape[0])
+        _add_to_leaves(tree, self._x[new_jobs], new_y, weights,
+                       self._num_values)
+      rebuilt = [(self._next_rebuilt + i) % self._num_trees
+                 for i in range(self._num_rebuilt_trees)]
+      self._next_rebuilt = (rebuilt[-1] + 1) % self._num_trees
+    else:
+      rebuilt = list(range(self._num_trees))
+      self._trees = [None] * self._num_trees
+    self._new_jobs = []
+
+    # every tree is fitted to a Poisson bootstrap of the completed jobs, the
+    # same as the weights of the results added to the leaves
+    num_features = max(1, int(np.ceil(self._max_features * x.shape[1])))
+    args = [(x, y, np.random.poisson(1.0, size=x.shape[0]), self._num_values,
+             num_features, self._min_samples_split,
+             np.random.randint(2 ** 31 - 1)) for _ in rebuilt]
+    if self._num_processes > 1 and len(args) > 1:
+      trees = self._get_pool().starmap(_build_tree, args)
+    else:
+      trees = [_build_tree(*cur_args) for cur_args in args]
+    for tree_id, tree in zip(rebuilt, trees):
+      self._trees[tree_id] = tree
+
+  def _predict(self, x: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the mean and the variance of the forest's prediction: the
+    variance of the tree means plus the average variance of their leaves.
+    """
+    means = np.zeros((len(self._trees), x.shape[0]))
+    second_moments = np.zeros((len(self._trees), x.shape[0]))
+    for i, tree in enumerate(self._trees):
+      leaves = _route(tree, x, self._num_values)
+      weights = tree["leaf_w"][leaves]
+      means[i] = tree["leaf_s"][leaves] / weights
+      second_moments[i] = np.maximum(tree["leaf_q"][leaves] / weights,
+                                     means[i] ** 2)
+    mean = np.mean(means, axis=0)
+    return mean, np.maximum(np.mean(second_moments, axis=0) - mean ** 2, 0.0)
+
+  def _expected_improvement(self, x: np.ndarray, best: float) -> np.ndarray:
+    mean, var = self._predict(x)
+    sigma = np.sqrt(var) + 1e-12
+    z = (best - mean) / sigma
+    return sigma * (z * ndtr(z) + np.exp(-0.5 * z ** 2) / np.sqrt(2 * np.pi))
+
+  def _sample_random(self, num_points: int) -> np.ndarray:
+    x = np.random.uniform(size=(num_points, len(self._pm_names)))
+    cats = np.nonzero(self._is_cat)[0]
+    x[:, cats] = np.floor(x[:, cats] * self._num_values[cats])
+    return x
+
+  def _neighbours(self, x: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the neighbours of every row of ``x``, which differ from it in
+    a single parameter: four Gaussian steps of every continuous parameter
+    and all other values of every "values" parameter, along with the index
+    of the row they come from.
+    """
+    neighbours = []
+    for i in range(x.shape[1]):
+      if self._is_cat[i]:
+        for step in range(1, self._num_values[i]):
+          cur = x.copy()
+          cur[:, i] = (cur[:, i] + step) % self._num_values[i]
+          neighbours.append(cur)
+      else:
+        for _ in range(4):
+          cur = x.copy()
+          cur[:, i] = np.clip(cur[:, i] + np.random.normal(0.0, 0.2, x.shape[0]),
+                              0.0, 1.0)
+          neighbours.append(cur)
+    owners = np.tile(np.arange(x.shape[0]), len(neighbours))
+    return np.vstack(neighbours), owners
+
+  def _local_search(self, best: float) -> np.ndarray:
+    """Maximizes expected improvement by moving every starting point to its
+    best neighbour while that improves it.
+    """
+    complete = np.nonzero(self._status == RFSearch.COMPLETE_STATUS)[0]
+    order = np.argsort(self._values[complete], kind='stable')
+    x = np.vstack([self._x[complete[order[:self._num_local_searches]]],
+                   self._sample_random(self._num_random_starts)])
+    ei = self._expected_improvement(x, best)
+    active = np.arange(x.shape[0])
+    for _ in range(self._max_local_steps):
+      neighbours, owners = self._neighbours(x[active])
+      neighbours_ei = self._expected_improvement(neighbours, best)
+      # the best neighbour of every point: the first one of its group after
+      # sorting by point and decreasing expected improvement
+      order = np.lexsort((-neighbours_ei, owners))
+      first = order[np.r_[True, owners[order][1:] != owners[order][:-1]]]
+      improved = neighbours_ei[first] > ei[active] * (1.0 + 1e-6)
+      if not np.any(improved):
+        break
+      moved = active[improved]
+      x[moved] = neighbours[first[improved]]
+      ei[moved] = neighbours_ei[first[improved]]
+      active = moved
+    return x[np.argmax(ei)]
+
+  def _params_from_x(self, x: np.ndarray) -> dict:
+    params = {}
+    for i, pm_name in enumerate(self._pm_names):
+      pm_dict = self._params_to_tune[pm_name]
+      if self._is_cat[i]:
+        params[pm_name] = pm_dict["values"][int(x[i])]
+      else:
+        value = self._low[i] + x[i] * (self._high[i] - self._low[i])
+        if self._is_log[i]:
+          value = np.exp(value)
+        params[pm_name] = float(np.clip(value, pm_dict["min"], pm_dict["max"]))
+    return params
+
+  def _get_new_points(self, num_points: int) -> Iterable[Mapping]:
+    complete = np.nonzero(self._status == RFSearch.COMPLETE_STATUS)[0]
+    use_model = (complete.shape[0] >= max(self._num_startup_jobs, 2) and
+                 num_points > 0)
+    if use_model:
+      self._update_forest()
+      values = self._training_values(self._values[complete])
+      best, worst = np.min(values), np.max(values)
+      # the lies for the running jobs are removed after the suggestions
+      saved = [(tree["leaf_w"].copy(), tree["leaf_s"].copy(),
+                tree["leaf_q"].copy()) for tree in self._trees]
+      pending = np.nonzero(
+        self._status[:self._num_jobs] == RFSearch.PENDING_STATUS
+      )[0]
+      self._add_lies(self._x[pending], worst)
+
+    params = []
+    for _ in range(num_points):
+      if use_model and np.random.uniform() >= self._random_prob:
+        x = self._local_search(best)
+      else:
+        x = self._sample_random(1)[0]
+      if use_model:
+        self._add_lies(x[None], worst)
+      params.append(self._params_from_x(x))
+      self._add_job(params[-1])
+      self._evals_count += 1
+
+    if use_model:
+      for tree, (leaf_w, leaf_s, leaf_q) in zip(self._trees, saved):
+        tree["leaf_w"], tree["leaf_s"], tree["leaf_q"] = leaf_w, leaf_s, leaf_q
+    return params
+
+  def _add_lies(self, x: np.ndarray, value: float) -> None:
+    for tree in self._trees:
+      _add_to_leaves(tree, x, np.zeros(x.shape[0]) + value,
+                     np.ones(x.shape[0]), self._num_values)
+
+  def _add_result(self,
+                  result: float,
+                  params: Mapping,
+                  evaluation_succeeded: bool) -> None:
+    job_id = self._pop_job_id(params)
+    if job_id is None:
+      return
+    if evaluation_succeeded:
+      self._status[job_id] = RFSearch.COMPLETE_STATUS
+      if self._objective == "maximize":
+        result = -result
+      self._values[job_id] = result
+      self._new_jobs.append(job_id)
+    else:
+      self._status[job_id] = RFSearch.FAILED_STATUS
+
+  def gen_initial_params(self) -> Iterable[Mapping]:
+    init_params = super().gen_initial_params()
+    if init_params is not None:
+      for params in init_params:
+        self._add_job(params)
+
+    params = self._get_new_points(min(self._num_evals, self._num_init_jobs))
+
+    if init_params is not None:
+      return init_params + params
+    else:
+      return params
+
+  def gen_new_params(self,
+                     result: float,
+                     params: Mapping,
+                     evaluation_succeeded: bool) -> Iterable[Optional[Mapping]]:
+    if self._evals_count == self._num_evals:
+      return [None]
+    self._add_result(result, params, evaluation_succeeded)
+    return self._get_new_points(min(self._num_jobs_to_launch_each_time,
+                                    self._num_evals - self._evals_count))
+
+  def gen_new_params_batch(
+    self,
+    results: Iterable[Tuple[float, Mapping, bool]],
+  ) -> Iterable[Optional[Mapping]]:
+    if self._evals_count == self._num_evals:
+      return [None]
+    results = list(results)
+    for result, params, evaluation_succeeded in results:
+      self._add_result(result, params, evaluation_succeeded)
+    # the forest is updated once for all the results
+    num_points = min(self._num_jobs_to_launch_each_time * len(results),
+                     self._num_evals - self._evals_count)
+    return self._get_new_points(num_points)
+
+  def close(self) -> None:
+    if self._pool is not None:
+      self._pool.close()
+      self._pool.join()
+      self._pool = None
+
+
+def _build_tree(x, y, weights, num_values, num_features, min_samples_split,
+                seed):
+  """Grows a regression tree on the rows of ``x`` with positive ``weights``.
+  Columns with positive ``num_values`` hold value indices and are split by
+  subsets of values: the values are ordered by their mean result, which
+  gives the best subset, and values that don't reach the node go to a
+  random side. Other columns are split by thresholds. Every split is the
+  best one among ``num_features`` random columns. Returns the nodes as a
+  dictionary of arrays.
+  """
+  rng = np.random.RandomState(seed)
+  used = weights > 0
+  if not np.any(used):
+    used[:], weights = True, np.ones(weights.shape[0])
+  x, y, weights = x[used], y[used], weights[used].astype(float)
+  max_values = max(1, np.max(num_values)) if num_values.shape[0] > 0 else 1
+  feature, threshold, cat_left, left, right = [], [], [], [], []
+  leaf_w, leaf_s, leaf_q = [], [], []
+
+  def new_node(idx):
+    feature.append(-1)
+    threshold.append(0.0)
+    cat_left.append(np.zeros(max_values, dtype=bool))
+    left.append(-1)
+    right.append(-1)
+    w = weights[idx]
+    leaf_w.append(np.sum(w))
+    leaf_s.append(np.sum(w * y[idx]))
+    leaf_q.append(np.sum(w * y[idx] ** 2))
+    return len(feature) - 1
+
+  stack = [(new_node(np.arange(x.shape[0])), np.arange(x.shape[0]))]
+  while stack:
+    node, idx = stack.pop()
+    if idx.shape[0] < min_samples_split or np.ptp(y[idx]) == 0:
+      continue
+    w, wy = weights[idx], weights[idx] * y[idx]
+    total_w, total_s = np.sum(w), np.sum(wy)
+    best_score, best_split = total_s ** 2 / total_w * (1.0 + 1e-12), None
+    for f in rng.choice(x.shape[1], num_features, replace=False):
+      if num_values[f] > 0:
+        # values are sorted by their mean result and split like a threshold
+        cats = x[idx, f].astype(int)
+        cat_w = np.bincount(cats, w, minlength=num_values[f])
+        cat_s = np.bincount(cats, wy, minlength=num_values[f])
+        present = np.nonzero(cat_w > 0)[0]
+        if present.shape[0] < 2:
+          continue
+        order = present[np.argsort(cat_s[present] / cat_w[present],
+                                   kind='stable')]
+        cum_w, cum_s = np.cumsum(cat_w[order])[:-1], np.cumsum(cat_s[order])[:-1]
+      else:
+        order = np.argsort(x[idx, f], kind='stable')
+        xs = x[idx[order], f]
+        valid = np.nonzero(xs[1:] > xs[:-1])[0]
+        if valid.shape[0] == 0:
+          continue
+        cum_w = np.cumsum(w[order])[valid]
+        cum_s = np.cumsum(wy[order])[valid]
+      # minimizing the weighted squared error is maximizing this score
+      score = cum_s ** 2 / cum_w + (total_s - cum_s) ** 2 / (total_w - cum_w)
+      split = np.argmax(score)
+      if score[split] > best_score:
+        best_score = score[split]
+        if num_values[f] > 0:
+          best_split = (f, None, order[:split + 1])
+        else:
+          best_split = (f, 0.5 * (xs[valid[split]] + xs[valid[split] + 1]),
+                        None)
+    if best_split is None:
+      continue
+
+    f, thr, left_values = best_split
+    feature[node] = f
+    if left_values is not None:
+      cat_left[node][:num_values[f]] = rng.uniform(size=num_values[f]) < 0.5
+      cat_left[node][np.unique(x[idx, f].astype(int))] = False
+      cat_left[node][left_values] = True
+      go_left = cat_left[node][x[idx, f].astype(int)]
+    else:
+      threshold[node] = thr
+      go_left = x[idx, f] <= thr
+    for is_left in (True, False):
+      child_idx = idx[go_left == is_left]
+      child = new_node(child_idx)
+      if is_left:
+        left[node] = child
+      else:
+        right[node] = child
+      stack.append((child, child_idx))
+
+  return {
+    "feature": np.array(feature, dtype=int),
+    "threshold": np.array(threshold),
+    "cat_left": np.array(cat_left),
+    "left": np.array(left, dtype=int),
+    "right": np.array(right, dtype=int),
+    "leaf_w": np.array(leaf_w),
+    "leaf_s": np.array(leaf_s),
+    "leaf_q": np.array(leaf_q),
+  }
+
+
+def _route(tree, x, num_values):
+  """Returns the leaf of ``tree`` every row of ``x`` falls into."""
+  nodes = np.zeros(x.shape[0], dtype=int)
+  active = np.nonzero(tree["feature"][nodes] >= 0)[0]
+  max_values = tree["cat_left"].shape[1]
+  while active.shape[0] > 0:
+    cur = nodes[active]
+    f = tree["feature"][cur]
+    vals = x[active, f]
+    cats = np.clip(vals.astype(int), 0, max_values - 1)
+    go_left = np.where(num_values[f] > 0, tree["cat_left"][cur, cats],
+                       vals <= tree["threshold"][cur])
+    nodes[active] = np.where(go_left, tree["left"][cur], tree["right"][cur])
+    active = active[tree["feature"][nodes[active]] >= 0]
+  return nodes
+
+
+def _add_to_leaves(tree, x, y, weights, num_values):
+  leaves = _route(tree, x, num_values)
+  np.add.at(tree["leaf_w"], leaves, weights)
+  np.add.at(tree["leaf_s"], leaves, weights * y)
+  np.add.at(tree["leaf_q"], leaves, weights * y ** 2)
@@ -0,0 +1,304 @@
+# Copyright (c) 2018 NVIDIA Corporation
+import numpy as np
+from scipy.special import ndtr, ndtri
+from typing import Iterable, Mapping, Optional
+
+from .base import SearchAlgorithm
+
+
+class TPESearch(SearchAlgorithm):
+  """Tree-structured Parzen Estimator search.
+
+  The completed jobs are split into the ``good`` and the ``bad`` ones by
+  their result. For every parameter, a Parzen estimator (a mixture of
+  truncated Gaussians for "range" and "log_range" parameters, a smoothed
+  histogram for "values" parameters) is fitted to each of the two sets.
+  New jobs are drawn from the ``good`` densities and the candidate with the
+  largest ratio of the ``good`` to the ``bad`` density is evaluated.
+  Estimators of sets larger than ``num_bins`` are fitted to histograms
+  of every parameter with ``num_bins`` bins, so the cost of a suggestion
+  is linear in the number of completed jobs.
+  """
+  PENDING_STATUS = 0
+  COMPLETE_STATUS = 1
+  FAILED_STATUS = 2
+
+  def __init__(self,
+               params_to_tune: Mapping,
+               params_to_try_first: Mapping,
+               objective: str,
+               num_evals: int,
+               random_seed: int = None,
+               num_init_jobs=1,
+               num_jobs_to_launch_each_time=1,
+               num_startup_jobs=10,
+               gamma=0.1,
+               max_good_jobs=25,
+               num_candidates=24,
+               prior_weight=1.0,
+               constant_liar=True,
+               num_bins=1000) -> None:
+    super().__init__(params_to_tune, params_to_try_first,
+                     objective, num_evals, random_seed)
+    self._num_init_jobs = num_init_jobs
+    self._num_jobs_to_launch_each_time = num_jobs_to_launch_each_time
+    self._num_startup_jobs = num_startup_jobs
+    self._gamma = gamma
+    self._max_good_jobs = max_good_jobs
+    self._num_candidates = num_candidates
+    self._prior_weight = prior_weight
+    # running jobs are counted as bad ones, so that the workers don't all
+    # get the same suggestion
+    self._constant_liar = constant_liar
+    self._num_bins = num_bins
+
+    # "range" and "log_range" parameters are modeled in linear and
+    # logarithmic space respectively, "values" parameters by value index
+    self._cont_names, self._cat_names = [], []
+    for pm_name, pm_dict in self._params_to_tune.items():
+      if pm_dict["type"] == "values":
+        self._cat_names.append(pm_name)
+      else:
+        self._cont_names.append(pm_name)
+    self._low, self._high, self._is_log = self._param_bounds(self._cont_names)
+    self._num_values = np.array([
+      len(self._params_to_tune[pm_name]["values"])
+      for pm_name in self._cat_names
+    ], dtype=int)
+
+    max_jobs = num_evals + max(self._pre_configs_counter, 0)
+    self._x = np.zeros((max_jobs, len(self._cont_names)))
+    self._c = np.zeros((max_jobs, len(self._cat_names)), dtype=int)
+    self._values = np.zeros(max_jobs) + np.inf
+    self._status = np.zeros(max_jobs, dtype=int) + TPESearch.PENDING_STATUS
+    self._num_jobs = 0
+
+    self._evals_count = 0
+
+  def _add_job(self, params: Mapping) -> None:
+    # jobs that don't specify all parameters can't be used by the model
+    job_id = None
+    if self._has_all_params(params):
+      job_id = self._num_jobs
+      self._num_jobs += 1
+      for i, pm_name in enumerate(self._cont_names):
+        self._x[job_id, i] = float(params[pm_name])
+        if self._is_log[i]:
+          self._x[job_id, i] = np.log(self._x[job_id, i])
+      for i, pm_name in enumerate(self._cat_names):
+        self._c[job_id, i] = self._value_index(pm_name, params[pm_name])
+    self._add_job_id(params, job_id)
+
+  def _fit_parzen(self, x):
+    """Returns the means, standard deviations, normalized weights and masses
+    inside the bounds of the Parzen estimator fitted to the rows of ``x``, one
+    row of components per continuous parameter. The last component is the
+    prior: a wide Gaussian centered in the middle of the bounds.
+    """
+    num_points, num_dims = x.shape
+    prior_mu = 0.5 * (self._low + self._high)
+    prior_sigma = self._high - self._low
+    min_sigma = prior_sigma / min(100.0, 1.0 + num_points)
+    if num_points > self._num_bins:
+      mus, sigmas, weights = self._fit_bins(x, min_sigma)
+    else:
+      mus = np.sort(x.T, axis=1)
+      padded = np.hstack([self._low[:, None], mus, self._high[:, None]])
+      # bandwidth is the distance to the farthest of the two neighbours
+      sigmas = np.maximum(padded[:, 1:-1] - padded[:, :-2],
+                          padded[:, 2:] - padded[:, 1:-1])
+      weights = np.ones((num_dims, num_points))
+    sigmas = np.clip(sigmas, min_sigma[:, None], prior_sigma[:, None])
+    mus = np.hstack([mus, prior_mu[:, None]])
+    sigmas = np.hstack([sigmas, prior_sigma[:, None]])
+    weights = np.hstack([weights, np.zeros((num_dims, 1)) + self._prior_weight])
+    weights /= np.sum(weights, axis=1, keepdims=True)
+    masses = (ndtr((self._high[:, None] - mus) / sigmas) -
+              ndtr((self._low[:, None] - mus) / sigmas))
+    return mus, sigmas, weights, masses
+
+  def _fit_bins(self, x, min_sigma):
+    """Approximates the Parzen estimator components of the points in ``x``
+    using ``num_bins`` bins of every parameter, which are much narrower
+    than the smallest bandwidth. The lowest and the highest point of a bin
+    get the distance to the previous and the next occupied bin as their
+    bandwidth, the points between them get the smallest one.
+    """
+    num_dims = x.shape[1]
+    num_bins = self._num_bins
+    width = (self._high - self._low) / num_bins
+    bins = np.clip(((x - self._low) / width).astype(int), 0, num_bins - 1)
+    bins += np.arange(num_dims) * num_bins
+    counts = np.bincount(bins.ravel(), minlength=num_dims * num_bins)
+    counts = counts.reshape(num_dims, num_bins)
+    centers = self._low[:, None] + width[:, None] * (np.arange(num_bins) + 0.5)
+
+    rows = np.arange(num_dims)[:, None]
+    occupied = np.where(counts > 0, np.arange(num_bins), -1)
+    prev_bins = np.maximum.accumulate(occupied, axis=1)
+    occupied[counts == 0] = num_bins
+    next_bins = np.minimum.accumulate(occupied[:, ::-1], axis=1)[:, ::-1]
+    prev_centers = np.hstack([
+      self._low[:, None],
+      np.where(prev_bins[:, :-1] >= 0,
+               centers[rows, np.maximum(prev_bins[:, :-1], 0)],
+               self._low[:, None]),
+    ])
+    next_centers = np.hstack([
+      np.where(next_bins[:, 1:] < num_bins,
+               centers[rows, np.minimum(next_bins[:, 1:], num_bins - 1)],
+               self._high[:, None]),
+      self._high[:, None],
+    ])
+    prev_gaps = centers - prev_centers
+    next_gaps = next_centers - centers
+    low_sigmas = np.where(counts > 1, prev_gaps,
+                          np.maximum(prev_gaps, next_gaps))
+    low_weights = (counts > 0).astype(float)
+    high_weights = (counts > 1).astype(float)
+    narrow_weights = counts - low_weights - high_weights
+    # components that end up with the smallest bandwidth are merged
+    low_narrow = low_sigmas <= min_sigma[:, None]
+    high_narrow = next_gaps <= min_sigma[:, None]
+    narrow_weights += low_weights * low_narrow + high_weights * high_narrow
+    low_weights[low_narrow] = 0.0
+    high_weights[high_narrow] = 0.0
+
+    # only a few components can be wide since the gaps add up to the range
+    wide_mus = np.hstack([centers, centers])
+    wide_sigmas = np.hstack([low_sigmas, next_gaps])
+    wide_weights = np.hstack([low_weights, high_weights])
+    num_wide = np.max(np.sum(wide_weights > 0, axis=1))
+    wide = np.argsort(wide_weights == 0, axis=1, kind='stable')[:, :num_wide]
+    return (
+      np.hstack([np.take_along_axis(wide_mus, wide, axis=1), centers]),
+      np.hstack([np.take_along_axis(wide_sigmas, wide, axis=1),
+                 np.repeat(min_sigma[:, None], num_bins, axis=1)]),
+      np.hstack([np.take_along_axis(wide_weights, wide, axis=1),
+                 narrow_weights]),
+    )
+
+  def _sample_parzen(self, parzen, num_samples):
+    mus, sigmas, weights, _ = parzen
+    num_dims = mus.shape[0]
+    cum_weights = np.cumsum(weights, axis=1)
+    comps = np.array([
+      np.searchsorted(cum_weights[i], np.random.uniform(size=num_samples) *
+                      cum_weights[i, -1])
+      for i in range(num_dims)
+    ])
+    comps = np.minimum(comps, weights.shape[1] - 1)
+    rows = np.arange(num_dims)[:, None]
+    mu, sigma = mus[rows, comps], sigmas[rows, comps]
+    # inverse cdf sampling of the truncated Gaussians
+    lo = ndtr((self._low[:, None] - mu) / sigma)
+    hi = ndtr((self._high[:, None] - mu) / sigma)
+    u = np.random.uniform(size=mu.shape) * (hi - lo) + lo
+    u = np.clip(u, np.finfo(float).tiny, 1.0 - np.finfo(float).eps)
+    samples = mu + sigma * ndtri(u)
+    return np.clip(samples, self._low[:, None], self._high[:, None]).T
+
+  def _log_parzen(self, parzen, x):
+    mus, sigmas, weights, masses = parzen
+    log_pdf = np.zeros(x.shape[0])
+    coefs = weights / (np.sqrt(2.0 * np.pi) * sigmas * masses)
+    for i in range(x.shape[1]):
+      z = (x[:, i:i + 1] - mus[i]) / sigmas[i]
+      log_pdf += np.log(np.exp(-0.5 * z ** 2).dot(coefs[i]))
+    return log_pdf
+
+  def _fit_histogram(self, c):
+    """Returns the log probabilities of every value of the "values"
+    parameters given the value indices in the rows of ``c``.
+    """
+    log_probs = []
+    for i, num_values in enumerate(self._num_values):
+      counts = np.bincount(c[:, i], minlength=num_values).astype(float)
+      counts += self._prior_weight / num_values
+      log_probs.append(np.log(counts / np.sum(counts)))
+    return log_probs
+
+  def _sample_candidates(self):
+    """Returns the continuous and the "values" parts of the next job."""
+    complete = np.nonzero(self._status == TPESearch.COMPLETE_STATUS)[0]
+    if complete.shape[0] < self._num_startup_jobs:
+      x = np.random.uniform(self._low, self._high)
+      c = np.array([np.random.randint(num) for num in self._num_values],
+                   dtype=int)
+      return x, c
+
+    num_good = int(min(np.ceil(self._gamma * complete.shape[0]),
+                       self._max_good_jobs, complete.shape[0]))
+    order = np.argpartition(self._values[complete], num_good - 1)
+    good, bad = complete[order[:num_good]], complete[order[num_good:]]
+    if self._constant_liar:
+      pending = np.nonzero(
+        self._status[:self._num_jobs] == TPESearch.PENDING_STATUS
+      )[0]
+      bad = np.append(bad, pending)
+
+    score = np.zeros(self._num_candidates)
+    x = np.zeros((self._num_candidates, len(self._cont_names)))
+    c = np.zeros((self._num_candidates, len(self._cat_names)), dtype=int)
+    if self._cont_names:
+      parzen_good = self._fit_parzen(self._x[good])
+      parzen_bad = self._fit_parzen(self._x[bad])
+      x = self._sample_parzen(parzen_good, self._num_candidates)
+      score += self._log_parzen(parzen_good, x)
+      score -= self._log_parzen(parzen_bad, x)
+    if self._cat_names:
+      hist_good = self._fit_histogram(self._c[good])
+      hist_bad = self._fit_histogram(self._c[bad])
+      for i, num_values in enumerate(self._num_values):
+        c[:, i] = np.random.choice(num_values, size=self._num_candidates,
+                                   p=np.exp(hist_good[i]))
+        score += hist_good[i][c[:, i]] - hist_bad[i][c[:, i]]
+    best = np.argmax(score)
+    return x[best], c[best]
+
+  def _get_new_point(self) -> Mapping:
+    x, c = self._sample_candidates()
+    params = {}
+    for i, pm_name in enumerate(self._cont_names):
+      pm_dict = self._params_to_tune[pm_name]
+      value = np.exp(x[i]) if self._is_log[i] else x[i]
+      params[pm_name] = float(np.clip(value, pm_dict["min"], pm_dict["max"]))
+    for i, pm_name in enumerate(self._cat_names):
+      params[pm_name] = self._params_to_tune[pm_name]["values"][c[i]]
+    self._add_job(params)
+    self._evals_count += 1
+    return params
+
+  def gen_initial_params(self) -> Iterable[Mapping]:
+    init_params = super().gen_initial_params()
+    if init_params is not None:
+      for params in init_params:
+        self._add_job(params)
+
+    params = [self._get_new_point()
+              for _ in range(min(self._num_evals, self._num_init_jobs))]
+
+    if init_params is not None:
+      return init_params + params
+    else:
+      return params
+
+  def gen_new_params(self,
+                     result: float,
+                     params: Mapping,
+                     evaluation_succeeded: bool) -> Iterable[Optional[Mapping]]:
+    if self._evals_count == self._num_evals:
+      return [None]
+    job_id = self._pop_job_id(params)
+    if job_id is not None:
+      if evaluation_succeeded:
+        self._status[job_id] = TPESearch.COMPLETE_STATUS
+        if self._objective == "maximize":
+          result = -result
+        self._values[job_id] = result
+      else:
+        self._status[job_id] = TPESearch.FAILED_STATUS
+
+    num_points = min(self._num_jobs_to_launch_each_time,
+                     self._num_evals - self._evals_count)
+    return [self._get_new_point() for _ in range(num_points)]
@@ -1,5 +1,6 @@
 # Copyright (c) 2018 NVIDIA Corporation
 import argparse
+import inspect
 import runpy
 from milano.exec_utils import ExecutionManager
 
@@ -21,11 +22,24 @@ if __name__ == '__main__':
     script_to_run=config['script_to_run'],
     **config['backend_params'],
   )
+  search_algorithm_params = dict(config['search_algorithm_params'])
+  # multi-fidelity search algorithms get the fidelity parameter separately
+  if 'fidelity_params' in config:
+    if 'fidelity_params' not in inspect.signature(
+      config['search_algorithm']
+    ).parameters:
+      raise ValueError(
+        "fidelity_params is set in the config, but {} is not a "
+        "multi-fidelity search algorithm, use e.g. MFSearch".format(
+          config['search_algorithm'].__name__,
+        )
+      )
+    search_algorithm_params['fidelity_params'] = config['fidelity_params']
   search_algorithm = config['search_algorithm'](
     params_to_tune=config['params_to_tune'],
     params_to_try_first=config.get('params_to_try_first', None),
     objective=config['objective'],
-    **config['search_algorithm_params'],
+    **search_algorithm_params,
   )
   exec_mng = ExecutionManager(
     backend_manager=backend_manager,